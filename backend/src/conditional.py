@@ -0,0 +1,29 @@
+import hashlib
+from flask import current_app, jsonify, request
+
+def etag_for(*parts):
+    """ETag value derived from fields that change whenever the resource does"""
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+def tag_response(response, etag, cache_control='private, must-revalidate'):
+    """Attach a weak ETag and Cache-Control to response"""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def not_modified(etag, cache_control='private, must-revalidate'):
+    """304 response when If-None-Match already has etag, else None"""
+    if request.if_none_match.contains_weak(etag):
+        return tag_response(current_app.response_class(status=304), etag, cache_control)
+    return None
+
+def conditional_response(etag, build_payload):
+    """304 when If-None-Match already has etag, else jsonify(build_payload())
+
+    build_payload is only called on a miss, so unchanged resources skip
+    serialization as well as the body transfer.
+    """
+    response = not_modified(etag)
+    if response is None:
+        response = tag_response(jsonify(build_payload()), etag)
+    return response
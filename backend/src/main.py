@@ -1,17 +1,31 @@
 import os
 import sys
+import re
+import sqlite3
+import threading
+import time
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
+from decimal import Decimal
+from cachetools import TTLCache
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from whitenoise import WhiteNoise
+import orjson
+import redis
 
 # Import all models
 from src.models.user import db, User, Branch, Category, Supplier, Product, Customer
 from src.models.inventory import Inventory, StockMovement, PurchaseOrder, PurchaseOrderItem
-from src.models.sales import Sale, SaleItem, LoyaltyTransaction, SystemSetting, AuditLog
+from src.models.sales import Sale, SaleItem, SalesDaily, LoyaltyTransaction, SystemSetting, AuditLog
+from src.response_cache import ResponseCache
+from src.migrations import create_index, upgrade_schema
 
 # Import all routes
 from src.routes.auth import auth_bp
@@ -25,7 +39,32 @@ from src.routes.purchase import purchase_bp
 from src.routes.reports import reports_bp
 from src.routes.settings import settings_bp
 
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson; datetimes and Decimals need no pre-conversion"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding to str
+        # in dumps() and having Werkzeug encode it again
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype='application/json')
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+app.json = ORJSONProvider(app)
+
+# Vite build output carries a content hash, e.g. /assets/index-4f3a9c1b.js
+HASHED_ASSET_RE = re.compile(r'^/assets/.+-[0-9A-Za-z_-]{8,}\.\w+$')
 
 # Configuration
 app.config['SECRET_KEY'] = 'pos-inventory-secret-key-change-in-production'
@@ -33,11 +72,90 @@ app.config['JWT_SECRET_KEY'] = 'jwt-secret-string-change-in-production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
-# Enable CORS for all routes
-CORS(app, origins="*")
+# Enable CORS for the API; ALLOWED_ORIGINS is a comma-separated list, "*" in development
+CORS(
+    app,
+    resources={r"/api/*": {"origins": os.environ.get('ALLOWED_ORIGINS', '*').split(',')}},
+    max_age=86400
+)
+
+class CachedJWTManager(JWTManager):
+    """JWTManager that reuses decoded claims for recently seen tokens"""
+
+    # Within one request flask-jwt-extended already keeps the decoded token on
+    # g, so get_jwt()/get_jwt_identity() never re-parse it; this cache only
+    # saves the decode across requests that carry the same token.
+
+    def __init__(self, app=None, maxsize=10000, ttl=60, min_remaining=5):
+        self._decoded_tokens = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._decoded_tokens_lock = threading.Lock()
+        self._min_remaining = min_remaining
+        super().__init__(app)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        key = (encoded_token, csrf_value, allow_expired)
+        with self._decoded_tokens_lock:
+            claims = self._decoded_tokens.get(key)
+        # Tokens close to expiry are decoded again so expiration is still enforced
+        if claims is not None and claims.get('exp', 0) - time.time() > self._min_remaining:
+            return claims
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        with self._decoded_tokens_lock:
+            self._decoded_tokens[key] = claims
+        return claims
+
+class TokenBlocklist:
+    """Revoked token ids and per-user revocations; kept in Redis when REDIS_URL is set, else in process memory"""
+
+    def __init__(self, redis_url=None):
+        self._redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self._local = TTLCache(maxsize=100000, ttl=app.config['JWT_REFRESH_TOKEN_EXPIRES'].total_seconds())
+        self._local_lock = threading.Lock()
+
+    def revoke(self, jti, expires_at):
+        # Only needs to outlive the token itself
+        ttl = max(int(expires_at - time.time()), 1)
+        if self._redis is not None:
+            self._redis.setex(f'jti:{jti}', ttl, 1)
+        else:
+            with self._local_lock:
+                self._local[jti] = True
+
+    def revoke_user(self, user_id):
+        """Revoke every token issued to user_id so far, e.g. after a role change"""
+        # Tokens carry the role claim, so they must not outlive a change to it
+        ttl = int(app.config['JWT_REFRESH_TOKEN_EXPIRES'].total_seconds())
+        # Whole seconds, like the tokens' iat
+        revoked_at = int(time.time())
+        if self._redis is not None:
+            self._redis.setex(f'user:{user_id}', ttl, revoked_at)
+        else:
+            with self._local_lock:
+                self._local[f'user:{user_id}'] = revoked_at
+
+    def is_revoked(self, jti, user_id=None, issued_at=None):
+        if self._redis is not None:
+            token_revoked, revoked_at = self._redis.mget(f'jti:{jti}', f'user:{user_id}')
+        else:
+            with self._local_lock:
+                token_revoked = jti in self._local
+                revoked_at = self._local.get(f'user:{user_id}')
+        if token_revoked:
+            return True
+        # A token issued in the revocation's second counts as issued after it, so
+        # logging in again straight after a role change works
+        return revoked_at is not None and issued_at is not None and issued_at < int(revoked_at)
 
 # Initialize JWT
-jwt = JWTManager(app)
+jwt = CachedJWTManager(app)
+app.extensions['token_blocklist'] = TokenBlocklist(os.environ.get('REDIS_URL'))
+app.extensions['response_cache'] = ResponseCache(os.environ.get('REDIS_URL'))
+
+@jwt.token_in_blocklist_loader
+def check_token_revoked(jwt_header, jwt_payload):
+    return app.extensions['token_blocklist'].is_revoked(
+        jwt_payload['jti'], jwt_payload.get('sub'), jwt_payload.get('iat')
+    )
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -52,13 +170,53 @@ app.register_blueprint(reports_bp, url_prefix='/api/reports')
 app.register_blueprint(settings_bp, url_prefix='/api/settings')
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool sized for concurrent POS terminals; tune per deployment, e.g. lower behind pgbouncer
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 20)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 40)),
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    'insertmanyvalues_page_size': 1000,
+    # Each optional-filter combination of a report is its own cache entry
+    'query_cache_size': 1200
+}
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'check_same_thread': False, 'timeout': 30}
+elif app.config['SQLALCHEMY_DATABASE_URI'].startswith(('postgresql://', 'postgresql+psycopg2://')):
+    # INSERTs already batch through insertmanyvalues; this also batches
+    # executemany UPDATE/DELETE via psycopg2's execute_batch
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['executemany_mode'] = 'values_plus_batch'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['executemany_batch_page_size'] = 1000
 db.init_app(app)
 
-# Create tables and seed data
-with app.app_context():
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL and relaxed fsync on SQLite connections"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-64000')
+    cursor.close()
+
+def seed_database():
+    """Create tables and seed default data"""
+    # create_all adds missing tables but neither changes existing ones nor adds
+    # indexes declared after a table was created, so existing databases get those here
     db.create_all()
+    with db.engine.begin() as connection:
+        upgrade_schema(connection)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                create_index(connection, index)
     
     # Create default admin user if not exists
     admin_user = User.query.filter_by(username='admin').first()
@@ -86,33 +244,52 @@ with app.app_context():
     
     # Create default categories if not exist
     if Category.query.count() == 0:
-        categories = [
-            Category(category_name='Electronics', description='Electronic devices and accessories'),
-            Category(category_name='Clothing', description='Apparel and fashion items'),
-            Category(category_name='Food & Beverages', description='Food and drink products'),
-            Category(category_name='Home & Garden', description='Home improvement and garden supplies'),
-            Category(category_name='Books & Media', description='Books, movies, and media products')
-        ]
-        for category in categories:
-            db.session.add(category)
+        db.session.execute(insert(Category), [
+            {'category_name': 'Electronics', 'description': 'Electronic devices and accessories'},
+            {'category_name': 'Clothing', 'description': 'Apparel and fashion items'},
+            {'category_name': 'Food & Beverages', 'description': 'Food and drink products'},
+            {'category_name': 'Home & Garden', 'description': 'Home improvement and garden supplies'},
+            {'category_name': 'Books & Media', 'description': 'Books, movies, and media products'}
+        ])
     
     # Create default system settings if not exist
     if SystemSetting.query.count() == 0:
-        settings = [
-            SystemSetting(setting_key='TAX_RATE', setting_value='10.00', description='Default tax rate percentage'),
-            SystemSetting(setting_key='CURRENCY', setting_value='USD', description='System currency'),
-            SystemSetting(setting_key='LOYALTY_POINTS_RATE', setting_value='1.00', description='Points earned per dollar spent'),
-            SystemSetting(setting_key='LOW_STOCK_THRESHOLD', setting_value='10', description='Default low stock alert threshold'),
-            SystemSetting(setting_key='RECEIPT_FOOTER', setting_value='Thank you for your business!', description='Receipt footer message'),
-            SystemSetting(setting_key='COMPANY_NAME', setting_value='Your Company Name', description='Company name for receipts'),
-            SystemSetting(setting_key='COMPANY_ADDRESS', setting_value='123 Main St, City, State 12345', description='Company address'),
-            SystemSetting(setting_key='COMPANY_PHONE', setting_value='(555) 123-4567', description='Company phone number')
-        ]
-        for setting in settings:
-            db.session.add(setting)
+        db.session.execute(insert(SystemSetting), [
+            {'setting_key': 'TAX_RATE', 'setting_value': '10.00', 'description': 'Default tax rate percentage'},
+            {'setting_key': 'CURRENCY', 'setting_value': 'USD', 'description': 'System currency'},
+            {'setting_key': 'LOYALTY_POINTS_RATE', 'setting_value': '1.00', 'description': 'Points earned per dollar spent'},
+            {'setting_key': 'LOW_STOCK_THRESHOLD', 'setting_value': '10', 'description': 'Default low stock alert threshold'},
+            {'setting_key': 'RECEIPT_FOOTER', 'setting_value': 'Thank you for your business!', 'description': 'Receipt footer message'},
+            {'setting_key': 'COMPANY_NAME', 'setting_value': 'Your Company Name', 'description': 'Company name for receipts'},
+            {'setting_key': 'COMPANY_ADDRESS', 'setting_value': '123 Main St, City, State 12345', 'description': 'Company address'},
+            {'setting_key': 'COMPANY_PHONE', 'setting_value': '(555) 123-4567', 'description': 'Company phone number'}
+        ])
     
     db.session.commit()
 
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables and seed default data"""
+    seed_database()
+    print('Database initialized')
+
+@app.cli.command('rebuild-sales-daily')
+def rebuild_sales_daily_command():
+    """Create the sales_daily rollup if missing and recompute it from sales"""
+    SalesDaily.__table__.create(db.engine, checkfirst=True)
+    SalesDaily.rebuild(db.session)
+    db.session.commit()
+    print('Sales daily rollup rebuilt')
+
+# Static files are served by WhiteNoise; anything else falls back to the SPA entry point
+app.wsgi_app = WhiteNoise(
+    app.wsgi_app,
+    root=app.static_folder,
+    index_file=True,
+    max_age=60,
+    immutable_file_test=lambda path, url: HASHED_ASSET_RE.match(url) is not None
+)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -120,15 +297,14 @@ def serve(path):
     if static_folder_path is None:
         return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+    index_path = os.path.join(static_folder_path, 'index.html')
+    if os.path.exists(index_path):
+        return send_from_directory(static_folder_path, 'index.html')
     else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+        return "index.html not found", 404
 
 if __name__ == '__main__':
+    with app.app_context():
+        seed_database()
     app.run(host='0.0.0.0', port=5000, debug=True)
 
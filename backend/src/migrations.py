@@ -0,0 +1,158 @@
+"""In-place upgrades for databases created before a schema change
+
+create_all only adds missing tables, so columns that were added, renamed or
+retyped on existing tables are brought up to date here. Each step checks the
+live schema first and does nothing once applied, so upgrade_schema() is safe
+to run on every start.
+"""
+from sqlalchemy import MetaData, func, inspect, literal_column, select, text, tuple_
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+from src.models.user import db
+
+# (table, old column, new column) for money now stored as integer cents
+CENTS_COLUMNS = (
+    ('stock_movements', 'unit_cost', 'unit_cost_cents'),
+    ('purchase_orders', 'sub_total', 'sub_total_cents'),
+    ('purchase_orders', 'tax_amount', 'tax_amount_cents'),
+    ('purchase_orders', 'total_amount', 'total_amount_cents'),
+    ('purchase_order_items', 'unit_cost', 'unit_cost_cents'),
+    ('purchase_order_items', 'line_total', 'line_total_cents'),
+)
+
+def _columns(connection, table):
+    """{name: reflected column} for table; empty when the table doesn't exist"""
+    inspector = inspect(connection)
+    if not inspector.has_table(table):
+        return {}
+    return {column['name']: column for column in inspector.get_columns(table)}
+
+def _money_to_cents(connection):
+    """Rename decimal money columns to *_cents and convert their values"""
+    postgresql = connection.dialect.name == 'postgresql'
+    for table, old, new in CENTS_COLUMNS:
+        columns = _columns(connection, table)
+        if old not in columns or new in columns:
+            continue
+        connection.execute(text(f'ALTER TABLE {table} RENAME COLUMN {old} TO {new}'))
+        if postgresql:
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN {new} TYPE BIGINT USING round({new} * 100)'))
+        else:
+            # SQLite columns hold any type, so only the values need converting
+            connection.execute(text(f'UPDATE {table} SET {new} = CAST(round({new} * 100) AS INTEGER)'))
+
+def _add_column(connection, table, column):
+    """Add the model's column to table when missing; True if it was added"""
+    columns = _columns(connection, table)
+    if not columns or column in columns:
+        return False
+    ddl = CreateColumn(db.metadata.tables[table].c[column]).compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {ddl}'))
+    return True
+
+def _check_unique(connection, index):
+    """Raise RuntimeError naming the rows that would violate unique index, if any"""
+    table = index.table
+    key = [
+        literal_column(expression.text) if isinstance(expression, TextClause) else expression
+        for expression in index.expressions
+    ]
+    where = index.dialect_kwargs.get(f'{connection.dialect.name}_where')
+    criteria = [where] if where is not None else []
+    duplicated = select(*key).select_from(table).where(*criteria).group_by(*key).having(func.count() > 1)
+    rows = connection.execute(
+        select(table.c.id, *key).where(*criteria, tuple_(*key).in_(duplicated)).order_by(*key, table.c.id)
+    ).all()
+    if rows:
+        conflicts = '; '.join(f'id {row[0]}: {tuple(row[1:])}' for row in rows)
+        raise RuntimeError(
+            f'Cannot create unique index {index.name}: {table.name} rows share '
+            f'{", ".join(str(column) for column in key)} ({conflicts}). '
+            'Merge or correct them, then run init-db again.'
+        )
+
+def create_index(connection, index):
+    """Create index unless it exists, first checking existing rows against a unique one"""
+    if index.unique:
+        _check_unique(connection, index)
+    # IF NOT EXISTS rather than checkfirst: SQLite can't reflect expression indexes
+    connection.execute(CreateIndex(index, if_not_exists=True))
+
+def _rebuild_sqlite_table(connection, name):
+    """Recreate table name from its model and copy the rows across
+
+    SQLite's recipe for changes ALTER TABLE can't make: create the new table,
+    copy, drop the old one and rename. Generated columns are recomputed.
+    """
+    # A scratch copy of the metadata, so the temporary table's foreign keys resolve
+    scratch = MetaData()
+    for table in db.metadata.tables.values():
+        table.to_metadata(scratch)
+    new_table = scratch.tables[name].to_metadata(scratch, name=f'{name}_new')
+    existing = _columns(connection, name)
+    copied = ', '.join(
+        column.name for column in new_table.columns
+        if column.computed is None and column.name in existing
+    )
+    connection.execute(CreateTable(new_table))
+    connection.execute(text(f'INSERT INTO {new_table.name} ({copied}) SELECT {copied} FROM {name}'))
+    connection.execute(text(f'DROP TABLE {name}'))
+    connection.execute(text(f'ALTER TABLE {new_table.name} RENAME TO {name}'))
+    # Dropping the old table dropped its indexes too
+    for index in db.metadata.tables[name].indexes:
+        create_index(connection, index)
+
+def _make_generated(connection, table, column):
+    """Add column as the model's stored generated column, replacing a plain one"""
+    columns = _columns(connection, table)
+    if not columns or 'computed' in columns.get(column, {}):
+        return
+    if connection.dialect.name == 'postgresql':
+        if column in columns:
+            connection.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+        ddl = CreateColumn(db.metadata.tables[table].c[column]).compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {ddl}'))
+    else:
+        # SQLite can only add virtual generated columns, so the table is rebuilt
+        _rebuild_sqlite_table(connection, table)
+
+def _generated_po_line_total(connection):
+    _make_generated(connection, 'purchase_order_items', 'line_total_cents')
+
+def _loyalty_transaction_count(connection):
+    """Add the per-customer loyalty counter, counting the transactions already recorded"""
+    if _add_column(connection, 'customers', 'loyalty_transaction_count') and _columns(connection, 'loyalty_transactions'):
+        connection.execute(text(
+            'UPDATE customers SET loyalty_transaction_count = '
+            '(SELECT count(*) FROM loyalty_transactions WHERE loyalty_transactions.customer_id = customers.id)'
+        ))
+
+def _generated_customer_full_name(connection):
+    _make_generated(connection, 'customers', 'full_name')
+
+def _sale_item_unit_cost(connection):
+    """Add the sold unit cost to sale items
+
+    Costs at the time of earlier sales weren't recorded, so existing items
+    take the product's current cost price, which the rollup used until now.
+    """
+    if _add_column(connection, 'sale_items', 'unit_cost'):
+        connection.execute(text(
+            'UPDATE sale_items SET unit_cost = '
+            '(SELECT cost_price FROM products WHERE products.id = sale_items.product_id)'
+        ))
+
+# Applied in order; later steps may rely on earlier ones
+UPGRADES = (
+    _money_to_cents,
+    _generated_po_line_total,
+    # Before the full_name rebuild, which would add the counter as 0 for everyone
+    _loyalty_transaction_count,
+    _generated_customer_full_name,
+    _sale_item_unit_cost,
+)
+
+def upgrade_schema(connection):
+    """Bring the existing tables reachable through connection up to the current models"""
+    for upgrade in UPGRADES:
+        upgrade(connection)
@@ -1,6 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from src.models.user import db
+from sqlalchemy import case, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.hybrid import hybrid_property
+from src.models.user import db, Branch, Supplier
+from src.models.types import Cents
 
 class Inventory(db.Model):
     __tablename__ = 'inventory'
@@ -10,31 +14,111 @@ class Inventory(db.Model):
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
     current_stock = db.Column(db.Integer, nullable=False, default=0)
     reserved_stock = db.Column(db.Integer, default=0)
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_updated = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
 
     # Relationships
     product = db.relationship('Product', backref='inventory_records')
     branch = db.relationship('Branch', backref='inventory_records')
 
-    # Unique constraint
-    __table_args__ = (db.UniqueConstraint('product_id', 'branch_id', name='unique_product_branch'),)
+    # Unique constraint and indexes
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'branch_id', name='unique_product_branch'),
+        # Covering on PostgreSQL so the low-stock check is an index-only scan
+        db.Index(
+            'ix_inv_branch_product', 'branch_id', 'product_id',
+            postgresql_include=['current_stock', 'reserved_stock', 'last_updated']
+        ),
+        # Stock-level range filters (low stock, valuation's current_stock > 0)
+        db.Index(
+            'ix_inv_branch_stock', 'branch_id', 'current_stock',
+            postgresql_include=['product_id']
+        ),
+    )
 
-    @property
+    @hybrid_property
     def available_stock(self):
         return self.current_stock - self.reserved_stock
 
-    def to_dict(self):
-        return {
+    @available_stock.expression
+    def available_stock(cls):
+        return cls.current_stock - cls.reserved_stock
+
+    @classmethod
+    def upsert_stock(cls, product_id, branch_id, quantity, absolute=False):
+        """Add quantity to (or with absolute, set) a stock level with one INSERT ... ON CONFLICT"""
+        insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(cls).values(product_id=product_id, branch_id=branch_id, current_stock=quantity)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['product_id', 'branch_id'],
+            set_={
+                'current_stock': stmt.excluded.current_stock if absolute else cls.current_stock + stmt.excluded.current_stock,
+                'last_updated': db.func.now()
+            }
+        ).returning(cls)
+        return db.session.scalars(stmt, execution_options={'populate_existing': True}).one()
+
+    @classmethod
+    def add_stock_many(cls, branch_id, quantities):
+        """Add {product_id: quantity} to one branch's stock with a single multi-row upsert"""
+        insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(cls).values([
+            {'product_id': product_id, 'branch_id': branch_id, 'current_stock': quantity}
+            for product_id, quantity in quantities.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['product_id', 'branch_id'],
+            set_={
+                'current_stock': cls.current_stock + stmt.excluded.current_stock,
+                'last_updated': db.func.now()
+            }
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def adjust_existing_stock(cls, branch_id, quantities):
+        """Add signed {product_id: quantity} deltas to the branch's existing stock rows in one UPDATE
+
+        Products without a stock row are left alone. Returns the product ids that were updated.
+        """
+        stmt = update(cls).where(
+            cls.branch_id == branch_id,
+            cls.product_id.in_(quantities)
+        ).values(
+            current_stock=cls.current_stock + case(quantities, value=cls.product_id, else_=0),
+            last_updated=db.func.now()
+        ).returning(cls.product_id)
+        return set(db.session.scalars(stmt, execution_options={'synchronize_session': False}))
+
+    @classmethod
+    def take_stock(cls, product_id, branch_id, quantity, available_only=False):
+        """Subtract quantity in one conditional UPDATE; None when there is not enough stock"""
+        in_stock = cls.available_stock if available_only else cls.current_stock
+        stmt = update(cls).where(
+            cls.product_id == product_id,
+            cls.branch_id == branch_id,
+            in_stock >= quantity
+        ).values(
+            current_stock=cls.current_stock - quantity,
+            last_updated=db.func.now()
+        ).returning(cls)
+        return db.session.scalars(stmt, execution_options={'populate_existing': True}).one_or_none()
+
+    def to_dict(self, include=()):
+        """Serialize; related objects are only added when named in include"""
+        data = {
             'id': self.id,
             'product_id': self.product_id,
             'branch_id': self.branch_id,
             'current_stock': self.current_stock,
             'reserved_stock': self.reserved_stock,
             'available_stock': self.available_stock,
-            'last_updated': self.last_updated.isoformat() if self.last_updated else None,
-            'product': self.product.to_dict() if self.product else None,
-            'branch': self.branch.to_dict() if self.branch else None
+            'last_updated': self.last_updated
         }
+        if 'product' in include:
+            data['product'] = self.product.to_dict() if self.product else None
+        if 'branch' in include:
+            data['branch'] = self.branch.to_dict() if self.branch else None
+        return data
 
 class StockMovement(db.Model):
     __tablename__ = 'stock_movements'
@@ -44,33 +128,48 @@ class StockMovement(db.Model):
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
     movement_type = db.Column(db.String(20), nullable=False)  # IN, OUT, TRANSFER, ADJUSTMENT
     quantity = db.Column(db.Integer, nullable=False)
-    unit_cost = db.Column(db.Numeric(10, 2))
+    unit_cost = db.Column('unit_cost_cents', Cents)
     reference = db.Column(db.String(100))
     notes = db.Column(db.String(255))
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
 
     # Relationships
     product = db.relationship('Product', backref='stock_movements')
     branch = db.relationship('Branch', backref='stock_movements')
     user = db.relationship('User', backref='stock_movements')
 
-    def to_dict(self):
-        return {
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_sm_product_created', 'product_id', 'created_at'),
+        db.Index('ix_sm_branch_created', 'branch_id', 'created_at'),
+        db.Index(
+            'ix_sm_created_id', 'created_at', 'id',
+            postgresql_include=['product_id', 'branch_id', 'movement_type']
+        ),
+    )
+
+    def to_dict(self, include=()):
+        """Serialize; related objects are only added when named in include"""
+        data = {
             'id': self.id,
             'product_id': self.product_id,
             'branch_id': self.branch_id,
             'movement_type': self.movement_type,
             'quantity': self.quantity,
-            'unit_cost': float(self.unit_cost) if self.unit_cost else None,
+            'unit_cost': self.unit_cost,
             'reference': self.reference,
             'notes': self.notes,
             'created_by': self.created_by,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'product': self.product.to_dict() if self.product else None,
-            'branch': self.branch.to_dict() if self.branch else None,
-            'user': self.user.to_dict() if self.user else None
+            'created_at': self.created_at
         }
+        if 'product' in include:
+            data['product'] = self.product.to_dict() if self.product else None
+        if 'branch' in include:
+            data['branch'] = self.branch.to_dict() if self.branch else None
+        if 'user' in include:
+            data['user'] = self.user.to_dict() if self.user else None
+        return data
 
 class PurchaseOrder(db.Model):
     __tablename__ = 'purchase_orders'
@@ -79,42 +178,56 @@ class PurchaseOrder(db.Model):
     po_number = db.Column(db.String(50), unique=True, nullable=False)
     supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), nullable=False)
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
-    order_date = db.Column(db.DateTime, default=datetime.utcnow)
+    order_date = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
     expected_delivery_date = db.Column(db.Date)
     status = db.Column(db.String(20), default='Pending')  # Pending, Approved, Received, Cancelled
-    sub_total = db.Column(db.Numeric(12, 2), nullable=False)
-    tax_amount = db.Column(db.Numeric(12, 2), default=0)
-    total_amount = db.Column(db.Numeric(12, 2), nullable=False)
+    sub_total = db.Column('sub_total_cents', Cents, nullable=False)
+    tax_amount = db.Column('tax_amount_cents', Cents, default=0)
+    total_amount = db.Column('total_amount_cents', Cents, nullable=False)
     notes = db.Column(db.String(255))
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
 
     # Relationships
-    supplier = db.relationship('Supplier', backref='purchase_orders')
-    branch = db.relationship('Branch', backref='purchase_orders')
-    user = db.relationship('User', backref='purchase_orders')
+    supplier = db.relationship('Supplier', back_populates='purchase_orders')
+    branch = db.relationship('Branch', back_populates='purchase_orders')
+    user = db.relationship('User', back_populates='purchase_orders')
+    items = db.relationship('PurchaseOrderItem', back_populates='purchase_order')
 
-    def to_dict(self):
-        return {
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_po_supplier_status', 'supplier_id', 'status'),
+        # List filters, each ending in order_date so the newest-first sort walks the index
+        db.Index('ix_po_branch_status_date', 'branch_id', 'status', 'order_date'),
+        db.Index('ix_po_supplier_date', 'supplier_id', 'order_date'),
+    )
+
+    def to_dict(self, include=()):
+        """Serialize; related objects are only added when named in include"""
+        data = {
             'id': self.id,
             'po_number': self.po_number,
             'supplier_id': self.supplier_id,
             'branch_id': self.branch_id,
-            'order_date': self.order_date.isoformat() if self.order_date else None,
-            'expected_delivery_date': self.expected_delivery_date.isoformat() if self.expected_delivery_date else None,
+            'order_date': self.order_date,
+            'expected_delivery_date': self.expected_delivery_date,
             'status': self.status,
-            'sub_total': float(self.sub_total) if self.sub_total else 0,
-            'tax_amount': float(self.tax_amount) if self.tax_amount else 0,
-            'total_amount': float(self.total_amount) if self.total_amount else 0,
+            'sub_total': self.sub_total or 0,
+            'tax_amount': self.tax_amount or 0,
+            'total_amount': self.total_amount or 0,
             'notes': self.notes,
             'created_by': self.created_by,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'supplier': self.supplier.to_dict() if self.supplier else None,
-            'branch': self.branch.to_dict() if self.branch else None,
-            'user': self.user.to_dict() if self.user else None
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
+        if 'supplier' in include:
+            data['supplier'] = Supplier.get_cached(self.supplier_id)
+        if 'branch' in include:
+            data['branch'] = Branch.get_cached(self.branch_id)
+        if 'user' in include:
+            data['user'] = self.user.to_dict() if self.user else None
+        return data
 
 class PurchaseOrderItem(db.Model):
     __tablename__ = 'purchase_order_items'
@@ -124,13 +237,18 @@ class PurchaseOrderItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     ordered_quantity = db.Column(db.Integer, nullable=False)
     received_quantity = db.Column(db.Integer, default=0)
-    unit_cost = db.Column(db.Numeric(10, 2), nullable=False)
-    line_total = db.Column(db.Numeric(12, 2), nullable=False)
+    unit_cost = db.Column('unit_cost_cents', Cents, nullable=False)
+    line_total = db.Column('line_total_cents', Cents, db.Computed('ordered_quantity * unit_cost_cents', persisted=True))
 
     # Relationships
-    purchase_order = db.relationship('PurchaseOrder', backref='items')
+    purchase_order = db.relationship('PurchaseOrder', back_populates='items')
     product = db.relationship('Product', backref='purchase_order_items')
 
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_poi_po', 'purchase_order_id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -138,8 +256,8 @@ class PurchaseOrderItem(db.Model):
             'product_id': self.product_id,
             'ordered_quantity': self.ordered_quantity,
             'received_quantity': self.received_quantity,
-            'unit_cost': float(self.unit_cost) if self.unit_cost else 0,
-            'line_total': float(self.line_total) if self.line_total else 0,
+            'unit_cost': self.unit_cost or 0,
+            'line_total': self.line_total or 0,
             'product': self.product.to_dict() if self.product else None
         }
 
@@ -1,6 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from src.models.user import db
+import threading
+from cachetools import TTLCache
+from sqlalchemy import delete, func, insert, inspect, literal, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.user import db, User, Branch, Customer
+
+# Sale number counter; created by create_all on databases with sequences (not SQLite)
+sale_number_seq = db.Sequence('sale_number_seq', metadata=db.metadata)
 
 class Sale(db.Model):
     __tablename__ = 'sales'
@@ -10,41 +18,98 @@ class Sale(db.Model):
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'))
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
     cashier_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+    sale_date = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
     sub_total = db.Column(db.Numeric(12, 2), nullable=False)
     tax_amount = db.Column(db.Numeric(12, 2), default=0)
     discount_amount = db.Column(db.Numeric(12, 2), default=0)
     total_amount = db.Column(db.Numeric(12, 2), nullable=False)
     payment_method = db.Column(db.String(20), nullable=False)  # Cash, Card, Mobile, Credit
     payment_status = db.Column(db.String(20), default='Completed')  # Pending, Completed, Refunded
-    notes = db.Column(db.String(255))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    notes = db.deferred(db.Column(db.String(255)))
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
 
     # Relationships
-    customer = db.relationship('Customer', backref='sales')
-    branch = db.relationship('Branch', backref='sales')
-    cashier = db.relationship('User', backref='sales')
+    customer = db.relationship('Customer', back_populates='sales', lazy='selectin')
+    branch = db.relationship('Branch', back_populates='sales')
+    cashier = db.relationship('User', back_populates='sales', lazy='selectin')
+    items = db.relationship('SaleItem', back_populates='sale')
+    loyalty_transactions = db.relationship('LoyaltyTransaction', back_populates='sale')
+
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_sales_date', 'sale_date'),
+        db.Index('ix_sales_branch_date', 'branch_id', 'sale_date'),
+        db.Index('ix_sales_cashier_date', 'cashier_id', 'sale_date'),
+        db.Index('ix_sales_customer', 'customer_id'),
+        db.Index('ix_sales_payment_status', 'payment_status'),
+        db.Index('ix_sales_payment_method_date', 'payment_method', 'sale_date'),
+        # Partial over non-refunded sales, which every sales aggregate filters on;
+        # the INCLUDE list lets PostgreSQL answer them with index-only scans
+        db.Index(
+            'ix_sales_active_date', 'sale_date', 'branch_id',
+            postgresql_where=db.text("payment_status <> 'Refunded'"),
+            sqlite_where=db.text("payment_status <> 'Refunded'"),
+            postgresql_include=['id', 'total_amount', 'tax_amount', 'discount_amount', 'payment_method']
+        ),
+    )
+
+    @classmethod
+    def list_select(cls, *criteria):
+        """Select of sale list rows with customer, branch and cashier names, newest first"""
+        return select(
+            cls.id,
+            cls.sale_number,
+            cls.customer_id,
+            cls.branch_id,
+            cls.cashier_id,
+            cls.sale_date,
+            cls.sub_total,
+            cls.tax_amount,
+            cls.discount_amount,
+            cls.total_amount,
+            cls.payment_method,
+            cls.payment_status,
+            cls.created_at,
+            (Customer.first_name + ' ' + Customer.last_name).label('customer_name'),
+            Branch.branch_name,
+            User.username.label('cashier_username')
+        ).outerjoin(Customer, cls.customer_id == Customer.id).join(
+            Branch, cls.branch_id == Branch.id
+        ).join(
+            User, cls.cashier_id == User.id
+        ).where(*criteria).order_by(cls.sale_date.desc(), cls.id.desc())
+
+    @classmethod
+    def list_as_dicts(cls, *criteria, limit=None, offset=None):
+        """Return sales as plain dicts built from row tuples, newest first"""
+        stmt = cls.list_select(*criteria).limit(limit).offset(offset)
+        return [dict(row._mapping) for row in db.session.execute(stmt)]
 
     def to_dict(self):
-        return {
+        # Read each relationship once; the instrumented getter is the costly part
+        customer, cashier = self.customer, self.cashier
+        data = {
             'id': self.id,
             'sale_number': self.sale_number,
             'customer_id': self.customer_id,
             'branch_id': self.branch_id,
             'cashier_id': self.cashier_id,
-            'sale_date': self.sale_date.isoformat() if self.sale_date else None,
-            'sub_total': float(self.sub_total) if self.sub_total else 0,
-            'tax_amount': float(self.tax_amount) if self.tax_amount else 0,
-            'discount_amount': float(self.discount_amount) if self.discount_amount else 0,
-            'total_amount': float(self.total_amount) if self.total_amount else 0,
+            'sale_date': self.sale_date,
+            'sub_total': self.sub_total or 0,
+            'tax_amount': self.tax_amount or 0,
+            'discount_amount': self.discount_amount or 0,
+            'total_amount': self.total_amount or 0,
             'payment_method': self.payment_method,
             'payment_status': self.payment_status,
-            'notes': self.notes,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'customer': self.customer.to_dict() if self.customer else None,
-            'branch': self.branch.to_dict() if self.branch else None,
-            'cashier': self.cashier.to_dict() if self.cashier else None
+            'created_at': self.created_at,
+            'customer': customer.to_dict() if customer else None,
+            'branch': Branch.get_cached(self.branch_id),
+            'cashier': cashier.to_dict() if cashier else None
         }
+        # Deferred column; only serialized when the query loaded it
+        if 'notes' not in inspect(self).unloaded:
+            data['notes'] = self.notes
+        return data
 
 class SaleItem(db.Model):
     __tablename__ = 'sale_items'
@@ -54,27 +119,113 @@ class SaleItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
+    # Product cost price at the time of sale, so later cost changes don't rewrite COGS
+    unit_cost = db.Column(db.Numeric(10, 2))
     discount_amount = db.Column(db.Numeric(10, 2), default=0)
     tax_amount = db.Column(db.Numeric(10, 2), default=0)
     line_total = db.Column(db.Numeric(12, 2), nullable=False)
 
     # Relationships
-    sale = db.relationship('Sale', backref='items')
-    product = db.relationship('Product', backref='sale_items')
+    sale = db.relationship('Sale', back_populates='items')
+    product = db.relationship('Product', back_populates='sale_items', lazy='selectin')
+
+    # Indexes
+    __table_args__ = (
+        # Covering on PostgreSQL so per-sale line lookups in the reports skip the heap
+        db.Index('ix_sale_items_sale', 'sale_id', postgresql_include=['product_id', 'quantity', 'line_total']),
+        db.Index('ix_sale_items_product', 'product_id'),
+    )
+
+    @classmethod
+    def bulk_create(cls, session, sale_id, items):
+        """Insert all line items for a sale in one executemany round-trip"""
+        session.execute(insert(cls), [dict(item, sale_id=sale_id) for item in items])
 
     def to_dict(self):
+        product = self.product
         return {
             'id': self.id,
             'sale_id': self.sale_id,
             'product_id': self.product_id,
             'quantity': self.quantity,
-            'unit_price': float(self.unit_price) if self.unit_price else 0,
-            'discount_amount': float(self.discount_amount) if self.discount_amount else 0,
-            'tax_amount': float(self.tax_amount) if self.tax_amount else 0,
-            'line_total': float(self.line_total) if self.line_total else 0,
-            'product': self.product.to_dict() if self.product else None
+            'unit_price': self.unit_price or 0,
+            'discount_amount': self.discount_amount or 0,
+            'tax_amount': self.tax_amount or 0,
+            'line_total': self.line_total or 0,
+            'product': product.to_dict() if product else None
         }
 
+class SalesDaily(db.Model):
+    """Sale totals per branch, day and payment method, excluding refunded sales
+
+    Kept in step with Sale by record_sale() in the same transaction, so the
+    reports sum a few rows per day instead of scanning sales.
+    """
+    __tablename__ = 'sales_daily'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
+    sale_day = db.Column(db.Date, nullable=False)
+    payment_method = db.Column(db.String(20), nullable=False)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    total_revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_tax = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_discount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_cogs = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    # Unique constraint and indexes
+    __table_args__ = (
+        db.UniqueConstraint('branch_id', 'sale_day', 'payment_method', name='unique_sales_daily_bucket'),
+        db.Index('ix_sales_daily_day', 'sale_day'),
+    )
+
+    BUCKET_COLUMNS = (
+        'branch_id', 'sale_day', 'payment_method', 'sale_count',
+        'total_revenue', 'total_tax', 'total_discount', 'total_cogs'
+    )
+
+    @classmethod
+    def _bucket_select(cls, *criteria, sign=1):
+        """Bucket rows aggregated from sales matching criteria, scaled by sign"""
+        cogs = select(
+            func.coalesce(func.sum(SaleItem.quantity * SaleItem.unit_cost), 0)
+        ).where(SaleItem.sale_id == Sale.id).scalar_subquery()
+        sale_day = func.date(Sale.sale_date)
+        return select(
+            Sale.branch_id,
+            sale_day,
+            Sale.payment_method,
+            literal(sign) * func.count(Sale.id),
+            literal(sign) * func.coalesce(func.sum(Sale.total_amount), 0),
+            literal(sign) * func.coalesce(func.sum(Sale.tax_amount), 0),
+            literal(sign) * func.coalesce(func.sum(Sale.discount_amount), 0),
+            literal(sign) * func.coalesce(func.sum(cogs), 0)
+        ).where(*criteria).group_by(Sale.branch_id, sale_day, Sale.payment_method)
+
+    @classmethod
+    def record_sale(cls, session, sale_id, sign=1):
+        """Add a sale's totals to its bucket, or with sign=-1 take them out again
+
+        Call once the sale's items are written; line costs use the unit cost
+        stored on each item, so a refund takes out exactly what the sale added.
+        """
+        insert = postgresql_insert if session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(cls).from_select(cls.BUCKET_COLUMNS, cls._bucket_select(Sale.id == sale_id, sign=sign))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['branch_id', 'sale_day', 'payment_method'],
+            set_={
+                column: getattr(cls, column) + getattr(stmt.excluded, column)
+                for column in cls.BUCKET_COLUMNS[3:]
+            }
+        )
+        session.execute(stmt)
+
+    @classmethod
+    def rebuild(cls, session):
+        """Recompute every bucket from the sales table"""
+        session.execute(delete(cls))
+        session.execute(insert(cls).from_select(cls.BUCKET_COLUMNS, cls._bucket_select(Sale.payment_status != 'Refunded')))
+
 class LoyaltyTransaction(db.Model):
     __tablename__ = 'loyalty_transactions'
     
@@ -84,11 +235,16 @@ class LoyaltyTransaction(db.Model):
     transaction_type = db.Column(db.String(20), nullable=False)  # EARNED, REDEEMED, EXPIRED, ADJUSTED
     points = db.Column(db.Integer, nullable=False)
     description = db.Column(db.String(255))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
 
     # Relationships
-    customer = db.relationship('Customer', backref='loyalty_transactions')
-    sale = db.relationship('Sale', backref='loyalty_transactions')
+    customer = db.relationship('Customer', back_populates='loyalty_transactions', lazy='selectin')
+    sale = db.relationship('Sale', back_populates='loyalty_transactions')
+
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_lt_customer_created', 'customer_id', 'created_at'),
+    )
 
     def to_dict(self):
         return {
@@ -98,7 +254,7 @@ class LoyaltyTransaction(db.Model):
             'transaction_type': self.transaction_type,
             'points': self.points,
             'description': self.description,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
             'customer': self.customer.to_dict() if self.customer else None,
             'sale': self.sale.to_dict() if self.sale else None
         }
@@ -111,10 +267,10 @@ class SystemSetting(db.Model):
     setting_value = db.Column(db.String(500))
     description = db.Column(db.String(255))
     updated_by = db.Column(db.Integer, db.ForeignKey('users.id'))
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
 
     # Relationships
-    user = db.relationship('User', backref='system_settings')
+    user = db.relationship('User', back_populates='system_settings')
 
     def to_dict(self):
         return {
@@ -123,10 +279,36 @@ class SystemSetting(db.Model):
             'setting_value': self.setting_value,
             'description': self.description,
             'updated_by': self.updated_by,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'updated_at': self.updated_at,
             'user': self.user.to_dict() if self.user else None
         }
 
+# All settings in one dict; the TTL bounds how long other workers keep a
+# value after a change, since clear_settings_cache() only reaches this process
+_settings_cache = TTLCache(maxsize=1, ttl=60)
+_settings_cache_lock = threading.Lock()
+
+def _all_settings():
+    with _settings_cache_lock:
+        settings = _settings_cache.get('all')
+    if settings is None:
+        settings = dict(db.session.execute(
+            select(SystemSetting.setting_key, SystemSetting.setting_value)
+        ).all())
+        with _settings_cache_lock:
+            _settings_cache['all'] = settings
+    return settings
+
+def get_setting(key, default=None):
+    """Return a setting value; every setting is loaded by one query and cached for 60s"""
+    value = _all_settings().get(key)
+    return value if value is not None else default
+
+def clear_settings_cache():
+    """Drop cached setting values after a setting is created, updated or deleted"""
+    with _settings_cache_lock:
+        _settings_cache.clear()
+
 class AuditLog(db.Model):
     __tablename__ = 'audit_log'
     
@@ -134,24 +316,40 @@ class AuditLog(db.Model):
     table_name = db.Column(db.String(100), nullable=False)
     record_id = db.Column(db.Integer, nullable=False)
     action = db.Column(db.String(20), nullable=False)  # INSERT, UPDATE, DELETE
-    old_values = db.Column(db.Text)
-    new_values = db.Column(db.Text)
+    old_values = db.deferred(db.Column(db.JSON().with_variant(JSONB, 'postgresql')))
+    new_values = db.deferred(db.Column(db.JSON().with_variant(JSONB, 'postgresql')))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
 
     # Relationships
-    user = db.relationship('User', backref='audit_logs')
+    user = db.relationship('User', back_populates='audit_logs')
+
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_audit_table_record', 'table_name', 'record_id'),
+        db.Index('ix_audit_user_timestamp', 'user_id', 'timestamp'),
+    )
+
+    @classmethod
+    def bulk_create(cls, session, entries):
+        """Insert audit entries in one executemany round-trip"""
+        if entries:
+            session.execute(insert(cls), entries)
 
     def to_dict(self):
-        return {
+        data = {
             'id': self.id,
             'table_name': self.table_name,
             'record_id': self.record_id,
             'action': self.action,
-            'old_values': self.old_values,
-            'new_values': self.new_values,
             'user_id': self.user_id,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'timestamp': self.timestamp,
             'user': self.user.to_dict() if self.user else None
         }
+        # Deferred columns; only serialized when the query loaded them
+        unloaded = inspect(self).unloaded
+        for key in ('old_values', 'new_values'):
+            if key not in unloaded:
+                data[key] = getattr(self, key)
+        return data
 
@@ -0,0 +1,16 @@
+from sqlalchemy.types import TypeDecorator, BigInteger
+
+class Cents(TypeDecorator):
+    """Money amount stored as integer cents, exposed as float units"""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(round(float(value) * 100))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return value / 100
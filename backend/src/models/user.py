@@ -1,9 +1,83 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import DDL, and_, event, func, inspect, lambda_stmt, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.hybrid import hybrid_property
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from functools import lru_cache
+from cachetools import TTLCache
 import bcrypt
+import secrets
+import threading
 
 db = SQLAlchemy()
 
+# Argon2id with OWASP's minimum recommended cost (19 MiB, 2 passes)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash():
+    return password_hasher.hash(secrets.token_urlsafe(16))
+
+# Branches, categories and suppliers change rarely but are serialized into
+# most sale and product responses; their to_dict() output is kept per process
+_lookup_cache = TTLCache(maxsize=4096, ttl=300)
+_lookup_cache_lock = threading.Lock()
+# Products by barcode for scanner lookups; a short TTL bounds staleness across workers
+_barcode_cache = TTLCache(maxsize=4096, ttl=60)
+
+def clear_lookup_cache():
+    """Drop cached branch/category/supplier dicts after one of them changes"""
+    with _lookup_cache_lock:
+        _lookup_cache.clear()
+        # Cached product dicts embed category and supplier
+        _barcode_cache.clear()
+
+def clear_barcode_cache():
+    """Drop cached product-by-barcode dicts after a product changes"""
+    with _lookup_cache_lock:
+        _barcode_cache.clear()
+
+class CachedLookupMixin:
+    @classmethod
+    def get_cached(cls, pk):
+        """Return to_dict() for the row with this id, cached for a few minutes"""
+        if pk is None:
+            return None
+        key = (cls.__tablename__, pk)
+        with _lookup_cache_lock:
+            data = _lookup_cache.get(key)
+        if data is None:
+            obj = db.session.get(cls, pk)
+            if obj is None:
+                return None
+            data = obj.to_dict()
+            with _lookup_cache_lock:
+                _lookup_cache[key] = data
+        return data
+
+def search_text_expression(*columns):
+    """coalesce(a, '') || ' ' || coalesce(b, '') ... over the given columns"""
+    expression = func.coalesce(columns[0], '')
+    for column in columns[1:]:
+        expression = expression + ' ' + func.coalesce(column, '')
+    return expression
+
+def add_trigram_index(table, name, column_names):
+    """On PostgreSQL, index the search_text_expression() of column_names with pg_trgm
+
+    The indexed expression must match the one the query builds, so ILIKE
+    '%term%' over it becomes a GIN probe instead of a sequential scan.
+    """
+    expression = " || ' ' || ".join(f"coalesce({column}, '')" for column in column_names)
+    event.listen(table, 'after_create', DDL(
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+    ).execute_if(dialect='postgresql'))
+    event.listen(table, 'after_create', DDL(
+        f'CREATE INDEX {name} ON {table.name} USING gin (({expression}) gin_trgm_ops)'
+    ).execute_if(dialect='postgresql'))
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -15,19 +89,77 @@ class User(db.Model):
     last_name = db.Column(db.String(50), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='Cashier')  # Admin, Cashier, InventoryManager
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
+
+    # Relationships
+    sales = db.relationship('Sale', back_populates='cashier')
+    system_settings = db.relationship('SystemSetting', back_populates='user')
+    audit_logs = db.relationship('AuditLog', back_populates='user')
+    purchase_orders = db.relationship('PurchaseOrder', back_populates='user')
+
+    # Keyset order of the user list
+    __table_args__ = (
+        db.Index('ix_users_created_id', 'created_at', 'id'),
+    )
+
+    SEARCH_COLUMNS = ('username', 'email', 'first_name', 'last_name')
+
+    # Columns of to_dict(); list endpoints read just these as plain rows
+    LIST_COLUMNS = (
+        'id', 'username', 'email', 'first_name', 'last_name', 'role',
+        'is_active', 'created_at', 'updated_at'
+    )
+
+    @classmethod
+    def rows_as_dicts(cls, query):
+        """to_dict()-shaped dicts for query's rows, built from column tuples instead of instances"""
+        return [dict(row._mapping) for row in query.with_entities(*(getattr(cls, name) for name in cls.LIST_COLUMNS))]
+
+    @hybrid_property
+    def search_text(self):
+        return ' '.join(getattr(self, name) or '' for name in self.SEARCH_COLUMNS)
+
+    @search_text.expression
+    def search_text(cls):
+        return search_text_expression(*(getattr(cls, name) for name in cls.SEARCH_COLUMNS))
 
     def __repr__(self):
         return f'<User {self.username}>'
 
+    @staticmethod
+    def hash_password(password):
+        """Return Argon2id hash for password"""
+        return password_hasher.hash(password)
+
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = self.hash_password(password)
 
     def check_password(self, password):
         """Check if provided password matches hash"""
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        if self.password_hash.startswith('$2'):
+            # Legacy bcrypt hash, replaced on the next successful login
+            return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        try:
+            return password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    @staticmethod
+    def check_dummy_password(password):
+        """Run a verify against a throwaway hash so unknown users cost the same time"""
+        try:
+            password_hasher.verify(_dummy_password_hash(), password)
+        except (VerificationError, InvalidHashError):
+            pass
+        return False
+
+    def password_needs_rehash(self):
+        """Check if hash is bcrypt or uses outdated Argon2 parameters"""
+        if self.password_hash.startswith('$2'):
+            return True
+        return password_hasher.check_needs_rehash(self.password_hash)
 
     def to_dict(self):
         return {
@@ -38,11 +170,11 @@ class User(db.Model):
             'last_name': self.last_name,
             'role': self.role,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
 
-class Branch(db.Model):
+class Branch(CachedLookupMixin, db.Model):
     __tablename__ = 'branches'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -51,7 +183,11 @@ class Branch(db.Model):
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
+
+    # Relationships
+    sales = db.relationship('Sale', back_populates='branch')
+    purchase_orders = db.relationship('PurchaseOrder', back_populates='branch')
 
     def to_dict(self):
         return {
@@ -61,10 +197,10 @@ class Branch(db.Model):
             'phone': self.phone,
             'email': self.email,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at
         }
 
-class Category(db.Model):
+class Category(CachedLookupMixin, db.Model):
     __tablename__ = 'categories'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -72,10 +208,11 @@ class Category(db.Model):
     description = db.Column(db.String(255))
     parent_category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
 
     # Self-referential relationship
     parent = db.relationship('Category', remote_side=[id], backref='subcategories')
+    products = db.relationship('Product', back_populates='category')
 
     def to_dict(self):
         return {
@@ -84,10 +221,10 @@ class Category(db.Model):
             'description': self.description,
             'parent_category_id': self.parent_category_id,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at
         }
 
-class Supplier(db.Model):
+class Supplier(CachedLookupMixin, db.Model):
     __tablename__ = 'suppliers'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -95,27 +232,68 @@ class Supplier(db.Model):
     contact_person = db.Column(db.String(100))
     email = db.Column(db.String(100))
     phone = db.Column(db.String(20))
-    address = db.Column(db.String(255))
+    address = db.deferred(db.Column(db.String(255)))
     tax_number = db.Column(db.String(50))
     payment_terms = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
+
+    # Relationships
+    products = db.relationship('Product', back_populates='supplier')
+    purchase_orders = db.relationship('PurchaseOrder', back_populates='supplier')
+
+    # Keyset order of the supplier list, and the name/email uniqueness the
+    # create and update routes rely on instead of checking first
+    __table_args__ = (
+        db.Index('ix_suppliers_created_id', 'created_at', 'id'),
+        db.Index('ix_suppliers_supplier_name', 'supplier_name', unique=True),
+        db.Index(
+            'ix_suppliers_email_lower', db.text('lower(email)'), unique=True,
+            postgresql_where=db.text("email <> ''"),
+            sqlite_where=db.text("email <> ''")
+        ),
+    )
+
+    SEARCH_COLUMNS = ('supplier_name', 'contact_person', 'email', 'phone')
+
+    # Columns of to_dict() other than the deferred address; list endpoints read
+    # just these as plain rows
+    LIST_COLUMNS = (
+        'id', 'supplier_name', 'contact_person', 'email', 'phone', 'tax_number',
+        'payment_terms', 'is_active', 'created_at', 'updated_at'
+    )
+
+    @classmethod
+    def rows_as_dicts(cls, query):
+        """to_dict()-shaped dicts for query's rows, built from column tuples instead of instances"""
+        return [dict(row._mapping) for row in query.with_entities(*(getattr(cls, name) for name in cls.LIST_COLUMNS))]
+
+    @hybrid_property
+    def search_text(self):
+        return ' '.join(getattr(self, name) or '' for name in self.SEARCH_COLUMNS)
+
+    @search_text.expression
+    def search_text(cls):
+        return search_text_expression(*(getattr(cls, name) for name in cls.SEARCH_COLUMNS))
 
     def to_dict(self):
-        return {
+        data = {
             'id': self.id,
             'supplier_name': self.supplier_name,
             'contact_person': self.contact_person,
             'email': self.email,
             'phone': self.phone,
-            'address': self.address,
             'tax_number': self.tax_number,
             'payment_terms': self.payment_terms,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
+        # Deferred column; only serialized when the query loaded it
+        if 'address' not in inspect(self).unloaded:
+            data['address'] = self.address
+        return data
 
 class Product(db.Model):
     __tablename__ = 'products'
@@ -124,7 +302,7 @@ class Product(db.Model):
     product_code = db.Column(db.String(50), unique=True, nullable=False)
     barcode = db.Column(db.String(100), unique=True)
     product_name = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.String(500))
+    description = db.deferred(db.Column(db.String(500)))
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'))
     unit_of_measure = db.Column(db.String(20), nullable=False)
@@ -135,34 +313,100 @@ class Product(db.Model):
     reorder_level = db.Column(db.Integer, default=0)
     tax_rate = db.Column(db.Numeric(5, 2), default=0)
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
 
     # Relationships
-    category = db.relationship('Category', backref='products')
-    supplier = db.relationship('Supplier', backref='products')
+    category = db.relationship('Category', back_populates='products')
+    supplier = db.relationship('Supplier', back_populates='products')
+    sale_items = db.relationship('SaleItem', back_populates='product')
+
+    # Partial indexes over active products, which is what the catalogue,
+    # low-stock and valuation queries filter on
+    __table_args__ = (
+        db.Index(
+            'ix_products_active_category', 'category_id',
+            postgresql_where=db.text('is_active'),
+            sqlite_where=db.text('is_active = 1')
+        ),
+        db.Index(
+            'ix_products_active_id', 'id', 'reorder_level', 'cost_price',
+            postgresql_where=db.text('is_active'),
+            sqlite_where=db.text('is_active = 1')
+        ),
+    )
+
+    SEARCH_COLUMNS = ('product_name', 'product_code', 'barcode')
+    # Columns behind to_dict_summary(); list queries load_only() these
+    SUMMARY_COLUMNS = (
+        'id', 'product_code', 'barcode', 'product_name', 'category_id',
+        'cost_price', 'selling_price', 'tax_rate', 'is_active'
+    )
+
+    @hybrid_property
+    def search_text(self):
+        return ' '.join(getattr(self, name) or '' for name in self.SEARCH_COLUMNS)
+
+    @search_text.expression
+    def search_text(cls):
+        return search_text_expression(*(getattr(cls, name) for name in cls.SEARCH_COLUMNS))
 
     def to_dict(self):
-        return {
+        data = {
             'id': self.id,
             'product_code': self.product_code,
             'barcode': self.barcode,
             'product_name': self.product_name,
-            'description': self.description,
             'category_id': self.category_id,
             'supplier_id': self.supplier_id,
             'unit_of_measure': self.unit_of_measure,
-            'cost_price': float(self.cost_price) if self.cost_price else 0,
-            'selling_price': float(self.selling_price) if self.selling_price else 0,
+            'cost_price': self.cost_price or 0,
+            'selling_price': self.selling_price or 0,
             'min_stock_level': self.min_stock_level,
             'max_stock_level': self.max_stock_level,
             'reorder_level': self.reorder_level,
-            'tax_rate': float(self.tax_rate) if self.tax_rate else 0,
+            'tax_rate': self.tax_rate or 0,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'category': self.category.to_dict() if self.category else None,
-            'supplier': self.supplier.to_dict() if self.supplier else None
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'category': Category.get_cached(self.category_id),
+            'supplier': Supplier.get_cached(self.supplier_id)
+        }
+        # Deferred column; only serialized when the query loaded it
+        if 'description' not in inspect(self).unloaded:
+            data['description'] = self.description
+        return data
+
+    @classmethod
+    def get_cached_by_barcode(cls, barcode):
+        """Return to_dict() of the active product with this barcode, cached briefly"""
+        with _lookup_cache_lock:
+            data = _barcode_cache.get(barcode)
+        if data is None:
+            # lambda_stmt caches the constructed statement as well as its SQL;
+            # barcode is extracted from the closure as a bound parameter
+            product = db.session.scalars(lambda_stmt(
+                lambda: select(Product).where(Product.barcode == barcode, Product.is_active == True).limit(1)
+            )).first()
+            if product is None:
+                return None
+            data = product.to_dict()
+            with _lookup_cache_lock:
+                _barcode_cache[barcode] = data
+        return data
+
+    def to_dict_summary(self):
+        """Compact form for lists; reads only SUMMARY_COLUMNS"""
+        return {
+            'id': self.id,
+            'product_code': self.product_code,
+            'barcode': self.barcode,
+            'product_name': self.product_name,
+            'category_id': self.category_id,
+            'cost_price': self.cost_price or 0,
+            'selling_price': self.selling_price or 0,
+            'tax_rate': self.tax_rate or 0,
+            'is_active': self.is_active
         }
 
 class Customer(db.Model):
@@ -172,31 +416,102 @@ class Customer(db.Model):
     customer_code = db.Column(db.String(50), unique=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
+    full_name = db.Column(db.String(101), db.Computed("first_name || ' ' || last_name", persisted=True))
     email = db.Column(db.String(100))
     phone = db.Column(db.String(20))
-    address = db.Column(db.String(255))
+    address = db.deferred(db.Column(db.String(255)))
     date_of_birth = db.Column(db.Date)
     loyalty_points = db.Column(db.Integer, default=0)
+    loyalty_transaction_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     total_purchases = db.Column(db.Numeric(12, 2), default=0)
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), server_default=db.func.now())
+
+    # Relationships
+    sales = db.relationship('Sale', back_populates='customer')
+    loyalty_transactions = db.relationship('LoyaltyTransaction', back_populates='customer')
+
+    # Indexes; the partial one only covers active customers, the default list filter
+    __table_args__ = (
+        db.Index('ix_customers_created_id', 'created_at', 'id'),
+        db.Index(
+            'ix_customers_active_created', 'created_at', 'id',
+            postgresql_where=db.text('is_active'),
+            sqlite_where=db.text('is_active = 1')
+        ),
+        # Emails are compared case-insensitively, so uniqueness is on lower(email);
+        # customers saved without an email store '', which may repeat
+        db.Index(
+            'ix_customers_email_lower', db.text('lower(email)'), unique=True,
+            postgresql_where=db.text("email <> ''"),
+            sqlite_where=db.text("email <> ''")
+        ),
+    )
+
+    SEARCH_COLUMNS = ('first_name', 'last_name', 'email', 'phone', 'customer_code')
+
+    @hybrid_property
+    def search_text(self):
+        return ' '.join(getattr(self, name) or '' for name in self.SEARCH_COLUMNS)
+
+    @search_text.expression
+    def search_text(cls):
+        return search_text_expression(*(getattr(cls, name) for name in cls.SEARCH_COLUMNS))
+
+    @classmethod
+    def insert_unless_code_exists(cls, **values):
+        """INSERT ... ON CONFLICT (customer_code) DO NOTHING; None when the code is taken"""
+        insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(cls).values(**values).on_conflict_do_nothing(
+            index_elements=['customer_code']
+        ).returning(cls)
+        return db.session.scalars(stmt).one_or_none()
+
+    @classmethod
+    def token_search(cls, terms):
+        """Filter matching every word in terms, in any of the search columns
+
+        PostgreSQL uses the trigger-maintained search_tsv column and its GIN
+        index; other databases AND one ILIKE per word over search_text.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            return literal_column('customers.search_tsv').op('@@')(func.plainto_tsquery('simple', terms))
+        return and_(*(cls.search_text.ilike(f'%{word}%') for word in terms.split()))
 
     def to_dict(self):
-        return {
+        data = {
             'id': self.id,
             'customer_code': self.customer_code,
             'first_name': self.first_name,
             'last_name': self.last_name,
-            'full_name': f"{self.first_name} {self.last_name}",
+            'full_name': self.full_name,
             'email': self.email,
             'phone': self.phone,
-            'address': self.address,
-            'date_of_birth': self.date_of_birth.isoformat() if self.date_of_birth else None,
+            'date_of_birth': self.date_of_birth,
             'loyalty_points': self.loyalty_points,
-            'total_purchases': float(self.total_purchases) if self.total_purchases else 0,
+            'total_purchases': self.total_purchases or 0,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
+        # Deferred column; only serialized when the query loaded it
+        if 'address' not in inspect(self).unloaded:
+            data['address'] = self.address
+        return data
+
+add_trigram_index(Product.__table__, 'ix_products_search_trgm', Product.SEARCH_COLUMNS)
+add_trigram_index(Customer.__table__, 'ix_customers_search_trgm', Customer.SEARCH_COLUMNS)
+add_trigram_index(Supplier.__table__, 'ix_suppliers_search_trgm', Supplier.SEARCH_COLUMNS)
+add_trigram_index(User.__table__, 'ix_users_search_trgm', User.SEARCH_COLUMNS)
 
+# Full-text search column for PostgreSQL, kept current by the built-in
+# tsvector_update_trigger; not mapped since other databases have no tsvector
+for statement in (
+    'ALTER TABLE customers ADD COLUMN search_tsv tsvector',
+    'CREATE TRIGGER customers_search_tsv_update BEFORE INSERT OR UPDATE ON customers '
+    "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_tsv, 'pg_catalog.simple', "
+    'first_name, last_name, email, phone, customer_code)',
+    'CREATE INDEX ix_customers_search_tsv ON customers USING gin (search_tsv)',
+):
+    event.listen(Customer.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
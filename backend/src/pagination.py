@@ -0,0 +1,61 @@
+import base64
+import math
+from datetime import datetime
+from sqlalchemy import literal, tuple_
+from src.models.user import db
+
+def page_args(page, per_page):
+    """Clamp page/per_page query args the way Flask-SQLAlchemy's paginate() does"""
+    return max(page, 1), per_page if per_page > 0 else 20
+
+def paginate_ids(query, id_column, order_by, page, per_page):
+    """Deferred-join pagination: page over the id column only
+
+    Returns (ids, total). OFFSET skips narrow id rows instead of full rows;
+    the caller then loads just these ids with WHERE id IN (...) and the same
+    ordering.
+    """
+    return page_ids(query, id_column, order_by, page, per_page), query.order_by(None).count()
+
+def page_ids(query, id_column, order_by, page, per_page):
+    """Ids for one page of query, reading only the id column"""
+    return [
+        row[0] for row in query.with_entities(id_column).order_by(*order_by)
+        .limit(per_page).offset((page - 1) * per_page)
+    ]
+
+def page_count(total, per_page):
+    return math.ceil(total / per_page) if total else 0
+
+def encode_cursor(created_at, row_id):
+    """Opaque keyset cursor for a (created_at, id) position"""
+    raw = f'{created_at.isoformat()},{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError as e:
+        raise ValueError('Invalid cursor') from e
+
+def before_cursor(created_at, row_id, position):
+    """Keyset filter for rows after position in (created_at, id) descending order
+
+    SQLite keeps server-default timestamps as 'YYYY-MM-DD HH:MM:SS' text, while a
+    bound datetime always gets '.000000' appended, so rows sharing the cursor's
+    second would compare as earlier and the page would repeat. Whole-second
+    positions are bound in the stored form there.
+    """
+    position_at, position_id = position
+    if db.session.get_bind().dialect.name == 'sqlite' and position_at.microsecond == 0:
+        position_at = literal(position_at.strftime('%Y-%m-%d %H:%M:%S'))
+    return tuple_(created_at, row_id) < tuple_(position_at, position_id)
+
+def next_cursor(items, per_page):
+    """Cursor for the page after items, or None when this was the last page"""
+    if len(items) < per_page:
+        return None
+    last = items[-1]
+    return encode_cursor(last.created_at, last.id)
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+import redis
+from cachetools import TTLCache
+from flask import current_app, request
+from src.routes.auth import current_role
+from src.conditional import not_modified, tag_response
+
+# Cached bodies are at most ttl seconds old already; clients may reuse them briefly
+CACHE_CONTROL = 'private, max-age=10'
+
+class ResponseCache:
+    """Rendered JSON responses; kept in Redis when REDIS_URL is set, else in process memory
+
+    Entries outlive their freshness window by max_stale seconds so a failing
+    request can still be answered with the last good response.
+    """
+
+    def __init__(self, redis_url=None, max_stale=300):
+        self._redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self._max_stale = max_stale
+        self._local = TTLCache(maxsize=1024, ttl=max_stale)
+        self._local_lock = threading.Lock()
+
+    def get(self, key):
+        """(body, status, created_at) for key, or None"""
+        if self._redis is not None:
+            entry = self._redis.hgetall(key)
+            if not entry:
+                return None
+            return entry[b'body'], int(entry[b'status']), float(entry[b'created_at'])
+        with self._local_lock:
+            return self._local.get(key)
+
+    def set(self, key, body, status):
+        created_at = time.time()
+        if self._redis is not None:
+            pipe = self._redis.pipeline()
+            pipe.hset(key, mapping={'body': body, 'status': status, 'created_at': created_at})
+            pipe.expire(key, self._max_stale)
+            pipe.execute()
+        else:
+            with self._local_lock:
+                self._local[key] = (body, status, created_at)
+
+def cache_key():
+    """Key for the current request: path, query args and the caller's role"""
+    role = current_role()
+    args = sorted((key, value) for key, value in request.args.items(multi=True) if key != 'nocache')
+    raw = repr((request.path, args, role))
+    return 'response:' + hashlib.sha1(raw.encode()).hexdigest()
+
+def cached_response(entry, state):
+    body, status, created_at = entry
+    etag = hashlib.md5(body).hexdigest()
+    response = not_modified(etag, CACHE_CONTROL)
+    if response is None:
+        response = current_app.response_class(body, status=status, mimetype='application/json')
+        tag_response(response, etag, CACHE_CONTROL)
+    response.headers['X-Cache'] = state
+    response.headers['Age'] = str(int(time.time() - created_at))
+    return response
+
+def cached(ttl=30):
+    """Serve a read-only JSON view from the response cache for ttl seconds
+
+    Must sit below @jwt_required(). ?nocache=1 bypasses the cache; a 5xx from
+    the view is replaced by the last good response while it is still kept.
+    Cached bodies carry an ETag, so a client polling with If-None-Match gets
+    a bodiless 304 while nothing changed. Streamed responses are passed
+    through uncached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.args.get('nocache', '').lower() in ('1', 'true'):
+                return view(*args, **kwargs)
+
+            cache = current_app.extensions['response_cache']
+            key = cache_key()
+            try:
+                entry = cache.get(key)
+            except redis.RedisError:
+                entry = None
+            if entry and time.time() - entry[2] < ttl:
+                return cached_response(entry, 'HIT')
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code >= 500 and entry:
+                return cached_response(entry, 'STALE')
+            if response.status_code == 200 and not response.is_streamed:
+                body = response.get_data()
+                try:
+                    cache.set(key, body, response.status_code)
+                except redis.RedisError:
+                    pass
+                etag = hashlib.md5(body).hexdigest()
+                unchanged = not_modified(etag, CACHE_CONTROL)
+                response = unchanged if unchanged is not None else tag_response(response, etag, CACHE_CONTROL)
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
@@ -1,171 +1,192 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, current_app
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_jwt
 from src.models.user import db, User
-from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import select, union_all
+from sqlalchemy.exc import SQLAlchemyError
+import uuid
 
 auth_bp = Blueprint('auth', __name__)
 
+# Database errors only: a catch-all here would also win over flask-jwt-extended's
+# app-level handlers and turn missing or revoked tokens into 500s instead of 401s
+@auth_bp.errorhandler(SQLAlchemyError)
+def handle_error(e):
+    """Roll back and return an opaque error; details are logged under trace_id"""
+    db.session.rollback()
+    trace_id = uuid.uuid4().hex
+    current_app.logger.error('Unhandled error in auth route (trace_id=%s)', trace_id, exc_info=e)
+    return jsonify({'error': 'Internal error', 'trace_id': trace_id}), 500
+
+def load_current_user():
+    """Return the User for the current JWT, loaded once per request"""
+    if 'current_user' not in g:
+        g.current_user = User.query.get(get_jwt_identity())
+    return g.current_user
+
+@lru_cache(maxsize=1024)
+def _role_for_token(user_id, issued_at):
+    # Keyed by issue time as well, so a re-login picks up a changed role
+    user = db.session.get(User, user_id)
+    return user.role if user else None
+
+def current_role():
+    """Role of the current JWT's user, from the role claim when the token has one"""
+    claims = get_jwt()
+    role = claims.get('role')
+    if role is None:
+        # Token issued before the role claim existed; looked up once per token
+        role = _role_for_token(get_jwt_identity(), claims.get('iat'))
+    return role
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
-    try:
-        data = request.get_json()
-        
-        if not data or not data.get('username') or not data.get('password'):
-            return jsonify({'error': 'Username and password are required'}), 400
-        
-        username = data.get('username')
-        password = data.get('password')
-        
-        # Find user by username or email
-        user = User.query.filter(
-            (User.username == username) | (User.email == username)
-        ).first()
-        
-        if not user or not user.check_password(password):
-            return jsonify({'error': 'Invalid credentials'}), 401
-        
-        if not user.is_active:
-            return jsonify({'error': 'Account is deactivated'}), 401
-        
-        # Create tokens
-        access_token = create_access_token(identity=user.id)
-        refresh_token = create_refresh_token(identity=user.id)
-        
-        return jsonify({
-            'message': 'Login successful',
-            'access_token': access_token,
-            'refresh_token': refresh_token,
-            'user': user.to_dict()
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    data = request.get_json()
+    
+    if not data or not data.get('username') or not data.get('password'):
+        return jsonify({'error': 'Username and password are required'}), 400
+    
+    username = data.get('username')
+    password = data.get('password')
+    
+    # Find user by username or email; UNION ALL lets each branch use its
+    # unique index instead of an OR across two columns
+    lookup = union_all(
+        select(User).where(User.username == username),
+        select(User).where(User.email == username)
+    )
+    user = db.session.execute(
+        select(User).from_statement(lookup)
+    ).scalars().first()
+    
+    if not user:
+        # Same hashing cost as a real check so timing does not reveal valid usernames
+        User.check_dummy_password(password)
+        return jsonify({'error': 'Invalid credentials'}), 401
+    
+    if not user.check_password(password):
+        return jsonify({'error': 'Invalid credentials'}), 401
+    
+    if not user.is_active:
+        return jsonify({'error': 'Account is deactivated'}), 401
+    
+    # Upgrade bcrypt or outdated hashes now that the plain password is known
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
+    
+    # Create tokens
+    access_token = create_access_token(identity=user.id, additional_claims={'role': user.role})
+    refresh_token = create_refresh_token(identity=user.id)
+    
+    return jsonify({
+        'message': 'Login successful',
+        'access_token': access_token,
+        'refresh_token': refresh_token,
+        'user': user.to_dict()
+    }), 200
 
 @auth_bp.route('/register', methods=['POST'])
 @jwt_required()
 def register():
-    try:
-        # Only admins can register new users
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if not current_user or current_user.role != 'Admin':
-            return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
-        
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['username', 'email', 'password', 'first_name', 'last_name', 'role']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} is required'}), 400
-        
-        # Check if username or email already exists
-        existing_user = User.query.filter(
-            (User.username == data['username']) | (User.email == data['email'])
-        ).first()
-        
-        if existing_user:
-            return jsonify({'error': 'Username or email already exists'}), 400
-        
-        # Validate role
-        valid_roles = ['Admin', 'Cashier', 'InventoryManager']
-        if data['role'] not in valid_roles:
-            return jsonify({'error': f'Invalid role. Must be one of: {", ".join(valid_roles)}'}), 400
-        
-        # Create new user
-        new_user = User(
-            username=data['username'],
-            email=data['email'],
-            first_name=data['first_name'],
-            last_name=data['last_name'],
-            role=data['role'],
-            is_active=data.get('is_active', True)
-        )
-        new_user.set_password(data['password'])
-        
-        db.session.add(new_user)
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'User registered successfully',
-            'user': new_user.to_dict()
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    # Only admins can register new users
+    if current_role() != 'Admin':
+        return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
+    
+    data = request.get_json()
+    
+    # Validate required fields
+    required_fields = ['username', 'email', 'password', 'first_name', 'last_name', 'role']
+    for field in required_fields:
+        if not data.get(field):
+            return jsonify({'error': f'{field} is required'}), 400
+    
+    # Check if username or email already exists
+    existing_user = User.query.filter(
+        (User.username == data['username']) | (User.email == data['email'])
+    ).first()
+    
+    if existing_user:
+        return jsonify({'error': 'Username or email already exists'}), 400
+    
+    # Validate role
+    valid_roles = ['Admin', 'Cashier', 'InventoryManager']
+    if data['role'] not in valid_roles:
+        return jsonify({'error': f'Invalid role. Must be one of: {", ".join(valid_roles)}'}), 400
+    
+    # Create new user
+    new_user = User(
+        username=data['username'],
+        email=data['email'],
+        first_name=data['first_name'],
+        last_name=data['last_name'],
+        role=data['role'],
+        is_active=data.get('is_active', True)
+    )
+    new_user.set_password(data['password'])
+    
+    db.session.add(new_user)
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'User registered successfully',
+        'user': new_user.to_dict()
+    }), 201
 
 @auth_bp.route('/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh():
-    try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
-        
-        if not user or not user.is_active:
-            return jsonify({'error': 'User not found or inactive'}), 404
-        
-        new_token = create_access_token(identity=current_user_id)
-        
-        return jsonify({
-            'access_token': new_token,
-            'user': user.to_dict()
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    current_user_id = get_jwt_identity()
+    user = load_current_user()
+    
+    if not user or not user.is_active:
+        return jsonify({'error': 'User not found or inactive'}), 404
+    
+    new_token = create_access_token(identity=current_user_id, additional_claims={'role': user.role})
+    
+    return jsonify({
+        'access_token': new_token,
+        'user': user.to_dict()
+    }), 200
 
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        return jsonify({'user': user.to_dict()}), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    user = load_current_user()
+    
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    return jsonify({'user': user.to_dict()}), 200
 
 @auth_bp.route('/change-password', methods=['POST'])
 @jwt_required()
 def change_password():
-    try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        data = request.get_json()
-        
-        if not data.get('current_password') or not data.get('new_password'):
-            return jsonify({'error': 'Current password and new password are required'}), 400
-        
-        if not user.check_password(data['current_password']):
-            return jsonify({'error': 'Current password is incorrect'}), 400
-        
-        if len(data['new_password']) < 6:
-            return jsonify({'error': 'New password must be at least 6 characters long'}), 400
-        
-        user.set_password(data['new_password'])
-        user.updated_at = datetime.utcnow()
-        db.session.commit()
-        
-        return jsonify({'message': 'Password changed successfully'}), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    user = load_current_user()
+    
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    data = request.get_json()
+    
+    if not data.get('current_password') or not data.get('new_password'):
+        return jsonify({'error': 'Current password and new password are required'}), 400
+    
+    if not user.check_password(data['current_password']):
+        return jsonify({'error': 'Current password is incorrect'}), 400
+    
+    if len(data['new_password']) < 6:
+        return jsonify({'error': 'New password must be at least 6 characters long'}), 400
+    
+    user.set_password(data['new_password'])
+    db.session.commit()
+    
+    return jsonify({'message': 'Password changed successfully'}), 200
 
 @auth_bp.route('/logout', methods=['POST'])
 @jwt_required()
 def logout():
-    # In a production environment, you would typically blacklist the token
-    # For now, we'll just return a success message
+    claims = get_jwt()
+    current_app.extensions['token_blocklist'].revoke(claims['jti'], claims['exp'])
     return jsonify({'message': 'Logged out successfully'}), 200
 
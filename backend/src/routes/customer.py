@@ -1,17 +1,20 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Customer
+from flask_jwt_extended import jwt_required
+from src.models.user import db, Customer
 from src.models.sales import Sale, LoyaltyTransaction
+from src.routes.auth import current_role
 from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, undefer, raiseload
+from src.pagination import page_args, page_ids, page_count, decode_cursor, next_cursor, before_cursor
 import uuid
 
 customer_bp = Blueprint('customer', __name__)
 
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
 
 def generate_customer_code():
     """Generate unique customer code"""
@@ -26,30 +29,42 @@ def get_customers():
         search = request.args.get('search', '')
         active_only = request.args.get('active_only', 'true').lower() == 'true'
         
+        page, per_page = page_args(page, per_page)
         query = Customer.query
         
         if active_only:
             query = query.filter(Customer.is_active == True)
         
         if search:
-            query = query.filter(
-                (Customer.first_name.contains(search)) |
-                (Customer.last_name.contains(search)) |
-                (Customer.email.contains(search)) |
-                (Customer.phone.contains(search)) |
-                (Customer.customer_code.contains(search))
-            )
-        
-        customers = query.order_by(Customer.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+            query = query.filter(Customer.search_text.ilike(f'%{search}%'))
+        
+        total = query.count()
+        
+        # Keyset pagination: ?cursor= continues after the last customer seen
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            query = query.filter(before_cursor(Customer.created_at, Customer.id, position))
+            page = 1
+        
+        order_by = (Customer.created_at.desc(), Customer.id.desc())
+        ids = page_ids(query, Customer.id, order_by, page, per_page)
+        # Customer.to_dict() touches no relationships; raiseload('*') keeps it that
+        # way by failing loudly instead of issuing a query per row
+        customers = Customer.query.options(raiseload('*')).filter(
+            Customer.id.in_(ids)
+        ).order_by(*order_by).all()
         
         return jsonify({
-            'customers': [customer.to_dict() for customer in customers.items],
-            'total': customers.total,
-            'pages': customers.pages,
+            'customers': [customer.to_dict() for customer in customers],
+            'total': total,
+            'pages': page_count(total, per_page),
             'current_page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'next_cursor': next_cursor(customers, per_page)
         }), 200
         
     except Exception as e:
@@ -59,16 +74,20 @@ def get_customers():
 @jwt_required()
 def get_customer(customer_id):
     try:
-        customer = Customer.query.get(customer_id)
+        customer = Customer.query.options(undefer(Customer.address)).get(customer_id)
         
         if not customer:
             return jsonify({'error': 'Customer not found'}), 404
         
         # Get customer's purchase history
-        sales = Sale.query.filter_by(customer_id=customer_id).order_by(Sale.sale_date.desc()).limit(10).all()
+        sales = Sale.query.options(
+            selectinload(Sale.cashier)
+        ).filter_by(customer_id=customer_id).order_by(Sale.sale_date.desc()).limit(10).all()
         
         # Get loyalty transactions
-        loyalty_transactions = LoyaltyTransaction.query.filter_by(customer_id=customer_id).order_by(LoyaltyTransaction.created_at.desc()).limit(10).all()
+        loyalty_transactions = LoyaltyTransaction.query.options(
+            selectinload(LoyaltyTransaction.sale)
+        ).filter_by(customer_id=customer_id).order_by(LoyaltyTransaction.created_at.desc()).limit(10).all()
         
         customer_dict = customer.to_dict()
         customer_dict['recent_sales'] = [sale.to_dict() for sale in sales]
@@ -91,19 +110,12 @@ def create_customer():
             if not data.get(field):
                 return jsonify({'error': f'{field} is required'}), 400
         
-        # Check if email already exists (if provided)
-        if data.get('email'):
-            existing_customer = Customer.query.filter_by(email=data['email']).first()
-            if existing_customer:
-                return jsonify({'error': 'Email already exists'}), 400
-        
-        # Generate customer code if not provided
-        customer_code = data.get('customer_code') or generate_customer_code()
-        
-        # Check if customer code already exists
-        existing_code = Customer.query.filter_by(customer_code=customer_code).first()
-        if existing_code:
-            return jsonify({'error': 'Customer code already exists'}), 400
+        # customer_code uniqueness is left to the unique index; email is matched
+        # case-insensitively through the lower(email) index
+        if data.get('email') and db.session.query(
+            Customer.query.filter(func.lower(Customer.email) == func.lower(data['email'])).exists()
+        ).scalar():
+            return jsonify({'error': 'Email already exists'}), 400
         
         # Parse date of birth if provided
         date_of_birth = None
@@ -113,9 +125,8 @@ def create_customer():
             except ValueError:
                 return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
-        # Create new customer
-        new_customer = Customer(
-            customer_code=customer_code,
+        # Create new customer; a generated code that collides is regenerated
+        values = dict(
             first_name=data['first_name'],
             last_name=data['last_name'],
             email=data.get('email'),
@@ -124,8 +135,23 @@ def create_customer():
             date_of_birth=date_of_birth,
             is_active=data.get('is_active', True)
         )
+        attempts = 1 if data.get('customer_code') else 3
+        new_customer = None
+        try:
+            for _ in range(attempts):
+                customer_code = data.get('customer_code') or generate_customer_code()
+                new_customer = Customer.insert_unless_code_exists(customer_code=customer_code, **values)
+                if new_customer:
+                    break
+        except IntegrityError:
+            # lower(email) is unique; a concurrent insert won the race
+            db.session.rollback()
+            return jsonify({'error': 'Email already exists'}), 400
+        
+        if not new_customer:
+            db.session.rollback()
+            return jsonify({'error': 'Customer code already exists'}), 400
         
-        db.session.add(new_customer)
         db.session.commit()
         
         return jsonify({
@@ -148,8 +174,10 @@ def update_customer(customer_id):
         data = request.get_json()
         
         # Check if email already exists (if changed)
-        if data.get('email') and data['email'] != customer.email:
-            existing_customer = Customer.query.filter_by(email=data['email']).first()
+        if data.get('email') and data['email'].lower() != (customer.email or '').lower():
+            existing_customer = Customer.query.filter(
+                func.lower(Customer.email) == func.lower(data['email'])
+            ).first()
             if existing_customer:
                 return jsonify({'error': 'Email already exists'}), 400
         
@@ -176,7 +204,6 @@ def update_customer(customer_id):
             if field in data:
                 setattr(customer, field, data[field])
         
-        customer.updated_at = datetime.utcnow()
         db.session.commit()
         
         return jsonify({
@@ -201,7 +228,6 @@ def delete_customer(customer_id):
         
         # Soft delete - just mark as inactive
         customer.is_active = False
-        customer.updated_at = datetime.utcnow()
         db.session.commit()
         
         return jsonify({'message': 'Customer deleted successfully'}), 200
@@ -217,16 +243,12 @@ def search_customers():
         query = request.args.get('q', '')
         limit = request.args.get('limit', 10, type=int)
         
-        if not query:
+        if not query.strip():
             return jsonify({'customers': []}), 200
         
         customers = Customer.query.filter(
             Customer.is_active == True,
-            (Customer.first_name.contains(query)) |
-            (Customer.last_name.contains(query)) |
-            (Customer.email.contains(query)) |
-            (Customer.phone.contains(query)) |
-            (Customer.customer_code.contains(query))
+            Customer.token_search(query)
         ).limit(limit).all()
         
         return jsonify({
@@ -248,19 +270,31 @@ def get_customer_loyalty(customer_id):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         
-        transactions = LoyaltyTransaction.query.filter_by(customer_id=customer_id).order_by(
-            LoyaltyTransaction.created_at.desc()
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        page, per_page = page_args(page, per_page)
+        order_by = (LoyaltyTransaction.created_at.desc(), LoyaltyTransaction.id.desc())
+        # One extra id tells whether another page exists; the total comes from
+        # the counter kept on the customer instead of a COUNT(*)
+        ids = [
+            row[0] for row in LoyaltyTransaction.query.filter_by(customer_id=customer_id)
+            .with_entities(LoyaltyTransaction.id).order_by(*order_by)
+            .limit(per_page + 1).offset((page - 1) * per_page)
+        ]
+        has_more = len(ids) > per_page
+        total = customer.loyalty_transaction_count
+        transactions = LoyaltyTransaction.query.options(
+            selectinload(LoyaltyTransaction.sale)
+        ).filter(LoyaltyTransaction.id.in_(ids[:per_page])).order_by(*order_by).all()
         
         return jsonify({
             'customer_id': customer_id,
             'current_points': customer.loyalty_points,
-            'total_purchases': float(customer.total_purchases),
-            'transactions': [transaction.to_dict() for transaction in transactions.items],
-            'total': transactions.total,
-            'pages': transactions.pages,
+            'total_purchases': customer.total_purchases or 0,
+            'transactions': [transaction.to_dict() for transaction in transactions],
+            'total': total,
+            'pages': page_count(total, per_page),
             'current_page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'has_more': has_more
         }), 200
         
     except Exception as e:
@@ -287,7 +321,7 @@ def adjust_loyalty_points(customer_id):
         
         # Update customer points
         customer.loyalty_points += points
-        customer.updated_at = datetime.utcnow()
+        customer.loyalty_transaction_count = Customer.loyalty_transaction_count + 1
         
         # Create loyalty transaction
         transaction = LoyaltyTransaction(
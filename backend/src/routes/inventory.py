@@ -1,17 +1,25 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Product, Branch
+from src.models.user import db, Product, Branch
 from src.models.inventory import Inventory, StockMovement
+from src.routes.auth import current_role
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import func, insert
+from sqlalchemy.orm import joinedload, contains_eager
+from src.pagination import page_args, paginate_ids, page_ids, page_count, decode_cursor, next_cursor, before_cursor
+from src.streaming import stream_json
+import uuid
 
 inventory_bp = Blueprint('inventory', __name__)
 
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
+
+def generate_transfer_reference():
+    """Generate unique transfer reference"""
+    today = datetime.now().strftime('%Y%m%d')
+    return f"TRANSFER-{today}-{uuid.uuid4().hex[:12].upper()}"
 
 @inventory_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -23,29 +31,28 @@ def get_inventory():
         low_stock_only = request.args.get('low_stock_only', 'false').lower() == 'true'
         search = request.args.get('search', '')
         
+        page, per_page = page_args(page, per_page)
         query = db.session.query(Inventory).join(Product)
         
         if branch_id:
             query = query.filter(Inventory.branch_id == branch_id)
         
         if search:
-            query = query.filter(
-                (Product.product_name.contains(search)) |
-                (Product.product_code.contains(search)) |
-                (Product.barcode.contains(search))
-            )
+            query = query.filter(Product.search_text.ilike(f'%{search}%'))
         
         if low_stock_only:
             query = query.filter(Inventory.current_stock <= Product.reorder_level)
         
-        inventory_records = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        ids, total = paginate_ids(query, Inventory.id, (Inventory.id,), page, per_page)
+        inventory_records = db.session.query(Inventory).join(Product).options(
+            contains_eager(Inventory.product),
+            joinedload(Inventory.branch)
+        ).filter(Inventory.id.in_(ids)).order_by(Inventory.id).all()
         
         return jsonify({
-            'inventory': [record.to_dict() for record in inventory_records.items],
-            'total': inventory_records.total,
-            'pages': inventory_records.pages,
+            'inventory': [record.to_dict(include=('product', 'branch')) for record in inventory_records],
+            'total': total,
+            'pages': page_count(total, per_page),
             'current_page': page,
             'per_page': per_page
         }), 200
@@ -57,15 +64,67 @@ def get_inventory():
 @jwt_required()
 def get_product_inventory(product_id):
     try:
-        inventory_records = Inventory.query.filter_by(product_id=product_id).all()
+        inventory_records = Inventory.query.options(
+            joinedload(Inventory.product),
+            joinedload(Inventory.branch)
+        ).filter_by(product_id=product_id).all()
         
         return jsonify({
-            'inventory': [record.to_dict() for record in inventory_records]
+            'inventory': [record.to_dict(include=('product', 'branch')) for record in inventory_records]
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def apply_stock_adjustment(data, user_id):
+    """Validate one adjustment and apply it to inventory
+
+    Returns (inventory, movement_row, None) on success or
+    (None, None, (message, status)) when the adjustment is rejected.
+    """
+    # Validate required fields
+    required_fields = ['product_id', 'branch_id', 'quantity', 'movement_type']
+    for field in required_fields:
+        if field not in data:
+            return None, None, (f'{field} is required', 400)
+    
+    product_id = data['product_id']
+    branch_id = data['branch_id']
+    quantity = data['quantity']
+    movement_type = data['movement_type']  # IN, OUT, ADJUSTMENT
+    
+    # Validate product and branch exist
+    if not Product.query.get(product_id):
+        return None, None, ('Product not found', 404)
+    
+    if not Branch.query.get(branch_id):
+        return None, None, ('Branch not found', 404)
+    
+    # Update inventory in a single statement; the row is created if missing
+    if movement_type == 'IN':
+        inventory = Inventory.upsert_stock(product_id, branch_id, quantity)
+    elif movement_type == 'OUT':
+        inventory = Inventory.take_stock(product_id, branch_id, quantity)
+        if inventory is None:
+            return None, None, ('Insufficient stock', 400)
+    elif movement_type == 'ADJUSTMENT':
+        # Direct adjustment to specific quantity
+        inventory = Inventory.upsert_stock(product_id, branch_id, quantity, absolute=True)
+    else:
+        return None, None, ('Invalid movement type', 400)
+    
+    movement_row = {
+        'product_id': product_id,
+        'branch_id': branch_id,
+        'movement_type': movement_type,
+        'quantity': quantity if movement_type != 'OUT' else -quantity,
+        'unit_cost': data.get('unit_cost'),
+        'reference': data.get('reference', ''),
+        'notes': data.get('notes', ''),
+        'created_by': user_id
+    }
+    return inventory, movement_row, None
+
 @inventory_bp.route('/adjust', methods=['POST'])
 @jwt_required()
 def adjust_stock():
@@ -74,79 +133,47 @@ def adjust_stock():
             return jsonify({'error': 'Unauthorized. Admin or Inventory Manager access required.'}), 403
         
         data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['product_id', 'branch_id', 'quantity', 'movement_type']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'{field} is required'}), 400
-        
-        product_id = data['product_id']
-        branch_id = data['branch_id']
-        quantity = data['quantity']
-        movement_type = data['movement_type']  # IN, OUT, ADJUSTMENT
-        unit_cost = data.get('unit_cost')
-        reference = data.get('reference', '')
-        notes = data.get('notes', '')
-        
-        # Validate product and branch exist
-        product = Product.query.get(product_id)
-        if not product:
-            return jsonify({'error': 'Product not found'}), 404
-        
-        branch = Branch.query.get(branch_id)
-        if not branch:
-            return jsonify({'error': 'Branch not found'}), 404
-        
-        # Get or create inventory record
-        inventory = Inventory.query.filter_by(
-            product_id=product_id, 
-            branch_id=branch_id
-        ).first()
-        
-        if not inventory:
-            inventory = Inventory(
-                product_id=product_id,
-                branch_id=branch_id,
-                current_stock=0
-            )
-            db.session.add(inventory)
-        
-        # Calculate new stock level
-        if movement_type == 'IN':
-            new_stock = inventory.current_stock + quantity
-        elif movement_type == 'OUT':
-            if inventory.current_stock < quantity:
-                return jsonify({'error': 'Insufficient stock'}), 400
-            new_stock = inventory.current_stock - quantity
-        elif movement_type == 'ADJUSTMENT':
-            new_stock = quantity  # Direct adjustment to specific quantity
-        else:
-            return jsonify({'error': 'Invalid movement type'}), 400
-        
-        # Update inventory
-        inventory.current_stock = new_stock
-        inventory.last_updated = datetime.utcnow()
+        user_id = get_jwt_identity()
+        
+        # A list of adjustments is applied all-or-nothing with one commit and
+        # one executemany INSERT for the movements
+        if isinstance(data, list):
+            inventories = []
+            movement_rows = []
+            for index, item in enumerate(data):
+                inventory, movement_row, error = apply_stock_adjustment(item, user_id)
+                if error:
+                    db.session.rollback()
+                    message, status = error
+                    return jsonify({'error': f'Item {index}: {message}'}), status
+                inventories.append(inventory)
+                movement_rows.append(movement_row)
+            
+            if movement_rows:
+                db.session.execute(insert(StockMovement), movement_rows)
+            db.session.commit()
+            
+            return jsonify({
+                'message': 'Stock adjusted successfully',
+                'inventory': [inventory.to_dict(include=('product', 'branch')) for inventory in inventories]
+            }), 200
+        
+        inventory, movement_row, error = apply_stock_adjustment(data, user_id)
+        if error:
+            db.session.rollback()
+            message, status = error
+            return jsonify({'error': message}), status
         
         # Create stock movement record
-        stock_movement = StockMovement(
-            product_id=product_id,
-            branch_id=branch_id,
-            movement_type=movement_type,
-            quantity=quantity if movement_type != 'OUT' else -quantity,
-            unit_cost=unit_cost,
-            reference=reference,
-            notes=notes,
-            created_by=get_jwt_identity()
-        )
+        stock_movement = StockMovement(**movement_row)
         
         db.session.add(stock_movement)
         db.session.commit()
         
         return jsonify({
             'message': 'Stock adjusted successfully',
-            'inventory': inventory.to_dict(),
-            'movement': stock_movement.to_dict()
+            'inventory': inventory.to_dict(include=('product', 'branch')),
+            'movement': stock_movement.to_dict(include=('product', 'branch', 'user'))
         }), 200
         
     except Exception as e:
@@ -187,67 +214,51 @@ def transfer_stock():
         if not from_branch or not to_branch:
             return jsonify({'error': 'Branch not found'}), 404
         
-        # Get source inventory
-        from_inventory = Inventory.query.filter_by(
-            product_id=product_id, 
-            branch_id=from_branch_id
-        ).first()
+        # Lock both rows in branch order first, so two opposite transfers of the
+        # same product serialize instead of deadlocking on each other's row
+        Inventory.query.filter(
+            Inventory.product_id == product_id,
+            Inventory.branch_id.in_([from_branch_id, to_branch_id])
+        ).order_by(Inventory.branch_id).with_for_update().all()
         
-        if not from_inventory or from_inventory.available_stock < quantity:
+        # Take from the source only if enough is available, then upsert the destination
+        from_inventory = Inventory.take_stock(product_id, from_branch_id, quantity, available_only=True)
+        if from_inventory is None:
             return jsonify({'error': 'Insufficient stock in source branch'}), 400
         
-        # Get or create destination inventory
-        to_inventory = Inventory.query.filter_by(
-            product_id=product_id, 
-            branch_id=to_branch_id
-        ).first()
-        
-        if not to_inventory:
-            to_inventory = Inventory(
-                product_id=product_id,
-                branch_id=to_branch_id,
-                current_stock=0
-            )
-            db.session.add(to_inventory)
-        
-        # Update inventories
-        from_inventory.current_stock -= quantity
-        from_inventory.last_updated = datetime.utcnow()
-        
-        to_inventory.current_stock += quantity
-        to_inventory.last_updated = datetime.utcnow()
+        to_inventory = Inventory.upsert_stock(product_id, to_branch_id, quantity)
         
         # Create stock movement records
-        transfer_ref = f"TRANSFER-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-        
-        out_movement = StockMovement(
-            product_id=product_id,
-            branch_id=from_branch_id,
-            movement_type='TRANSFER',
-            quantity=-quantity,
-            reference=transfer_ref,
-            notes=f"Transfer to {to_branch.branch_name}. {notes}",
-            created_by=get_jwt_identity()
-        )
-        
-        in_movement = StockMovement(
-            product_id=product_id,
-            branch_id=to_branch_id,
-            movement_type='TRANSFER',
-            quantity=quantity,
-            reference=transfer_ref,
-            notes=f"Transfer from {from_branch.branch_name}. {notes}",
-            created_by=get_jwt_identity()
-        )
-        
-        db.session.add(out_movement)
-        db.session.add(in_movement)
+        user_id = get_jwt_identity()
+        transfer_ref = generate_transfer_reference()
+        
+        # Both movements go out in one executemany INSERT
+        db.session.execute(insert(StockMovement), [
+            {
+                'product_id': product_id,
+                'branch_id': from_branch_id,
+                'movement_type': 'TRANSFER',
+                'quantity': -quantity,
+                'reference': transfer_ref,
+                'notes': f"Transfer to {to_branch.branch_name}. {notes}",
+                'created_by': user_id
+            },
+            {
+                'product_id': product_id,
+                'branch_id': to_branch_id,
+                'movement_type': 'TRANSFER',
+                'quantity': quantity,
+                'reference': transfer_ref,
+                'notes': f"Transfer from {from_branch.branch_name}. {notes}",
+                'created_by': user_id
+            }
+        ])
         db.session.commit()
         
         return jsonify({
             'message': 'Stock transferred successfully',
-            'from_inventory': from_inventory.to_dict(),
-            'to_inventory': to_inventory.to_dict(),
+            'from_inventory': from_inventory.to_dict(include=('product', 'branch')),
+            'to_inventory': to_inventory.to_dict(include=('product', 'branch')),
             'transfer_reference': transfer_ref
         }), 200
         
@@ -265,6 +276,7 @@ def get_stock_movements():
         branch_id = request.args.get('branch_id', type=int)
         movement_type = request.args.get('movement_type')
         
+        page, per_page = page_args(page, per_page)
         query = StockMovement.query
         
         if product_id:
@@ -276,16 +288,33 @@ def get_stock_movements():
         if movement_type:
             query = query.filter(StockMovement.movement_type == movement_type)
         
-        movements = query.order_by(StockMovement.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        total = query.count()
+        
+        # Keyset pagination: ?cursor= continues after the last movement seen
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            query = query.filter(before_cursor(StockMovement.created_at, StockMovement.id, position))
+            page = 1
+        
+        order_by = (StockMovement.created_at.desc(), StockMovement.id.desc())
+        ids = page_ids(query, StockMovement.id, order_by, page, per_page)
+        movements = StockMovement.query.options(
+            joinedload(StockMovement.product),
+            joinedload(StockMovement.branch),
+            joinedload(StockMovement.user)
+        ).filter(StockMovement.id.in_(ids)).order_by(*order_by).all()
         
         return jsonify({
-            'movements': [movement.to_dict() for movement in movements.items],
-            'total': movements.total,
-            'pages': movements.pages,
+            'movements': [movement.to_dict(include=('product', 'branch', 'user')) for movement in movements],
+            'total': total,
+            'pages': page_count(total, per_page),
             'current_page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'next_cursor': next_cursor(movements, per_page)
         }), 200
         
     except Exception as e:
@@ -297,7 +326,22 @@ def get_low_stock_items():
     try:
         branch_id = request.args.get('branch_id', type=int)
         
-        query = db.session.query(Inventory).join(Product).filter(
+        # Plain row tuples; no ORM instances are built for this list
+        query = db.session.query(
+            Inventory.id,
+            Inventory.product_id,
+            Inventory.branch_id,
+            Inventory.current_stock,
+            Inventory.reserved_stock,
+            Inventory.available_stock.label('available_stock'),
+            Inventory.last_updated,
+            Product.product_name,
+            Product.product_code,
+            Product.reorder_level,
+            Branch.branch_name
+        ).join(Product, Inventory.product_id == Product.id).join(
+            Branch, Inventory.branch_id == Branch.id
+        ).filter(
             Inventory.current_stock <= Product.reorder_level,
             Product.is_active == True
         )
@@ -305,12 +349,13 @@ def get_low_stock_items():
         if branch_id:
             query = query.filter(Inventory.branch_id == branch_id)
         
-        low_stock_items = query.all()
+        count = query.with_entities(func.count(Inventory.id)).scalar()
         
-        return jsonify({
-            'low_stock_items': [item.to_dict() for item in low_stock_items],
-            'count': len(low_stock_items)
-        }), 200
+        # The count comes from SQL; detail rows are streamed from the cursor
+        return stream_json(
+            '{"count": ' + str(count) + ', "low_stock_items": [',
+            iter(query.yield_per(1000))
+        ), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -321,36 +366,29 @@ def get_inventory_valuation():
     try:
         branch_id = request.args.get('branch_id', type=int)
         
+        filters = [Product.is_active == True]
+        
+        if branch_id:
+            filters.append(Inventory.branch_id == branch_id)
+        
+        total_value = db.session.query(
+            func.coalesce(func.sum(Inventory.current_stock * Product.cost_price), 0)
+        ).select_from(Inventory).join(Product).filter(*filters).scalar()
+        
         query = db.session.query(
             Inventory.product_id,
             Inventory.branch_id,
             Inventory.current_stock,
             Product.product_name,
-            Product.cost_price,
-            (Inventory.current_stock * Product.cost_price).label('total_value')
-        ).join(Product).filter(Product.is_active == True)
-        
-        if branch_id:
-            query = query.filter(Inventory.branch_id == branch_id)
-        
-        valuation_data = query.all()
-        
-        total_value = sum(item.total_value for item in valuation_data if item.total_value)
-        
-        return jsonify({
-            'valuation': [
-                {
-                    'product_id': item.product_id,
-                    'branch_id': item.branch_id,
-                    'product_name': item.product_name,
-                    'current_stock': item.current_stock,
-                    'cost_price': float(item.cost_price) if item.cost_price else 0,
-                    'total_value': float(item.total_value) if item.total_value else 0
-                }
-                for item in valuation_data
-            ],
-            'total_inventory_value': float(total_value)
-        }), 200
+            func.coalesce(Product.cost_price, 0).label('cost_price'),
+            func.coalesce(Inventory.current_stock * Product.cost_price, 0).label('total_value')
+        ).join(Product).filter(*filters)
+        
+        # The total is summed by the database; detail rows are streamed from the cursor
+        return stream_json(
+            '{"total_inventory_value": ' + current_app.json.dumps(total_value) + ', "valuation": [',
+            iter(query.yield_per(1000))
+        ), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,17 +1,29 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Product, Category, Supplier
+from flask_jwt_extended import jwt_required
+from src.models.user import db, Product, Category, Supplier, clear_barcode_cache
 from src.models.inventory import Inventory
-from datetime import datetime
+from src.routes.auth import current_role
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only, undefer
+from src.pagination import page_args, page_count
+from src.conditional import etag_for, conditional_response
 import uuid
 
 product_bp = Blueprint('product', __name__)
 
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
+
+def duplicate_error_response(error):
+    """Map a unique violation on product_code or barcode to a 400; re-raise anything else"""
+    message = str(error.orig)
+    if 'barcode' in message:
+        return jsonify({'error': 'Barcode already exists'}), 400
+    if 'product_code' in message:
+        return jsonify({'error': 'Product code already exists'}), 400
+    raise error
 
 @product_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -22,33 +34,46 @@ def get_products():
         search = request.args.get('search', '')
         category_id = request.args.get('category_id', type=int)
         active_only = request.args.get('active_only', 'true').lower() == 'true'
+        after_id = request.args.get('after_id', type=int)
+        summary = request.args.get('fields') == 'summary'
+        page, per_page = page_args(page, per_page)
         
         query = Product.query
+        if summary:
+            # Narrow rows: only the columns to_dict_summary() reads are selected
+            query = query.options(load_only(*(getattr(Product, name) for name in Product.SUMMARY_COLUMNS)))
         
         if active_only:
             query = query.filter(Product.is_active == True)
         
         if search:
-            query = query.filter(
-                (Product.product_name.contains(search)) |
-                (Product.product_code.contains(search)) |
-                (Product.barcode.contains(search))
-            )
+            query = query.filter(Product.search_text.ilike(f'%{search}%'))
         
         if category_id:
             query = query.filter(Product.category_id == category_id)
         
-        products = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if after_id is not None:
+            # Keyset pagination: ?after_id= seeks past the last id seen instead of OFFSET
+            total = query.count()
+            products = query.filter(Product.id > after_id).order_by(Product.id).limit(per_page).all()
+        else:
+            paginated = query.order_by(Product.id).paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            total, products = paginated.total, paginated.items
         
-        return jsonify({
-            'products': [product.to_dict() for product in products.items],
-            'total': products.total,
-            'pages': products.pages,
+        response = jsonify({
+            'products': [product.to_dict_summary() if summary else product.to_dict() for product in products],
+            'total': total,
+            'pages': page_count(total, per_page),
             'current_page': page,
-            'per_page': per_page
-        }), 200
+            'per_page': per_page,
+            'next_after_id': products[-1].id if len(products) == per_page else None
+        })
+        if after_id is None and 'page' in request.args:
+            # Offset paging still works, but clients should follow next_after_id
+            response.headers['Deprecation'] = 'true'
+        return response, 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -57,17 +82,26 @@ def get_products():
 @jwt_required()
 def get_product(product_id):
     try:
-        product = Product.query.get(product_id)
+        product = Product.query.options(undefer(Product.description)).get(product_id)
         
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
         # Get inventory information
-        inventory_records = Inventory.query.filter_by(product_id=product_id).all()
-        product_dict = product.to_dict()
-        product_dict['inventory'] = [inv.to_dict() for inv in inventory_records]
+        inventory_records = Inventory.query.options(
+            joinedload(Inventory.branch)
+        ).filter_by(product_id=product_id).all()
         
-        return jsonify({'product': product_dict}), 200
+        def build_payload():
+            product_dict = product.to_dict()
+            product_dict['inventory'] = [inv.to_dict(include=('branch',)) for inv in inventory_records]
+            return {'product': product_dict}
+        
+        # Stock levels are part of the payload, so their timestamps are part of the ETag
+        etag = etag_for(product.id, product.updated_at, *(
+            (inv.id, inv.last_updated) for inv in inventory_records
+        ))
+        return conditional_response(etag, build_payload)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -91,17 +125,6 @@ def create_product():
         if not data.get('product_code'):
             data['product_code'] = f"PRD-{str(uuid.uuid4())[:8].upper()}"
         
-        # Check if product code already exists
-        existing_product = Product.query.filter_by(product_code=data['product_code']).first()
-        if existing_product:
-            return jsonify({'error': 'Product code already exists'}), 400
-        
-        # Check if barcode already exists (if provided)
-        if data.get('barcode'):
-            existing_barcode = Product.query.filter_by(barcode=data['barcode']).first()
-            if existing_barcode:
-                return jsonify({'error': 'Barcode already exists'}), 400
-        
         # Validate category exists
         category = Category.query.get(data['category_id'])
         if not category:
@@ -132,7 +155,12 @@ def create_product():
         )
         
         db.session.add(new_product)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            # product_code and barcode uniqueness is enforced by their unique indexes
+            db.session.rollback()
+            return duplicate_error_response(e)
         
         return jsonify({
             'message': 'Product created successfully',
@@ -156,18 +184,6 @@ def update_product(product_id):
         
         data = request.get_json()
         
-        # Check if product code already exists (if changed)
-        if data.get('product_code') and data['product_code'] != product.product_code:
-            existing_product = Product.query.filter_by(product_code=data['product_code']).first()
-            if existing_product:
-                return jsonify({'error': 'Product code already exists'}), 400
-        
-        # Check if barcode already exists (if changed)
-        if data.get('barcode') and data['barcode'] != product.barcode:
-            existing_barcode = Product.query.filter_by(barcode=data['barcode']).first()
-            if existing_barcode:
-                return jsonify({'error': 'Barcode already exists'}), 400
-        
         # Validate category exists (if changed)
         if data.get('category_id') and data['category_id'] != product.category_id:
             category = Category.query.get(data['category_id'])
@@ -191,8 +207,12 @@ def update_product(product_id):
             if field in data:
                 setattr(product, field, data[field])
         
-        product.updated_at = datetime.utcnow()
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            return duplicate_error_response(e)
+        clear_barcode_cache()
         
         return jsonify({
             'message': 'Product updated successfully',
@@ -216,8 +236,8 @@ def delete_product(product_id):
         
         # Soft delete - just mark as inactive
         product.is_active = False
-        product.updated_at = datetime.utcnow()
         db.session.commit()
+        clear_barcode_cache()
         
         return jsonify({'message': 'Product deleted successfully'}), 200
         
@@ -235,12 +255,21 @@ def search_products():
         if not query:
             return jsonify({'products': []}), 200
         
-        products = Product.query.filter(
-            Product.is_active == True,
-            (Product.product_name.contains(query)) |
-            (Product.product_code.contains(query)) |
-            (Product.barcode.contains(query))
-        ).limit(limit).all()
+        products = []
+        
+        # A scanned barcode is tried as an exact code first: two unique-index
+        # probes instead of a substring search
+        if query.isdigit() and len(query) >= 6:
+            products = Product.query.filter(
+                Product.is_active == True,
+                or_(Product.barcode == query, Product.product_code == query)
+            ).limit(limit).all()
+        
+        if not products:
+            products = Product.query.filter(
+                Product.is_active == True,
+                Product.search_text.ilike(f'%{query}%')
+            ).limit(limit).all()
         
         return jsonify({
             'products': [product.to_dict() for product in products]
@@ -253,12 +282,17 @@ def search_products():
 @jwt_required()
 def get_product_by_barcode(barcode):
     try:
-        product = Product.query.filter_by(barcode=barcode, is_active=True).first()
+        # The hottest lookup in the app; served from a short-lived per-process cache
+        product = Product.get_cached_by_barcode(barcode)
         
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
-        return jsonify({'product': product.to_dict()}), 200
+        # Scanners re-fetch the same products constantly; unchanged ones get a 304
+        return conditional_response(
+            etag_for(product['id'], product['updated_at']),
+            lambda: {'product': product}
+        )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
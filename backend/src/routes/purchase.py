@@ -1,23 +1,31 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Product, Branch, Supplier
+from src.models.user import db, Product, Branch, Supplier
 from src.models.inventory import PurchaseOrder, PurchaseOrderItem, Inventory, StockMovement
+from src.routes.auth import current_role
 from datetime import datetime, date
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import joinedload, selectinload, raiseload
+from src.conditional import etag_for, conditional_response
+from src.schemas import PurchaseOrderIn, validation_error_message
+from pydantic import ValidationError
 import uuid
 
 purchase_bp = Blueprint('purchase', __name__)
 
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
 
 def generate_po_number():
     """Generate unique purchase order number"""
     today = datetime.now().strftime('%Y%m%d')
     return f"PO-{today}-{str(uuid.uuid4())[:8].upper()}"
 
+def purchase_order_exists(po_id):
+    """Tell a missing order apart from one a conditional UPDATE skipped"""
+    return db.session.query(PurchaseOrder.query.filter(PurchaseOrder.id == po_id).exists()).scalar()
+
 @purchase_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_purchase_orders():
@@ -30,7 +38,10 @@ def get_purchase_orders():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        query = PurchaseOrder.query
+        # Supplier and branch come from the lookup cache in to_dict; only the
+        # creating user needs loading, joined into the page query. raiseload('*')
+        # turns any other relationship access into an error instead of a query per row
+        query = PurchaseOrder.query.options(joinedload(PurchaseOrder.user), raiseload('*'))
         
         if supplier_id:
             query = query.filter(PurchaseOrder.supplier_id == supplier_id)
@@ -54,7 +65,7 @@ def get_purchase_orders():
         )
         
         return jsonify({
-            'purchase_orders': [po.to_dict() for po in purchase_orders.items],
+            'purchase_orders': [po.to_dict(include=('supplier', 'branch', 'user')) for po in purchase_orders.items],
             'total': purchase_orders.total,
             'pages': purchase_orders.pages,
             'current_page': page,
@@ -68,15 +79,27 @@ def get_purchase_orders():
 @jwt_required()
 def get_purchase_order(po_id):
     try:
-        purchase_order = PurchaseOrder.query.get(po_id)
+        # Exactly what the serializers read; anything else raises rather than lazy loading
+        purchase_order = PurchaseOrder.query.options(
+            joinedload(PurchaseOrder.user),
+            selectinload(PurchaseOrder.items).selectinload(PurchaseOrderItem.product),
+            raiseload('*')
+        ).get(po_id)
         
         if not purchase_order:
             return jsonify({'error': 'Purchase order not found'}), 404
         
-        po_dict = purchase_order.to_dict()
-        po_dict['items'] = [item.to_dict() for item in purchase_order.items]
+        def build_payload():
+            po_dict = purchase_order.to_dict(include=('supplier', 'branch', 'user'))
+            po_dict['items'] = [item.to_dict() for item in purchase_order.items]
+            return {'purchase_order': po_dict}
         
-        return jsonify({'purchase_order': po_dict}), 200
+        # Receiving bumps the order's updated_at; item products can change on their own
+        etag = etag_for(purchase_order.id, purchase_order.updated_at, *(
+            (item.id, item.received_quantity, item.product.updated_at if item.product else None)
+            for item in purchase_order.items
+        ))
+        return conditional_response(etag, build_payload)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -88,22 +111,15 @@ def create_purchase_order():
         if not check_permission(['Admin', 'InventoryManager']):
             return jsonify({'error': 'Unauthorized. Admin or Inventory Manager access required.'}), 403
         
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['supplier_id', 'branch_id', 'items']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'{field} is required'}), 400
-        
-        if not data['items']:
-            return jsonify({'error': 'Purchase order must have at least one item'}), 400
+        # Types, required fields, positive quantities/costs and the date are all
+        # checked by the schema in one pass
+        try:
+            payload = PurchaseOrderIn.model_validate(request.get_json())
+        except ValidationError as e:
+            return jsonify({'error': validation_error_message(e)}), 400
         
-        supplier_id = data['supplier_id']
-        branch_id = data['branch_id']
-        items_data = data['items']
-        expected_delivery_date = data.get('expected_delivery_date')
-        notes = data.get('notes', '')
+        supplier_id = payload.supplier_id
+        branch_id = payload.branch_id
         
         # Validate supplier and branch exist
         supplier = Supplier.query.get(supplier_id)
@@ -114,41 +130,25 @@ def create_purchase_order():
         if not branch or not branch.is_active:
             return jsonify({'error': 'Branch not found or inactive'}), 404
         
-        # Parse expected delivery date if provided
-        expected_delivery_date_obj = None
-        if expected_delivery_date:
-            try:
-                expected_delivery_date_obj = datetime.strptime(expected_delivery_date, '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
-        
-        # Validate items
-        validated_items = []
-        sub_total = 0
+        # Validate items; every referenced product is fetched in one IN query
+        product_ids = {item.product_id for item in payload.items}
+        products = {
+            product.id: product
+            for product in Product.query.filter(Product.id.in_(product_ids)).all()
+        }
         
-        for item_data in items_data:
-            product_id = item_data.get('product_id')
-            ordered_quantity = item_data.get('ordered_quantity', 0)
-            unit_cost = item_data.get('unit_cost', 0)
-            
-            if not product_id or ordered_quantity <= 0 or unit_cost <= 0:
-                return jsonify({'error': 'Invalid item data'}), 400
-            
-            # Validate product exists
-            product = Product.query.get(product_id)
+        for item in payload.items:
+            product = products.get(item.product_id)
             if not product or not product.is_active:
-                return jsonify({'error': f'Product {product_id} not found or inactive'}), 404
-            
-            line_total = unit_cost * ordered_quantity
-            
-            validated_items.append({
-                'product_id': product_id,
-                'ordered_quantity': ordered_quantity,
-                'unit_cost': unit_cost,
-                'line_total': line_total
-            })
-            
-            sub_total += line_total
+                return jsonify({'error': f'Product {item.product_id} not found or inactive'}), 404
+        
+        # line_total is generated by the database from quantity and cost
+        validated_items = [item.model_dump() for item in payload.items]
+        
+        # Sum what the generated line_total columns will hold: whole cents times quantity
+        sub_total = sum(
+            round(item['unit_cost'] * 100) * item['ordered_quantity'] for item in validated_items
+        ) / 100
         
         # Calculate totals (assuming no tax for simplicity, can be enhanced)
         tax_amount = 0
@@ -159,30 +159,32 @@ def create_purchase_order():
             po_number=generate_po_number(),
             supplier_id=supplier_id,
             branch_id=branch_id,
-            expected_delivery_date=expected_delivery_date_obj,
+            expected_delivery_date=payload.expected_delivery_date,
             sub_total=sub_total,
             tax_amount=tax_amount,
             total_amount=total_amount,
-            notes=notes,
+            notes=payload.notes,
             created_by=get_jwt_identity()
         )
         
         db.session.add(purchase_order)
         db.session.flush()  # Get PO ID
         
-        # Create purchase order items
-        for item_data in validated_items:
-            po_item = PurchaseOrderItem(
-                purchase_order_id=purchase_order.id,
-                **item_data
-            )
-            db.session.add(po_item)
+        # Create purchase order items in one INSERT; RETURNING brings back ids and line totals
+        po_items = db.session.scalars(
+            insert(PurchaseOrderItem).returning(PurchaseOrderItem),
+            [dict(item, purchase_order_id=purchase_order.id) for item in validated_items]
+        ).all()
+        
+        # Serialize items before commit expires them; their products are still
+        # in the identity map from validation, so no refetch is needed
+        items = [item.to_dict() for item in po_items]
         
         db.session.commit()
         
         # Return PO with items
-        po_dict = purchase_order.to_dict()
-        po_dict['items'] = [item.to_dict() for item in purchase_order.items]
+        po_dict = purchase_order.to_dict(include=('supplier', 'branch', 'user'))
+        po_dict['items'] = items
         
         return jsonify({
             'message': 'Purchase order created successfully',
@@ -223,12 +225,11 @@ def update_purchase_order(po_id):
             if field in data:
                 setattr(purchase_order, field, data[field])
         
-        purchase_order.updated_at = datetime.utcnow()
         db.session.commit()
         
         return jsonify({
             'message': 'Purchase order updated successfully',
-            'purchase_order': purchase_order.to_dict()
+            'purchase_order': purchase_order.to_dict(include=('supplier', 'branch', 'user'))
         }), 200
         
     except Exception as e:
@@ -242,7 +243,8 @@ def receive_purchase_order(po_id):
         if not check_permission(['Admin', 'InventoryManager']):
             return jsonify({'error': 'Unauthorized. Admin or Inventory Manager access required.'}), 403
         
-        purchase_order = PurchaseOrder.query.get(po_id)
+        # Items are loaded up front for the lookups below and the all_received check
+        purchase_order = PurchaseOrder.query.options(selectinload(PurchaseOrder.items)).get(po_id)
         if not purchase_order:
             return jsonify({'error': 'Purchase order not found'}), 404
         
@@ -255,6 +257,13 @@ def receive_purchase_order(po_id):
         if not received_items:
             return jsonify({'error': 'No items to receive'}), 400
         
+        # Stock deltas and movements are collected here and written with one
+        # upsert and one executemany after the loop
+        po_items = {item.id: item for item in purchase_order.items}
+        user_id = get_jwt_identity()
+        stock_deltas = {}
+        movement_rows = []
+        
         # Process received items
         for received_item in received_items:
             item_id = received_item.get('item_id')
@@ -264,42 +273,31 @@ def receive_purchase_order(po_id):
                 continue
             
             # Get purchase order item
-            po_item = PurchaseOrderItem.query.get(item_id)
-            if not po_item or po_item.purchase_order_id != po_id:
+            po_item = po_items.get(item_id)
+            if not po_item:
                 return jsonify({'error': f'Invalid item ID: {item_id}'}), 400
             
             # Update received quantity
             po_item.received_quantity += received_quantity
             
             # Update inventory
-            inventory = Inventory.query.filter_by(
-                product_id=po_item.product_id,
-                branch_id=purchase_order.branch_id
-            ).first()
-            
-            if not inventory:
-                inventory = Inventory(
-                    product_id=po_item.product_id,
-                    branch_id=purchase_order.branch_id,
-                    current_stock=0
-                )
-                db.session.add(inventory)
-            
-            inventory.current_stock += received_quantity
-            inventory.last_updated = datetime.utcnow()
+            stock_deltas[po_item.product_id] = stock_deltas.get(po_item.product_id, 0) + received_quantity
             
             # Create stock movement
-            movement = StockMovement(
-                product_id=po_item.product_id,
-                branch_id=purchase_order.branch_id,
-                movement_type='IN',
-                quantity=received_quantity,
-                unit_cost=po_item.unit_cost,
-                reference=purchase_order.po_number,
-                notes=f"Received from PO {purchase_order.po_number}",
-                created_by=get_jwt_identity()
-            )
-            db.session.add(movement)
+            movement_rows.append({
+                'product_id': po_item.product_id,
+                'branch_id': purchase_order.branch_id,
+                'movement_type': 'IN',
+                'quantity': received_quantity,
+                'unit_cost': po_item.unit_cost,
+                'reference': purchase_order.po_number,
+                'notes': f"Received from PO {purchase_order.po_number}",
+                'created_by': user_id
+            })
+        
+        if stock_deltas:
+            Inventory.add_stock_many(purchase_order.branch_id, stock_deltas)
+            db.session.execute(insert(StockMovement), movement_rows)
         
         # Check if all items are fully received
         all_received = all(
@@ -310,12 +308,13 @@ def receive_purchase_order(po_id):
         if all_received:
             purchase_order.status = 'Received'
         
-        purchase_order.updated_at = datetime.utcnow()
+        # A partial receipt changes only the items, so stamp the order explicitly
+        purchase_order.updated_at = db.func.now()
         db.session.commit()
         
         return jsonify({
             'message': 'Items received successfully',
-            'purchase_order': purchase_order.to_dict()
+            'purchase_order': purchase_order.to_dict(include=('supplier', 'branch', 'user'))
         }), 200
         
     except Exception as e:
@@ -329,20 +328,27 @@ def approve_purchase_order(po_id):
         if not check_permission(['Admin']):
             return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
         
-        purchase_order = PurchaseOrder.query.get(po_id)
-        if not purchase_order:
-            return jsonify({'error': 'Purchase order not found'}), 404
+        # The status gate is part of the UPDATE, so concurrent approvals cannot both pass it
+        purchase_order = db.session.scalars(
+            update(PurchaseOrder).where(
+                PurchaseOrder.id == po_id,
+                PurchaseOrder.status == 'Pending'
+            ).values(status='Approved', updated_at=func.now()).returning(PurchaseOrder),
+            execution_options={'populate_existing': True}
+        ).one_or_none()
         
-        if purchase_order.status != 'Pending':
+        if not purchase_order:
+            if not purchase_order_exists(po_id):
+                return jsonify({'error': 'Purchase order not found'}), 404
             return jsonify({'error': 'Only pending purchase orders can be approved'}), 400
         
-        purchase_order.status = 'Approved'
-        purchase_order.updated_at = datetime.utcnow()
+        # Serialized from the RETURNING row before commit expires it
+        po_dict = purchase_order.to_dict(include=('supplier', 'branch', 'user'))
         db.session.commit()
         
         return jsonify({
             'message': 'Purchase order approved successfully',
-            'purchase_order': purchase_order.to_dict()
+            'purchase_order': po_dict
         }), 200
         
     except Exception as e:
@@ -356,24 +362,34 @@ def cancel_purchase_order(po_id):
         if not check_permission(['Admin', 'InventoryManager']):
             return jsonify({'error': 'Unauthorized. Admin or Inventory Manager access required.'}), 403
         
-        purchase_order = PurchaseOrder.query.get(po_id)
-        if not purchase_order:
-            return jsonify({'error': 'Purchase order not found'}), 404
-        
-        if purchase_order.status in ['Received', 'Cancelled']:
-            return jsonify({'error': 'Cannot cancel received or already cancelled purchase order'}), 400
-        
         data = request.get_json()
         reason = data.get('reason', 'Cancelled by user')
         
-        purchase_order.status = 'Cancelled'
-        purchase_order.notes = f"{purchase_order.notes or ''} | CANCELLED: {reason}"
-        purchase_order.updated_at = datetime.utcnow()
+        # The status gate is part of the UPDATE, so it cannot race a receive or approval
+        purchase_order = db.session.scalars(
+            update(PurchaseOrder).where(
+                PurchaseOrder.id == po_id,
+                PurchaseOrder.status.notin_(['Received', 'Cancelled'])
+            ).values(
+                status='Cancelled',
+                notes=func.coalesce(PurchaseOrder.notes, '') + f" | CANCELLED: {reason}",
+                updated_at=func.now()
+            ).returning(PurchaseOrder),
+            execution_options={'populate_existing': True}
+        ).one_or_none()
+        
+        if not purchase_order:
+            if not purchase_order_exists(po_id):
+                return jsonify({'error': 'Purchase order not found'}), 404
+            return jsonify({'error': 'Cannot cancel received or already cancelled purchase order'}), 400
+        
+        # Serialized from the RETURNING row before commit expires it
+        po_dict = purchase_order.to_dict(include=('supplier', 'branch', 'user'))
         db.session.commit()
         
         return jsonify({
             'message': 'Purchase order cancelled successfully',
-            'purchase_order': purchase_order.to_dict()
+            'purchase_order': po_dict
         }), 200
         
     except Exception as e:
@@ -1,76 +1,135 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_jwt_extended import jwt_required
 from src.models.user import db, User, Product, Branch
-from src.models.sales import Sale, SaleItem
+from src.models.sales import Sale, SaleItem, SalesDaily
 from src.models.inventory import Inventory, StockMovement
-from datetime import datetime, date, timedelta
-from sqlalchemy import func, desc
+from src.models.types import Cents
+from src.routes.auth import current_role
+from src.response_cache import cached
+from src.pagination import page_args, page_count
+from src.conditional import etag_for, not_modified, tag_response
+from src.streaming import stream_json
+from datetime import datetime, date, time, timedelta
+import csv
+import io
+from itertools import islice
+from sqlalchemy import and_, func, desc, select
 
 reports_bp = Blueprint('reports', __name__)
 
+MAX_MOVEMENT_ROWS = 10000
+MAX_LOW_STOCK_ROWS = 10000
+
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
+
+def csv_response(stmt, filename):
+    """Stream the rows of stmt as a CSV download, header row first"""
+    # Run the query and fetch the first batch before the response starts, so a
+    # failure still becomes the route's error response
+    result = db.session.execute(stmt, execution_options={'yield_per': 1000})
+    first_batch = list(islice(result, 1000))
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(result.keys())
+        batch = first_batch
+        while batch:
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            batch = list(islice(result, 1000))
+        yield buffer.getvalue()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+def report_period(default_days=None):
+    """Dates from ?start_date=&end_date= (YYYY-MM-DD)
+
+    The end defaults to today and the start to default_days before it, or to
+    the first of the month when default_days is None.
+    """
+    today = date.today()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if start_date:
+        start_date_obj = date.fromisoformat(start_date)
+    elif default_days is None:
+        start_date_obj = today.replace(day=1)
+    else:
+        start_date_obj = today - timedelta(days=default_days)
+    end_date_obj = date.fromisoformat(end_date) if end_date else today
+    return start_date_obj, end_date_obj
+
+def day_range(start_date_obj, end_date_obj):
+    """Half-open datetime bounds covering start_date..end_date inclusive"""
+    # Comparing the bare column keeps the date indexes usable; func.date() would not
+    return datetime.combine(start_date_obj, time.min), datetime.combine(end_date_obj + timedelta(days=1), time.min)
 
 @reports_bp.route('/sales-summary', methods=['GET'])
 @jwt_required()
+@cached(ttl=30)
 def sales_summary():
     try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
         branch_id = request.args.get('branch_id', type=int)
         
-        # Default to last 30 days if no dates provided
-        if not start_date:
-            start_date = (date.today() - timedelta(days=30)).isoformat()
-        if not end_date:
-            end_date = date.today().isoformat()
+        start_date_obj, end_date_obj = report_period(30)
         
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-        
-        query = Sale.query.filter(
-            func.date(Sale.sale_date) >= start_date_obj,
-            func.date(Sale.sale_date) <= end_date_obj,
-            Sale.payment_status != 'Refunded'
-        )
+        # Summed from the daily rollup rather than scanning sales
+        filters = [
+            SalesDaily.sale_day >= start_date_obj,
+            SalesDaily.sale_day <= end_date_obj
+        ]
         
         if branch_id:
-            query = query.filter(Sale.branch_id == branch_id)
-        
-        sales = query.all()
-        
-        # Calculate summary statistics
-        total_sales = len(sales)
-        total_revenue = sum(sale.total_amount for sale in sales)
-        total_tax = sum(sale.tax_amount for sale in sales)
-        total_discount = sum(sale.discount_amount for sale in sales)
-        average_sale = total_revenue / total_sales if total_sales > 0 else 0
-        
-        # Daily breakdown
-        daily_sales = {}
-        for sale in sales:
-            sale_date = sale.sale_date.date().isoformat()
-            if sale_date not in daily_sales:
-                daily_sales[sale_date] = {'count': 0, 'revenue': 0}
-            daily_sales[sale_date]['count'] += 1
-            daily_sales[sale_date]['revenue'] += sale.total_amount
-        
-        # Payment method breakdown
+            filters.append(SalesDaily.branch_id == branch_id)
+        
+        # One pass over the (day, payment method) buckets yields the totals and
+        # both breakdowns
+        buckets = db.session.execute(
+            select(
+                SalesDaily.sale_day,
+                SalesDaily.payment_method,
+                func.sum(SalesDaily.sale_count).label('sale_count'),
+                func.sum(SalesDaily.total_revenue).label('total_revenue'),
+                func.sum(SalesDaily.total_tax).label('total_tax'),
+                func.sum(SalesDaily.total_discount).label('total_discount')
+            ).where(*filters).group_by(
+                SalesDaily.sale_day, SalesDaily.payment_method
+            ).having(
+                func.sum(SalesDaily.sale_count) > 0
+            ).order_by(SalesDaily.sale_day)
+        ).all()
+        
+        total_sales = total_revenue = total_tax = total_discount = 0
+        daily_breakdown = {}
         payment_methods = {}
-        for sale in sales:
-            method = sale.payment_method
-            if method not in payment_methods:
-                payment_methods[method] = {'count': 0, 'amount': 0}
-            payment_methods[method]['count'] += 1
-            payment_methods[method]['amount'] += sale.total_amount
+        for bucket in buckets:
+            total_sales += bucket.sale_count
+            total_revenue += bucket.total_revenue
+            total_tax += bucket.total_tax
+            total_discount += bucket.total_discount
+            
+            day = daily_breakdown.setdefault(bucket.sale_day.isoformat(), {'count': 0, 'revenue': 0})
+            day['count'] += bucket.sale_count
+            day['revenue'] += bucket.total_revenue
+            
+            method = payment_methods.setdefault(bucket.payment_method, {'count': 0, 'amount': 0})
+            method['count'] += bucket.sale_count
+            method['amount'] += bucket.total_revenue
+        average_sale = total_revenue / total_sales if total_sales > 0 else 0
         
         return jsonify({
             'period': {
-                'start_date': start_date,
-                'end_date': end_date
+                'start_date': start_date_obj.isoformat(),
+                'end_date': end_date_obj.isoformat()
             },
             'summary': {
                 'total_sales': total_sales,
@@ -79,20 +138,8 @@ def sales_summary():
                 'total_discount': float(total_discount),
                 'average_sale': float(average_sale)
             },
-            'daily_breakdown': {
-                date: {
-                    'count': data['count'],
-                    'revenue': float(data['revenue'])
-                }
-                for date, data in daily_sales.items()
-            },
-            'payment_methods': {
-                method: {
-                    'count': data['count'],
-                    'amount': float(data['amount'])
-                }
-                for method, data in payment_methods.items()
-            }
+            'daily_breakdown': daily_breakdown,
+            'payment_methods': payment_methods
         }), 200
         
     except Exception as e:
@@ -100,56 +147,59 @@ def sales_summary():
 
 @reports_bp.route('/top-products', methods=['GET'])
 @jwt_required()
+@cached(ttl=30)
 def top_products():
     try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
         branch_id = request.args.get('branch_id', type=int)
         limit = request.args.get('limit', 10, type=int)
         
-        # Default to last 30 days if no dates provided
-        if not start_date:
-            start_date = (date.today() - timedelta(days=30)).isoformat()
-        if not end_date:
-            end_date = date.today().isoformat()
-        
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+        start_date_obj, end_date_obj = report_period(30)
+        start_dt, end_dt = day_range(start_date_obj, end_date_obj)
         
         # Query for top selling products by quantity
-        query = db.session.query(
-            Product.id,
-            Product.product_name,
-            Product.product_code,
+        top = select(
+            SaleItem.product_id,
             func.sum(SaleItem.quantity).label('total_quantity'),
             func.sum(SaleItem.line_total).label('total_revenue'),
             func.count(SaleItem.id).label('transaction_count')
-        ).join(SaleItem).join(Sale).filter(
-            func.date(Sale.sale_date) >= start_date_obj,
-            func.date(Sale.sale_date) <= end_date_obj,
+        ).join(Sale).where(
+            Sale.sale_date >= start_dt,
+            Sale.sale_date < end_dt,
             Sale.payment_status != 'Refunded'
         )
         
         if branch_id:
-            query = query.filter(Sale.branch_id == branch_id)
-        
-        top_products = query.group_by(
-            Product.id, Product.product_name, Product.product_code
-        ).order_by(desc('total_quantity')).limit(limit).all()
+            top = top.where(Sale.branch_id == branch_id)
+        
+        # Rank by product id alone; names and codes are joined for the top rows only
+        top = top.group_by(SaleItem.product_id).order_by(
+            desc('total_quantity'), SaleItem.product_id
+        ).limit(limit).cte('top')
+        top_products = db.session.execute(
+            select(
+                Product.id,
+                Product.product_name,
+                Product.product_code,
+                top.c.total_quantity,
+                top.c.total_revenue,
+                top.c.transaction_count
+            ).join(top, Product.id == top.c.product_id)
+            .order_by(top.c.total_quantity.desc(), Product.id)
+        ).mappings().all()
         
         return jsonify({
             'period': {
-                'start_date': start_date,
-                'end_date': end_date
+                'start_date': start_date_obj.isoformat(),
+                'end_date': end_date_obj.isoformat()
             },
             'top_products': [
                 {
-                    'product_id': product.id,
-                    'product_name': product.product_name,
-                    'product_code': product.product_code,
-                    'total_quantity': product.total_quantity,
-                    'total_revenue': float(product.total_revenue),
-                    'transaction_count': product.transaction_count
+                    'product_id': product['id'],
+                    'product_name': product['product_name'],
+                    'product_code': product['product_code'],
+                    'total_quantity': product['total_quantity'],
+                    'total_revenue': product['total_revenue'],
+                    'transaction_count': product['transaction_count']
                 }
                 for product in top_products
             ]
@@ -163,106 +213,119 @@ def top_products():
 def inventory_valuation():
     try:
         branch_id = request.args.get('branch_id', type=int)
-        
-        query = db.session.query(
-            Product.id,
-            Product.product_name,
-            Product.product_code,
-            Product.cost_price,
-            Product.selling_price,
-            Inventory.current_stock,
-            Inventory.branch_id,
-            Branch.branch_name,
-            (Inventory.current_stock * Product.cost_price).label('cost_value'),
-            (Inventory.current_stock * Product.selling_price).label('retail_value')
-        ).join(Inventory).join(Branch).filter(
+        page = request.args.get('page', type=int)
+        per_page = request.args.get('per_page', 100, type=int)
+        summary_only = request.args.get('summary_only', 'false').lower() in ('1', 'true')
+        export_format = request.args.get('format', 'json')
+        
+        # Nothing stocked or priced has changed since the client's copy: 304
+        # before running the report
+        etag = etag_for(request.full_path, *db.session.execute(select(
+            func.max(Inventory.last_updated),
+            func.count(Inventory.id),
+            func.max(Product.updated_at)
+        ).select_from(Inventory).outerjoin(Product, Product.id == Inventory.product_id)).one())
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+        
+        filters = [
             Product.is_active == True,
             Inventory.current_stock > 0
-        )
+        ]
         
         if branch_id:
-            query = query.filter(Inventory.branch_id == branch_id)
-        
-        inventory_data = query.all()
+            filters.append(Inventory.branch_id == branch_id)
         
-        total_cost_value = sum(item.cost_value for item in inventory_data if item.cost_value)
-        total_retail_value = sum(item.retail_value for item in inventory_data if item.retail_value)
-        total_items = len(inventory_data)
-        
-        return jsonify({
-            'summary': {
-                'total_items': total_items,
-                'total_cost_value': float(total_cost_value),
-                'total_retail_value': float(total_retail_value),
-                'potential_profit': float(total_retail_value - total_cost_value)
-            },
-            'inventory': [
-                {
-                    'product_id': item.id,
-                    'product_name': item.product_name,
-                    'product_code': item.product_code,
-                    'branch_id': item.branch_id,
-                    'branch_name': item.branch_name,
-                    'current_stock': item.current_stock,
-                    'cost_price': float(item.cost_price) if item.cost_price else 0,
-                    'selling_price': float(item.selling_price) if item.selling_price else 0,
-                    'cost_value': float(item.cost_value) if item.cost_value else 0,
-                    'retail_value': float(item.retail_value) if item.retail_value else 0
-                }
-                for item in inventory_data
-            ]
-        }), 200
+        stmt = select(
+            Product.id.label('product_id'),
+            Product.product_name,
+            Product.product_code,
+            Inventory.branch_id,
+            Branch.branch_name,
+            Inventory.current_stock,
+            func.coalesce(Product.cost_price, 0).label('cost_price'),
+            func.coalesce(Product.selling_price, 0).label('selling_price'),
+            func.coalesce(Inventory.current_stock * Product.cost_price, 0).label('cost_value'),
+            func.coalesce(Inventory.current_stock * Product.selling_price, 0).label('retail_value')
+        ).select_from(Inventory).join(
+            Product, Product.id == Inventory.product_id
+        ).join(
+            Branch, Branch.id == Inventory.branch_id
+        ).where(*filters)
+        
+        if export_format == 'csv':
+            return tag_response(csv_response(stmt, 'inventory-valuation.csv'), etag), 200
+        
+        total_items, total_cost_value, total_retail_value = db.session.query(
+            func.count(Inventory.id),
+            func.coalesce(func.sum(Inventory.current_stock * Product.cost_price), 0),
+            func.coalesce(func.sum(Inventory.current_stock * Product.selling_price), 0)
+        ).select_from(Product).join(Inventory).filter(*filters).one()
+        
+        summary = {
+            'total_items': total_items,
+            'total_cost_value': float(total_cost_value),
+            'total_retail_value': float(total_retail_value),
+            'potential_profit': float(total_retail_value - total_cost_value)
+        }
+        
+        if summary_only:
+            return tag_response(jsonify({'summary': summary}), etag), 200
+        
+        # ?page= returns one page of detail rows; without it every row is streamed
+        if page:
+            page, per_page = page_args(page, per_page)
+            rows = db.session.execute(
+                stmt.order_by(Product.id, Inventory.branch_id)
+                .limit(per_page).offset((page - 1) * per_page)
+            ).mappings()
+            return tag_response(jsonify({
+                'summary': summary,
+                'inventory': [dict(item) for item in rows],
+                'total': total_items,
+                'pages': page_count(total_items, per_page),
+                'current_page': page,
+                'per_page': per_page
+            }), etag), 200
+        
+        # Totals are aggregated by the database; detail rows are streamed
+        return tag_response(stream_json(
+            '{"summary": ' + current_app.json.dumps(summary) + ', "inventory": [',
+            db.session.execute(stmt, execution_options={'yield_per': 1000})
+        ), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @reports_bp.route('/profit-loss', methods=['GET'])
 @jwt_required()
+@cached(ttl=30)
 def profit_loss():
     try:
         if not check_permission(['Admin']):
             return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
         
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
         branch_id = request.args.get('branch_id', type=int)
         
-        # Default to current month if no dates provided
-        if not start_date:
-            start_date = date.today().replace(day=1).isoformat()
-        if not end_date:
-            end_date = date.today().isoformat()
-        
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+        start_date_obj, end_date_obj = report_period()
         
-        # Calculate revenue from sales
-        sales_query = Sale.query.filter(
-            func.date(Sale.sale_date) >= start_date_obj,
-            func.date(Sale.sale_date) <= end_date_obj,
-            Sale.payment_status != 'Refunded'
-        )
+        filters = [
+            SalesDaily.sale_day >= start_date_obj,
+            SalesDaily.sale_day <= end_date_obj
+        ]
         
         if branch_id:
-            sales_query = sales_query.filter(Sale.branch_id == branch_id)
+            filters.append(SalesDaily.branch_id == branch_id)
         
-        sales = sales_query.all()
-        total_revenue = sum(sale.total_amount for sale in sales)
-        
-        # Calculate cost of goods sold (COGS)
-        cogs_query = db.session.query(
-            func.sum(SaleItem.quantity * Product.cost_price).label('total_cogs')
-        ).join(Product).join(Sale).filter(
-            func.date(Sale.sale_date) >= start_date_obj,
-            func.date(Sale.sale_date) <= end_date_obj,
-            Sale.payment_status != 'Refunded'
-        )
-        
-        if branch_id:
-            cogs_query = cogs_query.filter(Sale.branch_id == branch_id)
-        
-        cogs_result = cogs_query.first()
-        total_cogs = cogs_result.total_cogs if cogs_result.total_cogs else 0
+        # Revenue and COGS come from the daily rollup in a single round trip
+        totals = db.session.execute(select(
+            func.coalesce(func.sum(SalesDaily.total_revenue), 0).label('total_revenue'),
+            func.coalesce(func.sum(SalesDaily.sale_count), 0).label('total_sales'),
+            func.coalesce(func.sum(SalesDaily.total_cogs), 0).label('total_cogs')
+        ).where(*filters)).one()
+        total_revenue = totals.total_revenue
+        total_cogs = totals.total_cogs
         
         # Calculate gross profit
         gross_profit = total_revenue - total_cogs
@@ -270,12 +333,12 @@ def profit_loss():
         
         return jsonify({
             'period': {
-                'start_date': start_date,
-                'end_date': end_date
+                'start_date': start_date_obj.isoformat(),
+                'end_date': end_date_obj.isoformat()
             },
             'revenue': {
                 'total_revenue': float(total_revenue),
-                'total_sales': len(sales)
+                'total_sales': totals.total_sales
             },
             'costs': {
                 'cost_of_goods_sold': float(total_cogs)
@@ -291,44 +354,44 @@ def profit_loss():
 
 @reports_bp.route('/low-stock', methods=['GET'])
 @jwt_required()
+@cached(ttl=30)
 def low_stock_report():
     try:
         branch_id = request.args.get('branch_id', type=int)
+        limit = min(max(request.args.get('limit', MAX_LOW_STOCK_ROWS, type=int), 1), MAX_LOW_STOCK_ROWS)
         
-        query = db.session.query(
-            Product.id,
+        shortage = (Product.reorder_level - Inventory.current_stock).label('shortage')
+        stmt = select(
+            Product.id.label('product_id'),
             Product.product_name,
             Product.product_code,
+            Inventory.branch_id,
+            Branch.branch_name,
+            Inventory.current_stock,
             Product.reorder_level,
             Product.min_stock_level,
-            Inventory.current_stock,
-            Inventory.branch_id,
-            Branch.branch_name
-        ).join(Inventory).join(Branch).filter(
-            Product.is_active == True,
-            Inventory.current_stock <= Product.reorder_level
-        )
+            shortage
+        ).select_from(Inventory).join(
+            Product, and_(
+                Product.id == Inventory.product_id,
+                Product.is_active == True,
+                Inventory.current_stock <= Product.reorder_level
+            )
+        ).join(Branch, Branch.id == Inventory.branch_id)
         
         if branch_id:
-            query = query.filter(Inventory.branch_id == branch_id)
+            stmt = stmt.where(Inventory.branch_id == branch_id)
         
-        low_stock_items = query.order_by(Inventory.current_stock).all()
+        # Largest shortage first; the limit bounds the response for large catalogues.
+        # Columns are labelled with their output keys, so rows map straight to dicts
+        low_stock_items = [
+            dict(item) for item in db.session.execute(
+                stmt.order_by(shortage.desc(), Inventory.id).limit(limit)
+            ).mappings()
+        ]
         
         return jsonify({
-            'low_stock_items': [
-                {
-                    'product_id': item.id,
-                    'product_name': item.product_name,
-                    'product_code': item.product_code,
-                    'branch_id': item.branch_id,
-                    'branch_name': item.branch_name,
-                    'current_stock': item.current_stock,
-                    'reorder_level': item.reorder_level,
-                    'min_stock_level': item.min_stock_level,
-                    'shortage': item.reorder_level - item.current_stock
-                }
-                for item in low_stock_items
-            ],
+            'low_stock_items': low_stock_items,
             'total_items': len(low_stock_items)
         }), 200
         
@@ -339,82 +402,95 @@ def low_stock_report():
 @jwt_required()
 def stock_movements_report():
     try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
         branch_id = request.args.get('branch_id', type=int)
         product_id = request.args.get('product_id', type=int)
         movement_type = request.args.get('movement_type')
+        # Caps the rows written so a wide date range cannot produce an unbounded response
+        limit = min(max(request.args.get('limit', MAX_MOVEMENT_ROWS, type=int), 1), MAX_MOVEMENT_ROWS)
+        summary_only = request.args.get('summary_only', 'false').lower() in ('1', 'true')
+        export_format = request.args.get('format', 'json')
+        
+        start_date_obj, end_date_obj = report_period(7)
+        start_dt, end_dt = day_range(start_date_obj, end_date_obj)
+        
+        # Movements are append-only, so the newest id versions the report
+        etag = etag_for(
+            request.full_path, start_date_obj, end_date_obj,
+            db.session.execute(select(func.max(StockMovement.id))).scalar()
+        )
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
         
-        # Default to last 7 days if no dates provided
-        if not start_date:
-            start_date = (date.today() - timedelta(days=7)).isoformat()
-        if not end_date:
-            end_date = date.today().isoformat()
+        filters = [
+            StockMovement.created_at >= start_dt,
+            StockMovement.created_at < end_dt
+        ]
         
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+        if branch_id:
+            filters.append(StockMovement.branch_id == branch_id)
         
-        query = db.session.query(
+        if product_id:
+            filters.append(StockMovement.product_id == product_id)
+        
+        if movement_type:
+            filters.append(StockMovement.movement_type == movement_type)
+        
+        stmt = select(
             StockMovement.id,
             StockMovement.movement_type,
             StockMovement.quantity,
-            StockMovement.unit_cost,
+            func.nullif(StockMovement.unit_cost, 0, type_=Cents).label('unit_cost'),
             StockMovement.reference,
             StockMovement.notes,
             StockMovement.created_at,
             Product.product_name,
             Product.product_code,
             Branch.branch_name,
-            User.username
-        ).join(Product).join(Branch).join(User).filter(
-            func.date(StockMovement.created_at) >= start_date_obj,
-            func.date(StockMovement.created_at) <= end_date_obj
-        )
-        
-        if branch_id:
-            query = query.filter(StockMovement.branch_id == branch_id)
-        
-        if product_id:
-            query = query.filter(StockMovement.product_id == product_id)
-        
-        if movement_type:
-            query = query.filter(StockMovement.movement_type == movement_type)
-        
-        movements = query.order_by(desc(StockMovement.created_at)).all()
-        
-        # Calculate summary by movement type
-        movement_summary = {}
-        for movement in movements:
-            mov_type = movement.movement_type
-            if mov_type not in movement_summary:
-                movement_summary[mov_type] = {'count': 0, 'total_quantity': 0}
-            movement_summary[mov_type]['count'] += 1
-            movement_summary[mov_type]['total_quantity'] += abs(movement.quantity)
-        
-        return jsonify({
-            'period': {
-                'start_date': start_date,
-                'end_date': end_date
-            },
-            'summary': movement_summary,
-            'movements': [
-                {
-                    'id': movement.id,
-                    'movement_type': movement.movement_type,
-                    'quantity': movement.quantity,
-                    'unit_cost': float(movement.unit_cost) if movement.unit_cost else None,
-                    'reference': movement.reference,
-                    'notes': movement.notes,
-                    'created_at': movement.created_at.isoformat(),
-                    'product_name': movement.product_name,
-                    'product_code': movement.product_code,
-                    'branch_name': movement.branch_name,
-                    'created_by': movement.username
-                }
-                for movement in movements
-            ],
-            'total_movements': len(movements)
-        }), 200
+            User.username.label('created_by')
+        ).join(Product).join(Branch).join(User).where(*filters)
+        
+        if export_format == 'csv':
+            return tag_response(csv_response(
+                stmt.order_by(desc(StockMovement.created_at)).limit(limit), 'stock-movements.csv'
+            ), etag), 200
+        
+        # Summary is grouped by the database over every matching movement
+        summary_rows = db.session.execute(
+            select(
+                StockMovement.movement_type,
+                func.count(StockMovement.id),
+                func.coalesce(func.sum(func.abs(StockMovement.quantity)), 0)
+            ).where(*filters).group_by(StockMovement.movement_type)
+        ).all()
+        movement_summary = {
+            mov_type: {'count': count, 'total_quantity': total_quantity}
+            for mov_type, count, total_quantity in summary_rows
+        }
+        total_movements = sum(entry['count'] for entry in movement_summary.values())
+        
+        period = {
+            'start_date': start_date_obj.isoformat(),
+            'end_date': end_date_obj.isoformat()
+        }
+        
+        if summary_only:
+            return tag_response(jsonify({
+                'period': period,
+                'summary': movement_summary,
+                'total_movements': total_movements
+            }), etag), 200
+        
+        # Detail rows are streamed from the cursor after the summary
+        dumps = current_app.json.dumps
+        return tag_response(stream_json(
+            '{"period": ' + dumps(period) + ', "summary": ' + dumps(movement_summary)
+            + ', "total_movements": ' + str(total_movements) + ', "limit": ' + str(limit) + ', "movements": [',
+            db.session.execute(
+                stmt.order_by(desc(StockMovement.created_at)).limit(limit),
+                execution_options={'yield_per': 1000}
+            )
+        ), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
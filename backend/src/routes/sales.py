@@ -1,50 +1,50 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Product, Branch, Customer
-from src.models.sales import Sale, SaleItem, LoyaltyTransaction, SystemSetting
+from src.models.user import db, Product, Branch, Customer
+from src.models.sales import Sale, SaleItem, SalesDaily, LoyaltyTransaction, get_setting, sale_number_seq
 from src.models.inventory import Inventory, StockMovement
-from datetime import datetime, date
-from sqlalchemy import func
+from src.routes.auth import current_role
+from src.streaming import stream_json
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.orm import joinedload, selectinload, undefer
+import math
 import uuid
 
 sales_bp = Blueprint('sales', __name__)
 
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
 
 def generate_sale_number():
     """Generate unique sale number"""
     today = datetime.now().strftime('%Y%m%d')
-    return f"SALE-{today}-{str(uuid.uuid4())[:8].upper()}"
+    if db.engine.dialect.supports_sequences:
+        return f"SALE-{today}-{db.session.scalar(sale_number_seq.next_value()):08d}"
+    # No sequences on SQLite; 48 random bits keep same-day collisions negligible
+    return f"SALE-{today}-{uuid.uuid4().hex[:12].upper()}"
 
 def update_inventory_after_sale(sale_items, branch_id, cashier_id):
-    """Update inventory after a sale"""
+    """Take sold quantities out of stock with one UPDATE and return the stock movement rows to insert"""
+    quantities = {}
     for item in sale_items:
-        # Get inventory record
-        inventory = Inventory.query.filter_by(
-            product_id=item['product_id'],
-            branch_id=branch_id
-        ).first()
-        
-        if inventory:
-            # Update stock
-            inventory.current_stock -= item['quantity']
-            inventory.last_updated = datetime.utcnow()
-            
-            # Create stock movement
-            movement = StockMovement(
-                product_id=item['product_id'],
-                branch_id=branch_id,
-                movement_type='OUT',
-                quantity=-item['quantity'],
-                reference=f"SALE-{item.get('sale_id', '')}",
-                notes=f"Sale transaction",
-                created_by=cashier_id
-            )
-            db.session.add(movement)
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) - item['quantity']
+    Inventory.adjust_existing_stock(branch_id, quantities)
+    
+    # Stock movements, inserted together in one statement
+    return [
+        {
+            'product_id': item['product_id'],
+            'branch_id': branch_id,
+            'movement_type': 'OUT',
+            'quantity': -item['quantity'],
+            'reference': f"SALE-{item.get('sale_id', '')}",
+            'notes': f"Sale transaction",
+            'created_by': cashier_id
+        }
+        for item in sale_items
+    ]
 
 @sales_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -57,36 +57,65 @@ def get_sales():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         payment_method = request.args.get('payment_method')
+        after = request.args.get('after')
+        # Keyset pages skip the COUNT(*) unless asked for; offset pages need it for 'pages'
+        include_count = request.args.get('count', 'false' if after else 'true').lower() == 'true'
         
-        query = Sale.query
+        criteria = []
         
         if branch_id:
-            query = query.filter(Sale.branch_id == branch_id)
+            criteria.append(Sale.branch_id == branch_id)
         
         if cashier_id:
-            query = query.filter(Sale.cashier_id == cashier_id)
+            criteria.append(Sale.cashier_id == cashier_id)
         
         if start_date:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(func.date(Sale.sale_date) >= start_date_obj)
+            start_dt = datetime.combine(date.fromisoformat(start_date), time.min)
+            criteria.append(Sale.sale_date >= start_dt)
         
         if end_date:
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(func.date(Sale.sale_date) <= end_date_obj)
+            # Half-open upper bound keeps the sale_date indexes usable
+            end_dt = datetime.combine(date.fromisoformat(end_date) + timedelta(days=1), time.min)
+            criteria.append(Sale.sale_date < end_dt)
         
         if payment_method:
-            query = query.filter(Sale.payment_method == payment_method)
-        
-        sales = query.order_by(Sale.sale_date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+            criteria.append(Sale.payment_method == payment_method)
+        
+        # ?stream=true sends every matching sale unpaginated, for exports
+        if request.args.get('stream', '').lower() in ('1', 'true'):
+            return stream_json('{"sales": [', db.session.execute(
+                Sale.list_select(*criteria), execution_options={'yield_per': 1000}
+            )), 200
+        
+        page = max(page, 1)
+        per_page = per_page if per_page > 0 else 20
+        
+        total = db.session.query(func.count(Sale.id)).filter(*criteria).scalar() if include_count else None
+        
+        # Keyset pagination: ?after=<sale_date>,<id> continues below the last row seen
+        if after:
+            try:
+                after_date, after_id = after.rsplit(',', 1)
+                after_key = (datetime.fromisoformat(after_date), int(after_id))
+            except ValueError:
+                return jsonify({'error': 'after must be <iso_datetime>,<id>'}), 400
+            criteria.append(tuple_(Sale.sale_date, Sale.id) < after_key)
+            sales = Sale.list_as_dicts(*criteria, limit=per_page)
+        else:
+            sales = Sale.list_as_dicts(*criteria, limit=per_page, offset=(page - 1) * per_page)
+        
+        next_after = None
+        if len(sales) == per_page:
+            last = sales[-1]
+            next_after = f"{last['sale_date'].isoformat()},{last['id']}"
         
         return jsonify({
-            'sales': [sale.to_dict() for sale in sales.items],
-            'total': sales.total,
-            'pages': sales.pages,
+            'sales': sales,
+            'total': total,
+            'pages': math.ceil(total / per_page) if include_count else None,
             'current_page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'next_after': next_after
         }), 200
         
     except Exception as e:
@@ -96,7 +125,14 @@ def get_sales():
 @jwt_required()
 def get_sale(sale_id):
     try:
-        sale = Sale.query.get(sale_id)
+        # Customer and cashier ride along in the sale's own SELECT; items and
+        # their products follow in one IN query each
+        sale = db.session.get(Sale, sale_id, options=[
+            undefer(Sale.notes),
+            joinedload(Sale.customer),
+            joinedload(Sale.cashier),
+            selectinload(Sale.items).selectinload(SaleItem.product)
+        ])
         
         if not sale:
             return jsonify({'error': 'Sale not found'}), 404
@@ -135,18 +171,34 @@ def create_sale():
         notes = data.get('notes', '')
         
         # Validate branch exists
-        branch = Branch.query.get(branch_id)
+        branch = db.session.get(Branch, branch_id)
         if not branch:
             return jsonify({'error': 'Branch not found'}), 404
         
         # Validate customer exists (if provided)
         customer = None
         if customer_id:
-            customer = Customer.query.get(customer_id)
+            customer = db.session.get(Customer, customer_id)
             if not customer:
                 return jsonify({'error': 'Customer not found'}), 404
         
-        # Validate items and check stock availability
+        # Validate items and check stock availability; products and stock rows for
+        # the whole cart are loaded with one query each
+        product_ids = {item_data.get('product_id') for item_data in items_data}
+        products = {
+            product.id: product
+            for product in db.session.scalars(select(Product).where(Product.id.in_(product_ids)))
+        }
+        # Stock rows are locked (FOR UPDATE, in product order so concurrent carts can't
+        # deadlock) until commit, so two sales can't both pass the check on the same stock
+        inventories = {
+            inventory.product_id: inventory
+            for inventory in db.session.scalars(select(Inventory).where(
+                Inventory.product_id.in_(product_ids),
+                Inventory.branch_id == branch_id
+            ).order_by(Inventory.product_id).with_for_update())
+        }
+        
         validated_items = []
         sub_total = 0
         total_tax = 0
@@ -160,8 +212,7 @@ def create_sale():
             if not product_id or quantity <= 0:
                 return jsonify({'error': 'Invalid item data'}), 400
             
-            # Get product
-            product = Product.query.get(product_id)
+            product = products.get(product_id)
             if not product or not product.is_active:
                 return jsonify({'error': f'Product {product_id} not found or inactive'}), 404
             
@@ -170,11 +221,7 @@ def create_sale():
                 unit_price = float(product.selling_price)
             
             # Check stock availability
-            inventory = Inventory.query.filter_by(
-                product_id=product_id,
-                branch_id=branch_id
-            ).first()
-            
+            inventory = inventories.get(product_id)
             if not inventory or inventory.available_stock < quantity:
                 return jsonify({'error': f'Insufficient stock for product {product.product_name}'}), 400
             
@@ -187,6 +234,7 @@ def create_sale():
                 'product_id': product_id,
                 'quantity': quantity,
                 'unit_price': unit_price,
+                'unit_cost': product.cost_price,
                 'discount_amount': item_discount,
                 'tax_amount': tax_amount,
                 'line_total': line_total
@@ -215,36 +263,38 @@ def create_sale():
         db.session.add(sale)
         db.session.flush()  # Get sale ID
         
-        # Create sale items
-        for item_data in validated_items:
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                **item_data
-            )
-            db.session.add(sale_item)
-        
-        # Update inventory
-        update_inventory_after_sale(validated_items, branch_id, get_jwt_identity())
-        
-        # Handle loyalty points (if customer provided)
-        if customer:
-            loyalty_rate_setting = SystemSetting.query.filter_by(setting_key='LOYALTY_POINTS_RATE').first()
-            loyalty_rate = float(loyalty_rate_setting.setting_value) if loyalty_rate_setting else 1.0
+        # Everything below is direct statements plus in-memory changes to the customer
+        # row; hold those for the single flush at commit instead of re-scanning the
+        # session before every statement
+        with db.session.no_autoflush:
+            # Create sale items
+            SaleItem.bulk_create(db.session, sale.id, validated_items)
+            SalesDaily.record_sale(db.session, sale.id)
+            
+            # Update inventory
+            movement_rows = update_inventory_after_sale(validated_items, branch_id, get_jwt_identity())
+            if movement_rows:
+                db.session.execute(insert(StockMovement), movement_rows)
             
-            points_earned = int(total_amount * loyalty_rate)
-            if points_earned > 0:
-                customer.loyalty_points += points_earned
-                customer.total_purchases += total_amount
+            # Handle loyalty points (if customer provided)
+            if customer:
+                loyalty_rate = float(get_setting('LOYALTY_POINTS_RATE', 1.0))
                 
-                # Create loyalty transaction
-                loyalty_transaction = LoyaltyTransaction(
-                    customer_id=customer_id,
-                    sale_id=sale.id,
-                    transaction_type='EARNED',
-                    points=points_earned,
-                    description=f'Points earned from sale {sale.sale_number}'
-                )
-                db.session.add(loyalty_transaction)
+                points_earned = int(total_amount * loyalty_rate)
+                if points_earned > 0:
+                    customer.loyalty_points += points_earned
+                    customer.total_purchases = Customer.total_purchases + total_amount
+                    
+                    # Create loyalty transaction
+                    loyalty_transaction = LoyaltyTransaction(
+                        customer_id=customer_id,
+                        sale_id=sale.id,
+                        transaction_type='EARNED',
+                        points=points_earned,
+                        description=f'Points earned from sale {sale.sale_number}'
+                    )
+                    db.session.add(loyalty_transaction)
+                    customer.loyalty_transaction_count = Customer.loyalty_transaction_count + 1
         
         db.session.commit()
         
@@ -268,7 +318,8 @@ def refund_sale(sale_id):
         if not check_permission(['Admin', 'Cashier']):
             return jsonify({'error': 'Unauthorized. Admin or Cashier access required.'}), 403
         
-        sale = Sale.query.get(sale_id)
+        # notes is deferred on Sale but appended to below, so load it with the row
+        sale = db.session.get(Sale, sale_id, options=[undefer(Sale.notes)])
         if not sale:
             return jsonify({'error': 'Sale not found'}), 404
         
@@ -281,45 +332,48 @@ def refund_sale(sale_id):
         # Update sale status
         sale.payment_status = 'Refunded'
         sale.notes = f"{sale.notes or ''} | REFUNDED: {refund_reason}"
+        SalesDaily.record_sale(db.session, sale.id, sign=-1)
+        
+        # Restore inventory for every line with a single UPDATE
+        items = sale.items
+        quantities = {}
+        for item in items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        restocked = Inventory.adjust_existing_stock(sale.branch_id, quantities) if quantities else set()
+        
+        # Stock movements, inserted together in one statement
+        movement_rows = [
+            {
+                'product_id': item.product_id,
+                'branch_id': sale.branch_id,
+                'movement_type': 'IN',
+                'quantity': item.quantity,
+                'reference': f"REFUND-{sale.sale_number}",
+                'notes': f"Refund for sale {sale.sale_number}",
+                'created_by': get_jwt_identity()
+            }
+            for item in items
+            if item.product_id in restocked
+        ]
         
-        # Restore inventory
-        for item in sale.items:
-            inventory = Inventory.query.filter_by(
-                product_id=item.product_id,
-                branch_id=sale.branch_id
-            ).first()
-            
-            if inventory:
-                inventory.current_stock += item.quantity
-                inventory.last_updated = datetime.utcnow()
-                
-                # Create stock movement
-                movement = StockMovement(
-                    product_id=item.product_id,
-                    branch_id=sale.branch_id,
-                    movement_type='IN',
-                    quantity=item.quantity,
-                    reference=f"REFUND-{sale.sale_number}",
-                    notes=f"Refund for sale {sale.sale_number}",
-                    created_by=get_jwt_identity()
-                )
-                db.session.add(movement)
+        if movement_rows:
+            db.session.execute(insert(StockMovement), movement_rows)
         
         # Handle loyalty points refund
         if sale.customer_id:
-            customer = Customer.query.get(sale.customer_id)
+            customer = db.session.get(Customer, sale.customer_id)
             if customer:
                 # Find loyalty points earned from this sale
-                loyalty_transaction = LoyaltyTransaction.query.filter_by(
+                loyalty_transaction = db.session.scalars(select(LoyaltyTransaction).filter_by(
                     customer_id=sale.customer_id,
                     sale_id=sale.id,
                     transaction_type='EARNED'
-                ).first()
+                )).first()
                 
                 if loyalty_transaction:
                     # Deduct points
                     customer.loyalty_points -= loyalty_transaction.points
-                    customer.total_purchases -= sale.total_amount
+                    customer.total_purchases = Customer.total_purchases - sale.total_amount
                     
                     # Create refund loyalty transaction
                     refund_loyalty = LoyaltyTransaction(
@@ -330,6 +384,7 @@ def refund_sale(sale_id):
                         description=f'Points deducted for refunded sale {sale.sale_number}'
                     )
                     db.session.add(refund_loyalty)
+                    customer.loyalty_transaction_count = Customer.loyalty_transaction_count + 1
         
         db.session.commit()
         
@@ -349,32 +404,33 @@ def get_daily_summary():
         target_date = request.args.get('date', date.today().isoformat())
         branch_id = request.args.get('branch_id', type=int)
         
-        target_date_obj = datetime.strptime(target_date, '%Y-%m-%d').date()
+        target_date_obj = date.fromisoformat(target_date)
         
-        query = Sale.query.filter(
-            func.date(Sale.sale_date) == target_date_obj,
-            Sale.payment_status != 'Refunded'
-        )
+        # Per payment method totals from the daily rollup; no sale rows are loaded
+        query = db.session.query(
+            SalesDaily.payment_method,
+            func.sum(SalesDaily.sale_count),
+            func.sum(SalesDaily.total_revenue),
+            func.sum(SalesDaily.total_tax),
+            func.sum(SalesDaily.total_discount)
+        ).filter(SalesDaily.sale_day == target_date_obj)
         
         if branch_id:
-            query = query.filter(Sale.branch_id == branch_id)
+            query = query.filter(SalesDaily.branch_id == branch_id)
         
-        sales = query.all()
+        rows = query.group_by(SalesDaily.payment_method).having(func.sum(SalesDaily.sale_count) > 0).all()
         
         # Calculate summary
-        total_sales = len(sales)
-        total_revenue = sum(sale.total_amount for sale in sales)
-        total_tax = sum(sale.tax_amount for sale in sales)
-        total_discount = sum(sale.discount_amount for sale in sales)
+        total_sales = sum(count for _, count, _, _, _ in rows)
+        total_revenue = sum(revenue for _, _, revenue, _, _ in rows)
+        total_tax = sum(tax for _, _, _, tax, _ in rows)
+        total_discount = sum(discount for _, _, _, _, discount in rows)
         
         # Payment method breakdown
-        payment_methods = {}
-        for sale in sales:
-            method = sale.payment_method
-            if method not in payment_methods:
-                payment_methods[method] = {'count': 0, 'amount': 0}
-            payment_methods[method]['count'] += 1
-            payment_methods[method]['amount'] += sale.total_amount
+        payment_methods = {
+            method: {'count': count, 'amount': revenue}
+            for method, count, revenue, _, _ in rows
+        }
         
         return jsonify({
             'date': target_date,
@@ -382,13 +438,7 @@ def get_daily_summary():
             'total_revenue': float(total_revenue),
             'total_tax': float(total_tax),
             'total_discount': float(total_discount),
-            'payment_methods': {
-                method: {
-                    'count': data['count'],
-                    'amount': float(data['amount'])
-                }
-                for method, data in payment_methods.items()
-            }
+            'payment_methods': payment_methods
         }), 200
         
     except Exception as e:
@@ -398,25 +448,27 @@ def get_daily_summary():
 @jwt_required()
 def get_receipt(sale_id):
     try:
-        sale = Sale.query.get(sale_id)
+        # Customer and cashier ride along in the sale's own SELECT; items and
+        # their products follow in one IN query each
+        sale = db.session.get(Sale, sale_id, options=[
+            undefer(Sale.notes),
+            joinedload(Sale.customer),
+            joinedload(Sale.cashier),
+            selectinload(Sale.items).selectinload(SaleItem.product)
+        ])
         
         if not sale:
             return jsonify({'error': 'Sale not found'}), 404
         
         # Get company settings
-        company_name = SystemSetting.query.filter_by(setting_key='COMPANY_NAME').first()
-        company_address = SystemSetting.query.filter_by(setting_key='COMPANY_ADDRESS').first()
-        company_phone = SystemSetting.query.filter_by(setting_key='COMPANY_PHONE').first()
-        receipt_footer = SystemSetting.query.filter_by(setting_key='RECEIPT_FOOTER').first()
-        
         receipt_data = {
             'sale': sale.to_dict(),
             'items': [item.to_dict() for item in sale.items],
             'company': {
-                'name': company_name.setting_value if company_name else 'POS System',
-                'address': company_address.setting_value if company_address else '',
-                'phone': company_phone.setting_value if company_phone else '',
-                'footer': receipt_footer.setting_value if receipt_footer else 'Thank you!'
+                'name': get_setting('COMPANY_NAME', 'POS System'),
+                'address': get_setting('COMPANY_ADDRESS', ''),
+                'phone': get_setting('COMPANY_PHONE', ''),
+                'footer': get_setting('RECEIPT_FOOTER', 'Thank you!')
             }
         }
         
@@ -1,22 +1,22 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Branch, Category
-from src.models.sales import SystemSetting
+from src.models.user import db, Branch, Category, clear_lookup_cache
+from src.models.sales import SystemSetting, clear_settings_cache
+from src.routes.auth import current_role
 from datetime import datetime
+from sqlalchemy import select
 
 settings_bp = Blueprint('settings', __name__)
 
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
 
 @settings_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_settings():
     try:
-        settings = SystemSetting.query.all()
+        settings = db.session.scalars(select(SystemSetting)).all()
         
         settings_dict = {}
         for setting in settings:
@@ -35,7 +35,7 @@ def get_settings():
 @jwt_required()
 def get_setting(setting_key):
     try:
-        setting = SystemSetting.query.filter_by(setting_key=setting_key).first()
+        setting = db.session.scalars(select(SystemSetting).filter_by(setting_key=setting_key)).first()
         
         if not setting:
             return jsonify({'error': 'Setting not found'}), 404
@@ -59,7 +59,7 @@ def create_setting():
             return jsonify({'error': 'setting_key and setting_value are required'}), 400
         
         # Check if setting already exists
-        existing_setting = SystemSetting.query.filter_by(setting_key=data['setting_key']).first()
+        existing_setting = db.session.scalars(select(SystemSetting).filter_by(setting_key=data['setting_key'])).first()
         if existing_setting:
             return jsonify({'error': 'Setting already exists'}), 400
         
@@ -73,6 +73,7 @@ def create_setting():
         
         db.session.add(new_setting)
         db.session.commit()
+        clear_settings_cache()
         
         return jsonify({
             'message': 'Setting created successfully',
@@ -90,7 +91,7 @@ def update_setting(setting_key):
         if not check_permission(['Admin']):
             return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
         
-        setting = SystemSetting.query.filter_by(setting_key=setting_key).first()
+        setting = db.session.scalars(select(SystemSetting).filter_by(setting_key=setting_key)).first()
         if not setting:
             return jsonify({'error': 'Setting not found'}), 404
         
@@ -104,8 +105,8 @@ def update_setting(setting_key):
             setting.description = data['description']
         
         setting.updated_by = get_jwt_identity()
-        setting.updated_at = datetime.utcnow()
         db.session.commit()
+        clear_settings_cache()
         
         return jsonify({
             'message': 'Setting updated successfully',
@@ -123,12 +124,13 @@ def delete_setting(setting_key):
         if not check_permission(['Admin']):
             return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
         
-        setting = SystemSetting.query.filter_by(setting_key=setting_key).first()
+        setting = db.session.scalars(select(SystemSetting).filter_by(setting_key=setting_key)).first()
         if not setting:
             return jsonify({'error': 'Setting not found'}), 404
         
         db.session.delete(setting)
         db.session.commit()
+        clear_settings_cache()
         
         return jsonify({'message': 'Setting deleted successfully'}), 200
         
@@ -141,7 +143,7 @@ def delete_setting(setting_key):
 @jwt_required()
 def get_branches():
     try:
-        branches = Branch.query.filter_by(is_active=True).all()
+        branches = db.session.scalars(select(Branch).filter_by(is_active=True)).all()
         
         return jsonify({
             'branches': [branch.to_dict() for branch in branches]
@@ -164,7 +166,7 @@ def create_branch():
             return jsonify({'error': 'branch_name is required'}), 400
         
         # Check if branch name already exists
-        existing_branch = Branch.query.filter_by(branch_name=data['branch_name']).first()
+        existing_branch = db.session.scalars(select(Branch).filter_by(branch_name=data['branch_name'])).first()
         if existing_branch:
             return jsonify({'error': 'Branch name already exists'}), 400
         
@@ -179,6 +181,7 @@ def create_branch():
         
         db.session.add(new_branch)
         db.session.commit()
+        clear_lookup_cache()
         
         return jsonify({
             'message': 'Branch created successfully',
@@ -196,7 +199,7 @@ def update_branch(branch_id):
         if not check_permission(['Admin']):
             return jsonify({'error': 'Unauthorized. Admin access required.'}), 403
         
-        branch = Branch.query.get(branch_id)
+        branch = db.session.get(Branch, branch_id)
         if not branch:
             return jsonify({'error': 'Branch not found'}), 404
         
@@ -204,7 +207,7 @@ def update_branch(branch_id):
         
         # Check if branch name already exists (if changed)
         if data.get('branch_name') and data['branch_name'] != branch.branch_name:
-            existing_branch = Branch.query.filter_by(branch_name=data['branch_name']).first()
+            existing_branch = db.session.scalars(select(Branch).filter_by(branch_name=data['branch_name'])).first()
             if existing_branch:
                 return jsonify({'error': 'Branch name already exists'}), 400
         
@@ -216,6 +219,7 @@ def update_branch(branch_id):
                 setattr(branch, field, data[field])
         
         db.session.commit()
+        clear_lookup_cache()
         
         return jsonify({
             'message': 'Branch updated successfully',
@@ -231,7 +235,7 @@ def update_branch(branch_id):
 @jwt_required()
 def get_categories():
     try:
-        categories = Category.query.filter_by(is_active=True).all()
+        categories = db.session.scalars(select(Category).filter_by(is_active=True)).all()
         
         return jsonify({
             'categories': [category.to_dict() for category in categories]
@@ -254,13 +258,13 @@ def create_category():
             return jsonify({'error': 'category_name is required'}), 400
         
         # Check if category name already exists
-        existing_category = Category.query.filter_by(category_name=data['category_name']).first()
+        existing_category = db.session.scalars(select(Category).filter_by(category_name=data['category_name'])).first()
         if existing_category:
             return jsonify({'error': 'Category name already exists'}), 400
         
         # Validate parent category exists (if provided)
         if data.get('parent_category_id'):
-            parent_category = Category.query.get(data['parent_category_id'])
+            parent_category = db.session.get(Category, data['parent_category_id'])
             if not parent_category:
                 return jsonify({'error': 'Parent category not found'}), 404
         
@@ -274,6 +278,7 @@ def create_category():
         
         db.session.add(new_category)
         db.session.commit()
+        clear_lookup_cache()
         
         return jsonify({
             'message': 'Category created successfully',
@@ -291,7 +296,7 @@ def update_category(category_id):
         if not check_permission(['Admin', 'InventoryManager']):
             return jsonify({'error': 'Unauthorized. Admin or Inventory Manager access required.'}), 403
         
-        category = Category.query.get(category_id)
+        category = db.session.get(Category, category_id)
         if not category:
             return jsonify({'error': 'Category not found'}), 404
         
@@ -299,7 +304,7 @@ def update_category(category_id):
         
         # Check if category name already exists (if changed)
         if data.get('category_name') and data['category_name'] != category.category_name:
-            existing_category = Category.query.filter_by(category_name=data['category_name']).first()
+            existing_category = db.session.scalars(select(Category).filter_by(category_name=data['category_name'])).first()
             if existing_category:
                 return jsonify({'error': 'Category name already exists'}), 400
         
@@ -308,7 +313,7 @@ def update_category(category_id):
             if data['parent_category_id'] == category_id:
                 return jsonify({'error': 'Category cannot be its own parent'}), 400
             
-            parent_category = Category.query.get(data['parent_category_id'])
+            parent_category = db.session.get(Category, data['parent_category_id'])
             if not parent_category:
                 return jsonify({'error': 'Parent category not found'}), 404
         
@@ -320,6 +325,7 @@ def update_category(category_id):
                 setattr(category, field, data[field])
         
         db.session.commit()
+        clear_lookup_cache()
         
         return jsonify({
             'message': 'Category updated successfully',
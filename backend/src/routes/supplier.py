@@ -1,16 +1,31 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import db, User, Supplier
+from flask_jwt_extended import jwt_required
+from src.models.user import db, Supplier, Product, clear_lookup_cache
 from src.models.inventory import PurchaseOrder
-from datetime import datetime
+from src.routes.auth import current_role
+from src.response_cache import cached
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, undefer
+from src.pagination import page_args, page_count, encode_cursor, decode_cursor, before_cursor
 
 supplier_bp = Blueprint('supplier', __name__)
 
+# Shorter type-ahead queries match most of the table and can't use the trigram index
+MIN_SEARCH_LENGTH = 2
+
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
+
+def duplicate_error_response(error):
+    """Map a unique violation on supplier_name or email to a 400; re-raise anything else"""
+    message = str(error.orig)
+    if 'email' in message:
+        return jsonify({'error': 'Email already exists'}), 400
+    if 'supplier_name' in message:
+        return jsonify({'error': 'Supplier name already exists'}), 400
+    raise error
 
 @supplier_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -21,29 +36,42 @@ def get_suppliers():
         search = request.args.get('search', '')
         active_only = request.args.get('active_only', 'true').lower() == 'true'
         
+        page, per_page = page_args(page, per_page)
         query = Supplier.query
         
         if active_only:
             query = query.filter(Supplier.is_active == True)
         
         if search:
-            query = query.filter(
-                (Supplier.supplier_name.contains(search)) |
-                (Supplier.contact_person.contains(search)) |
-                (Supplier.email.contains(search)) |
-                (Supplier.phone.contains(search))
-            )
-        
-        suppliers = query.order_by(Supplier.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+            query = query.filter(Supplier.search_text.ilike(f'%{search}%'))
+        
+        # Keyset pages skip the COUNT(*) unless asked for; offset pages need it for 'pages'
+        cursor = request.args.get('cursor')
+        include_count = request.args.get('count', 'false' if cursor else 'true').lower() == 'true'
+        total = query.count() if include_count else None
+        
+        # Keyset pagination: ?cursor= continues after the last supplier seen
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            query = query.filter(before_cursor(Supplier.created_at, Supplier.id, position))
+            page = 1
+        
+        suppliers = Supplier.rows_as_dicts(
+            query.order_by(Supplier.created_at.desc(), Supplier.id.desc())
+            .limit(per_page).offset((page - 1) * per_page)
         )
+        last = suppliers[-1] if len(suppliers) == per_page else None
         
         return jsonify({
-            'suppliers': [supplier.to_dict() for supplier in suppliers.items],
-            'total': suppliers.total,
-            'pages': suppliers.pages,
+            'suppliers': suppliers,
+            'total': total,
+            'pages': page_count(total, per_page) if include_count else None,
             'current_page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'next_cursor': encode_cursor(last['created_at'], last['id']) if last else None
         }), 200
         
     except Exception as e:
@@ -53,18 +81,21 @@ def get_suppliers():
 @jwt_required()
 def get_supplier(supplier_id):
     try:
-        supplier = Supplier.query.get(supplier_id)
+        supplier = Supplier.query.options(undefer(Supplier.address)).get(supplier_id)
         
         if not supplier:
             return jsonify({'error': 'Supplier not found'}), 404
         
         # Get recent purchase orders
-        recent_orders = PurchaseOrder.query.filter_by(supplier_id=supplier_id).order_by(
+        recent_orders = PurchaseOrder.query.options(
+            joinedload(PurchaseOrder.branch),
+            joinedload(PurchaseOrder.user)
+        ).filter_by(supplier_id=supplier_id).order_by(
             PurchaseOrder.order_date.desc()
         ).limit(10).all()
         
         supplier_dict = supplier.to_dict()
-        supplier_dict['recent_orders'] = [order.to_dict() for order in recent_orders]
+        supplier_dict['recent_orders'] = [order.to_dict(include=('branch', 'user')) for order in recent_orders]
         
         return jsonify({'supplier': supplier_dict}), 200
         
@@ -84,17 +115,6 @@ def create_supplier():
         if not data.get('supplier_name'):
             return jsonify({'error': 'Supplier name is required'}), 400
         
-        # Check if supplier name already exists
-        existing_supplier = Supplier.query.filter_by(supplier_name=data['supplier_name']).first()
-        if existing_supplier:
-            return jsonify({'error': 'Supplier name already exists'}), 400
-        
-        # Check if email already exists (if provided)
-        if data.get('email'):
-            existing_email = Supplier.query.filter_by(email=data['email']).first()
-            if existing_email:
-                return jsonify({'error': 'Email already exists'}), 400
-        
         # Create new supplier
         new_supplier = Supplier(
             supplier_name=data['supplier_name'],
@@ -108,7 +128,13 @@ def create_supplier():
         )
         
         db.session.add(new_supplier)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            # supplier_name and email uniqueness is enforced by their unique indexes
+            db.session.rollback()
+            return duplicate_error_response(e)
+        clear_lookup_cache()
         
         return jsonify({
             'message': 'Supplier created successfully',
@@ -132,18 +158,6 @@ def update_supplier(supplier_id):
         
         data = request.get_json()
         
-        # Check if supplier name already exists (if changed)
-        if data.get('supplier_name') and data['supplier_name'] != supplier.supplier_name:
-            existing_supplier = Supplier.query.filter_by(supplier_name=data['supplier_name']).first()
-            if existing_supplier:
-                return jsonify({'error': 'Supplier name already exists'}), 400
-        
-        # Check if email already exists (if changed)
-        if data.get('email') and data['email'] != supplier.email:
-            existing_email = Supplier.query.filter_by(email=data['email']).first()
-            if existing_email:
-                return jsonify({'error': 'Email already exists'}), 400
-        
         # Update supplier fields
         updatable_fields = [
             'supplier_name', 'contact_person', 'email', 'phone', 'address',
@@ -154,8 +168,12 @@ def update_supplier(supplier_id):
             if field in data:
                 setattr(supplier, field, data[field])
         
-        supplier.updated_at = datetime.utcnow()
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            return duplicate_error_response(e)
+        clear_lookup_cache()
         
         return jsonify({
             'message': 'Supplier updated successfully',
@@ -177,17 +195,23 @@ def delete_supplier(supplier_id):
         if not supplier:
             return jsonify({'error': 'Supplier not found'}), 404
         
-        # Check if supplier has associated products or purchase orders
-        if supplier.products or supplier.purchase_orders:
+        # Check if supplier has associated products or purchase orders; one EXISTS
+        # query instead of loading both collections
+        has_records = db.session.scalar(select(or_(
+            select(Product.id).where(Product.supplier_id == supplier_id).exists(),
+            select(PurchaseOrder.id).where(PurchaseOrder.supplier_id == supplier_id).exists()
+        )))
+        if has_records:
             # Soft delete - just mark as inactive
             supplier.is_active = False
-            supplier.updated_at = datetime.utcnow()
             db.session.commit()
+            clear_lookup_cache()
             return jsonify({'message': 'Supplier deactivated successfully (has associated records)'}), 200
         else:
             # Hard delete if no associated records
             db.session.delete(supplier)
             db.session.commit()
+            clear_lookup_cache()
             return jsonify({'message': 'Supplier deleted successfully'}), 200
         
     except Exception as e:
@@ -196,25 +220,21 @@ def delete_supplier(supplier_id):
 
 @supplier_bp.route('/search', methods=['GET'])
 @jwt_required()
+@cached(ttl=5)
 def search_suppliers():
     try:
         query = request.args.get('q', '')
         limit = request.args.get('limit', 10, type=int)
         
-        if not query:
+        if len(query.strip()) < MIN_SEARCH_LENGTH:
             return jsonify({'suppliers': []}), 200
         
-        suppliers = Supplier.query.filter(
+        suppliers = Supplier.rows_as_dicts(Supplier.query.filter(
             Supplier.is_active == True,
-            (Supplier.supplier_name.contains(query)) |
-            (Supplier.contact_person.contains(query)) |
-            (Supplier.email.contains(query)) |
-            (Supplier.phone.contains(query))
-        ).limit(limit).all()
+            Supplier.search_text.ilike(f'%{query}%')
+        ).limit(limit))
         
-        return jsonify({
-            'suppliers': [supplier.to_dict() for supplier in suppliers]
-        }), 200
+        return jsonify({'suppliers': suppliers}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,15 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import db, User
-from datetime import datetime
+from src.routes.auth import current_role
+from sqlalchemy.exc import IntegrityError
+import orjson
+from src.pagination import page_args, page_count, encode_cursor, decode_cursor, before_cursor
 
 user_bp = Blueprint('user', __name__)
 
+ROLES = ('Admin', 'Cashier', 'InventoryManager')
+# The roles list never changes, so its response body is encoded once
+ROLES_JSON = orjson.dumps({
+    'roles': [{'value': role, 'label': role.replace('Manager', ' Manager')} for role in ROLES]
+})
+
 def check_permission(required_roles):
     """Check if current user has required role"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role in required_roles
+    return current_role() in required_roles
+
+def duplicate_error_response(error):
+    """Map a unique violation on username or email to a 400; re-raise anything else"""
+    message = str(error.orig)
+    if 'username' in message:
+        return jsonify({'error': 'Username already exists'}), 400
+    if 'email' in message:
+        return jsonify({'error': 'Email already exists'}), 400
+    raise error
 
 @user_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -24,32 +40,45 @@ def get_users():
         role = request.args.get('role')
         active_only = request.args.get('active_only', 'true').lower() == 'true'
         
+        page, per_page = page_args(page, per_page)
         query = User.query
         
         if active_only:
             query = query.filter(User.is_active == True)
         
         if search:
-            query = query.filter(
-                (User.username.contains(search)) |
-                (User.email.contains(search)) |
-                (User.first_name.contains(search)) |
-                (User.last_name.contains(search))
-            )
+            query = query.filter(User.search_text.ilike(f'%{search}%'))
         
         if role:
             query = query.filter(User.role == role)
         
-        users = query.order_by(User.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+        # Keyset pages skip the COUNT(*) unless asked for; offset pages need it for 'pages'
+        cursor = request.args.get('cursor')
+        include_count = request.args.get('count', 'false' if cursor else 'true').lower() == 'true'
+        total = query.count() if include_count else None
+        
+        # Keyset pagination: ?cursor= continues after the last user seen
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            query = query.filter(before_cursor(User.created_at, User.id, position))
+            page = 1
+        
+        users = User.rows_as_dicts(
+            query.order_by(User.created_at.desc(), User.id.desc())
+            .limit(per_page).offset((page - 1) * per_page)
         )
+        last = users[-1] if len(users) == per_page else None
         
         return jsonify({
-            'users': [user.to_dict() for user in users.items],
-            'total': users.total,
-            'pages': users.pages,
+            'users': users,
+            'total': total,
+            'pages': page_count(total, per_page) if include_count else None,
             'current_page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'next_cursor': encode_cursor(last['created_at'], last['id']) if last else None
         }), 200
         
     except Exception as e:
@@ -60,10 +89,9 @@ def get_users():
 def get_user(user_id):
     try:
         current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
         
         # Users can view their own profile, admins can view any profile
-        if current_user_id != user_id and current_user.role != 'Admin':
+        if current_user_id != user_id and current_role() != 'Admin':
             return jsonify({'error': 'Unauthorized'}), 403
         
         user = User.query.get(user_id)
@@ -81,10 +109,10 @@ def get_user(user_id):
 def update_user(user_id):
     try:
         current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        is_admin = current_role() == 'Admin'
         
         # Users can update their own profile, admins can update any profile
-        if current_user_id != user_id and current_user.role != 'Admin':
+        if current_user_id != user_id and not is_admin:
             return jsonify({'error': 'Unauthorized'}), 403
         
         user = User.query.get(user_id)
@@ -93,27 +121,21 @@ def update_user(user_id):
         
         data = request.get_json()
         
-        # Check if username or email already exists (if changed)
-        if data.get('username') and data['username'] != user.username:
-            existing_user = User.query.filter_by(username=data['username']).first()
-            if existing_user:
-                return jsonify({'error': 'Username already exists'}), 400
-        
-        if data.get('email') and data['email'] != user.email:
-            existing_user = User.query.filter_by(email=data['email']).first()
-            if existing_user:
-                return jsonify({'error': 'Email already exists'}), 400
-        
         # Only admins can change role and active status
-        if current_user.role != 'Admin':
+        if not is_admin:
             data.pop('role', None)
             data.pop('is_active', None)
         
         # Validate role if being changed
         if data.get('role'):
-            valid_roles = ['Admin', 'Cashier', 'InventoryManager']
-            if data['role'] not in valid_roles:
-                return jsonify({'error': f'Invalid role. Must be one of: {", ".join(valid_roles)}'}), 400
+            if data['role'] not in ROLES:
+                return jsonify({'error': f'Invalid role. Must be one of: {", ".join(ROLES)}'}), 400
+        
+        # Tokens already issued carry the old role, so a role or status change revokes them
+        access_changed = (
+            ('role' in data and data['role'] != user.role) or
+            ('is_active' in data and data['is_active'] != user.is_active)
+        )
         
         # Update user fields
         updatable_fields = ['username', 'email', 'first_name', 'last_name', 'role', 'is_active']
@@ -128,8 +150,15 @@ def update_user(user_id):
                 return jsonify({'error': 'Password must be at least 6 characters long'}), 400
             user.set_password(data['password'])
         
-        user.updated_at = datetime.utcnow()
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            # username and email uniqueness is enforced by their unique constraints
+            db.session.rollback()
+            return duplicate_error_response(e)
+        
+        if access_changed:
+            current_app.extensions['token_blocklist'].revoke_user(user_id)
         
         return jsonify({
             'message': 'User updated successfully',
@@ -159,8 +188,8 @@ def delete_user(user_id):
         
         # Soft delete - just mark as inactive
         user.is_active = False
-        user.updated_at = datetime.utcnow()
         db.session.commit()
+        current_app.extensions['token_blocklist'].revoke_user(user_id)
         
         return jsonify({'message': 'User deactivated successfully'}), 200
         
@@ -172,17 +201,7 @@ def delete_user(user_id):
 @jwt_required()
 def get_roles():
     try:
-        roles = ['Admin', 'Cashier', 'InventoryManager']
-        
-        return jsonify({
-            'roles': [
-                {
-                    'value': role,
-                    'label': role.replace('Manager', ' Manager')
-                }
-                for role in roles
-            ]
-        }), 200
+        return current_app.response_class(ROLES_JSON, mimetype='application/json'), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,27 @@
+from datetime import date
+from decimal import Decimal
+from typing import Annotated
+from pydantic import BaseModel, Field, field_validator
+
+class PurchaseOrderItemIn(BaseModel):
+    product_id: int
+    ordered_quantity: Annotated[int, Field(gt=0)]
+    unit_cost: Annotated[Decimal, Field(gt=0)]
+
+class PurchaseOrderIn(BaseModel):
+    supplier_id: int
+    branch_id: int
+    expected_delivery_date: date | None = None
+    notes: str = ''
+    items: Annotated[list[PurchaseOrderItemIn], Field(min_length=1)]
+
+    @field_validator('expected_delivery_date', mode='before')
+    @classmethod
+    def empty_date_is_none(cls, value):
+        return value or None
+
+def validation_error_message(error):
+    """First problem in a pydantic ValidationError as 'field: message'"""
+    first = error.errors()[0]
+    location = '.'.join(str(part) for part in first['loc'])
+    return f"{location}: {first['msg']}" if location else first['msg']
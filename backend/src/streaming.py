@@ -0,0 +1,26 @@
+from itertools import islice
+from flask import Response, current_app, stream_with_context
+
+BATCH_SIZE = 1000
+
+def stream_json(head, rows, tail=']}'):
+    """Stream head, then rows as comma-separated JSON objects, then tail
+
+    rows is an iterator of result rows whose columns are labelled with their
+    output keys, e.g. a yield_per result. The first batch is fetched before the
+    response starts, so a failing query still reaches the route's error
+    handling instead of ending a 200 with truncated JSON.
+    """
+    dumps = current_app.json.dumps
+    first_batch = list(islice(rows, BATCH_SIZE))
+
+    def generate():
+        yield head
+        batch, separator = first_batch, ''
+        while batch:
+            yield separator + dumps([dict(row._mapping) for row in batch])[1:-1]
+            separator = ','
+            batch = list(islice(rows, BATCH_SIZE))
+        yield tail
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
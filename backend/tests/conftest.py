@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The app reads its database URL at import time, so point it at a scratch file first
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file.name}'
+os.environ.pop('REDIS_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from src.main import app as flask_app, seed_database, TokenBlocklist
+from src.response_cache import ResponseCache
+from src.models.user import db, Branch, Category, Product
+from src.models.inventory import Inventory
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    # In-memory caches and revocations would otherwise carry over between tests
+    flask_app.extensions['response_cache'] = ResponseCache()
+    flask_app.extensions['token_blocklist'] = TokenBlocklist()
+    with flask_app.app_context():
+        db.drop_all()
+        seed_database()
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def admin_headers(app):
+    token = create_access_token(identity='1', additional_claims={'role': 'Admin'})
+    return {'Authorization': f'Bearer {token}'}
+
+@pytest.fixture
+def stocked_products(app):
+    """Two active products stocked at the seeded branch"""
+    branch = Branch.query.filter_by(branch_name='Main Store').one()
+    category = Category.query.first()
+    products = [
+        Product(
+            product_code=f'TST{index}', product_name=f'Test product {index}',
+            category_id=category.id, unit_of_measure='pcs',
+            cost_price=cost, selling_price=price
+        )
+        for index, (cost, price) in enumerate([(2, 5), (10, 15)], start=1)
+    ]
+    db.session.add_all(products)
+    db.session.flush()
+    db.session.add_all([
+        Inventory(product_id=product.id, branch_id=branch.id, current_stock=stock)
+        for product, stock in zip(products, [4, 3])
+    ])
+    db.session.commit()
+    return products
@@ -0,0 +1,24 @@
+import time
+from flask_jwt_extended import create_access_token
+from src.models.user import db, User
+
+def test_token_issued_right_after_revocation_is_accepted(client, admin_headers):
+    cashier = User(username='cashier1', email='cashier1@pos.com', first_name='Cash', last_name='Ier', role='Cashier')
+    cashier.set_password('cashier123')
+    db.session.add(cashier)
+    db.session.commit()
+    
+    # Issued a second before the role change, the old token must be revoked by it
+    old_token = create_access_token(
+        identity=str(cashier.id), additional_claims={'role': 'Cashier', 'iat': int(time.time()) - 1}
+    )
+    response = client.put(f'/api/users/{cashier.id}', headers=admin_headers, json={'role': 'InventoryManager'})
+    assert response.status_code == 200
+    
+    # Logging in again in the same second issues a token that is not revoked
+    new_token = create_access_token(identity=str(cashier.id), additional_claims={'role': 'InventoryManager'})
+    response = client.get('/api/auth/me', headers={'Authorization': f'Bearer {new_token}'})
+    assert response.status_code == 200
+    
+    response = client.get('/api/auth/me', headers={'Authorization': f'Bearer {old_token}'})
+    assert response.status_code == 401
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import CreateTable
+from src.migrations import create_index, upgrade_schema
+from src.models.user import Customer
+
+@pytest.fixture
+def connection():
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        yield connection
+
+def test_money_columns_become_cents(connection):
+    connection.execute(text(
+        'CREATE TABLE purchase_orders (id INTEGER PRIMARY KEY, sub_total NUMERIC(12, 2) NOT NULL, '
+        'tax_amount NUMERIC(12, 2), total_amount NUMERIC(12, 2) NOT NULL)'
+    ))
+    connection.execute(text('INSERT INTO purchase_orders VALUES (1, 12.5, 1.25, 13.75)'))
+    
+    upgrade_schema(connection)
+    upgrade_schema(connection)
+    
+    columns = {column['name'] for column in inspect(connection).get_columns('purchase_orders')}
+    assert columns == {'id', 'sub_total_cents', 'tax_amount_cents', 'total_amount_cents'}
+    assert connection.execute(text('SELECT sub_total_cents, tax_amount_cents, total_amount_cents FROM purchase_orders')).one() == (1250, 125, 1375)
+
+def test_po_line_total_becomes_generated(connection):
+    connection.execute(text(
+        'CREATE TABLE purchase_order_items (id INTEGER PRIMARY KEY, purchase_order_id INTEGER NOT NULL, '
+        'product_id INTEGER NOT NULL, ordered_quantity INTEGER NOT NULL, received_quantity INTEGER, '
+        'unit_cost NUMERIC(10, 2) NOT NULL, line_total NUMERIC(12, 2) NOT NULL)'
+    ))
+    connection.execute(text('INSERT INTO purchase_order_items VALUES (1, 1, 1, 3, 0, 2.5, 7.5)'))
+    
+    upgrade_schema(connection)
+    upgrade_schema(connection)
+    
+    columns = {column['name']: column for column in inspect(connection).get_columns('purchase_order_items')}
+    assert 'computed' in columns['line_total_cents']
+    assert connection.execute(text('SELECT unit_cost_cents, line_total_cents FROM purchase_order_items')).one() == (250, 750)
+    assert 'ix_poi_po' in {index['name'] for index in inspect(connection).get_indexes('purchase_order_items')}
+
+def test_customer_full_name_is_added(connection):
+    connection.execute(text(
+        'CREATE TABLE customers (id INTEGER PRIMARY KEY, customer_code VARCHAR(50) UNIQUE, '
+        'first_name VARCHAR(50) NOT NULL, last_name VARCHAR(50) NOT NULL, email VARCHAR(100), '
+        'phone VARCHAR(20), address VARCHAR(255), date_of_birth DATE, loyalty_points INTEGER, '
+        'total_purchases NUMERIC(12, 2), is_active BOOLEAN, created_at DATETIME, updated_at DATETIME)'
+    ))
+    connection.execute(text('CREATE TABLE sales (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customers (id))'))
+    connection.execute(text("INSERT INTO customers (id, first_name, last_name, email) VALUES (7, 'Ada', 'Lovelace', 'ada@example.com')"))
+    
+    upgrade_schema(connection)
+    upgrade_schema(connection)
+    
+    assert connection.execute(text('SELECT id, full_name, email FROM customers')).one() == (7, 'Ada Lovelace', 'ada@example.com')
+    assert inspect(connection).get_foreign_keys('sales')[0]['referred_table'] == 'customers'
+
+def test_loyalty_transaction_count_is_backfilled(connection):
+    connection.execute(text(
+        'CREATE TABLE customers (id INTEGER PRIMARY KEY, first_name VARCHAR(50) NOT NULL, '
+        'last_name VARCHAR(50) NOT NULL)'
+    ))
+    connection.execute(text('CREATE TABLE loyalty_transactions (id INTEGER PRIMARY KEY, customer_id INTEGER NOT NULL)'))
+    connection.execute(text("INSERT INTO customers VALUES (1, 'Ada', 'Lovelace'), (2, 'Alan', 'Turing')"))
+    connection.execute(text('INSERT INTO loyalty_transactions (customer_id) VALUES (1), (1), (1)'))
+    
+    upgrade_schema(connection)
+    upgrade_schema(connection)
+    
+    counts = connection.execute(text('SELECT id, loyalty_transaction_count FROM customers ORDER BY id')).all()
+    assert counts == [(1, 3), (2, 0)]
+
+def test_unique_index_reports_duplicate_rows(connection):
+    connection.execute(CreateTable(Customer.__table__))
+    connection.execute(text(
+        "INSERT INTO customers (id, first_name, last_name, email) VALUES "
+        "(1, 'Ada', 'Lovelace', 'ada@example.com'), (2, 'Ada', 'L', 'ADA@example.com'), "
+        "(3, 'No', 'Email', ''), (4, 'No', 'Email', '')"
+    ))
+    index = next(index for index in Customer.__table__.indexes if index.name == 'ix_customers_email_lower')
+    
+    with pytest.raises(RuntimeError, match=r"ix_customers_email_lower.*id 1: \('ada@example.com',\); id 2"):
+        create_index(connection, index)
+    
+    connection.execute(text("UPDATE customers SET email = 'ada.l@example.com' WHERE id = 2"))
+    create_index(connection, index)
+    create_index(connection, index)
+
+def test_sale_item_unit_cost_is_backfilled(connection):
+    connection.execute(text('CREATE TABLE products (id INTEGER PRIMARY KEY, cost_price NUMERIC(10, 2))'))
+    connection.execute(text(
+        'CREATE TABLE sale_items (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, quantity INTEGER NOT NULL)'
+    ))
+    connection.execute(text('INSERT INTO products VALUES (1, 2.5)'))
+    connection.execute(text('INSERT INTO sale_items VALUES (1, 1, 3)'))
+    
+    upgrade_schema(connection)
+    upgrade_schema(connection)
+    
+    assert connection.execute(text('SELECT unit_cost FROM sale_items')).scalar_one() == 2.5
@@ -0,0 +1,98 @@
+from sqlalchemy import text
+from src.models.user import db
+from src.models.inventory import StockMovement
+
+def test_inventory_valuation_page_has_detail_rows(client, admin_headers, stocked_products):
+    response = client.get('/api/reports/inventory-valuation?page=1', headers=admin_headers)
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['summary']['total_items'] == 2
+    assert data['summary']['total_cost_value'] == 38
+    assert [row['product_code'] for row in data['inventory']] == ['TST1', 'TST2']
+    assert data['inventory'][0]['branch_name'] == 'Main Store'
+    assert data['inventory'][0]['retail_value'] == 20
+
+def test_inventory_valuation_streams_detail_rows(client, admin_headers, stocked_products):
+    response = client.get('/api/reports/inventory-valuation', headers=admin_headers)
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['summary']['total_retail_value'] == 65
+    assert sorted(row['product_code'] for row in data['inventory']) == ['TST1', 'TST2']
+
+def test_inventory_valuation_csv_export(client, admin_headers, stocked_products):
+    response = client.get('/api/reports/inventory-valuation?format=csv', headers=admin_headers)
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'inventory-valuation.csv' in response.headers['Content-Disposition']
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == (
+        'product_id,product_name,product_code,branch_id,branch_name,'
+        'current_stock,cost_price,selling_price,cost_value,retail_value'
+    )
+    rows = [line.split(',') for line in lines[1:]]
+    assert sorted(row[2] for row in rows) == ['TST1', 'TST2']
+    assert {row[4] for row in rows} == {'Main Store'}
+
+def test_inventory_valuation_stream_query_error_is_500(client, admin_headers, stocked_products):
+    # The summary doesn't touch branches, so only the streamed detail query fails
+    db.session.execute(text('DROP TABLE branches'))
+    db.session.commit()
+    
+    for url in ('/api/reports/inventory-valuation', '/api/reports/inventory-valuation?format=csv'):
+        response = client.get(url, headers=admin_headers)
+        assert response.status_code == 500
+        assert 'branches' in response.get_json()['error']
+
+def test_stock_movements_report_unit_cost_in_currency_units(client, admin_headers, stocked_products):
+    db.session.add_all([
+        StockMovement(
+            product_id=stocked_products[0].id, branch_id=1, movement_type='IN',
+            quantity=5, unit_cost=2.5, reference='PO-1', created_by=1
+        ),
+        StockMovement(
+            product_id=stocked_products[1].id, branch_id=1, movement_type='ADJUSTMENT',
+            quantity=-1, unit_cost=0, reference='COUNT-1', created_by=1
+        ),
+    ])
+    db.session.commit()
+    
+    data = client.get('/api/reports/stock-movements', headers=admin_headers).get_json()
+    unit_costs = {movement['reference']: movement['unit_cost'] for movement in data['movements']}
+    assert unit_costs == {'PO-1': 2.5, 'COUNT-1': None}
+    assert data['summary']['IN'] == {'count': 1, 'total_quantity': 5}
+    
+    lines = client.get('/api/reports/stock-movements?format=csv', headers=admin_headers).get_data(as_text=True).splitlines()
+    header = lines[0].split(',')
+    rows = {row[header.index('reference')]: row for row in (line.split(',') for line in lines[1:])}
+    assert rows['PO-1'][header.index('unit_cost')] == '2.5'
+    assert rows['COUNT-1'][header.index('unit_cost')] == ''
+
+def test_stock_movements_report_answers_304_until_a_movement_is_added(client, admin_headers, stocked_products):
+    response = client.get('/api/reports/stock-movements?summary_only=true', headers=admin_headers)
+    etag = response.headers['ETag']
+    
+    headers = dict(admin_headers, **{'If-None-Match': etag})
+    response = client.get('/api/reports/stock-movements?summary_only=true', headers=headers)
+    assert response.status_code == 304
+    
+    db.session.add(StockMovement(
+        product_id=stocked_products[0].id, branch_id=1, movement_type='IN', quantity=1, created_by=1
+    ))
+    db.session.commit()
+    response = client.get('/api/reports/stock-movements?summary_only=true', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['total_movements'] == 1
+
+def test_profit_loss_is_served_from_the_response_cache(client, admin_headers):
+    first = client.get('/api/reports/profit-loss', headers=admin_headers)
+    second = client.get('/api/reports/profit-loss', headers=admin_headers)
+    
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert first.get_json() == second.get_json()
+    
+    headers = dict(admin_headers, **{'If-None-Match': second.headers['ETag']})
+    assert client.get('/api/reports/profit-loss', headers=headers).status_code == 304
+    assert 'X-Cache' not in client.get('/api/reports/profit-loss?nocache=1', headers=admin_headers).headers
@@ -0,0 +1,51 @@
+from src.models.user import db
+from src.models.sales import SalesDaily
+
+def sell(client, headers, products, quantities):
+    response = client.post('/api/sales/', headers=headers, json={
+        'branch_id': 1,
+        'payment_method': 'Cash',
+        'total_amount': 0,
+        'items': [
+            {'product_id': product.id, 'quantity': quantity}
+            for product, quantity in zip(products, quantities)
+        ]
+    })
+    assert response.status_code == 201
+    return response.get_json()['sale']
+
+def daily_buckets():
+    db.session.expire_all()
+    return [
+        (bucket.sale_count, float(bucket.total_revenue), float(bucket.total_cogs))
+        for bucket in SalesDaily.query.all()
+    ]
+
+def test_sales_daily_follows_sales_and_refunds(client, admin_headers, stocked_products):
+    first = sell(client, admin_headers, stocked_products, [2, 1])
+    sell(client, admin_headers, stocked_products[:1], [1])
+    
+    # Both sales tax at the products' 0% default: 2*5 + 15 and 5
+    assert daily_buckets() == [(2, 30.0, 16.0)]
+    
+    response = client.post(f"/api/sales/{first['id']}/refund", headers=admin_headers, json={})
+    assert response.status_code == 200
+    assert daily_buckets() == [(1, 5.0, 2.0)]
+
+def test_refund_after_cost_change_takes_out_the_sold_cost(client, admin_headers, stocked_products):
+    sale = sell(client, admin_headers, stocked_products[:1], [1])
+    
+    stocked_products[0].cost_price = 4
+    db.session.commit()
+    
+    response = client.post(f"/api/sales/{sale['id']}/refund", headers=admin_headers, json={})
+    assert response.status_code == 200
+    assert daily_buckets() == [(0, 0.0, 0.0)]
+    
+    report = client.get('/api/reports/profit-loss?nocache=1', headers=admin_headers).get_json()
+    assert report['profit']['gross_profit'] == 0
+    
+    # Rebuilding from the sales table agrees with the incremental updates
+    SalesDaily.rebuild(db.session)
+    db.session.commit()
+    assert daily_buckets() == []